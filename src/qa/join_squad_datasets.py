@@ -1,38 +1,248 @@
-# This script join two SQuAD datasets
+# This script join several SQuAD datasets
 import argparse
+import hashlib
 import random
 import logging
 import json
 import os
+import shutil
+import sys
+import tempfile
+
+# Use the faster orjson decoder when installed. The output is always encoded
+# with the standard library to keep it identical to json.dump
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# The SQuAD files are (de)compressed on the fly when they end with .gz or .zst,
+# with the I/O module of the translate-retrieve pipeline
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'tar', 'src', 'retrieve'))
+from translate_retrieve_io import file_compression, open_file
 
 logging.basicConfig(level=logging.INFO)
 
-def join(squad_file1, squad_file2):
-    with open(squad_file1) as sf1:
-        squad1 = json.load(sf1)
-    
-    with open(squad_file2) as sf2:
-        squad2 = json.load(sf2)
-    if squad1['version'] == squad2['version']:
-        squad_joint = {"version": squad1['version'], "data":[]}
-        data_squad1, data_squad2 = squad1['data'], squad2['data']
-        squad_joint["data"] = data_squad1 + data_squad2
-
-        # Shuffle the data with fixed seed
-        random.seed(10)
-        random.shuffle(squad_joint["data"])
-        squad_joint_filename = os.path.join(os.path.dirname(squad_file2),
-                                            'joint_{}_{}.json'.format(os.path.basename(squad_file1),
-                                                                 os.path.basename(squad_file2)))
-        with open(squad_joint_filename, 'w') as sjf:
-            json.dump(squad_joint, sjf)
-    else:
-        raise ValueError('The two SQUAD file must have the same version!')
+# Number of characters read at once when streaming a SQuAD file
+READ_SIZE = 1 << 20
+# Approximate size of a shuffling bucket, that is, of the articles held in memory at once
+BUCKET_SIZE = 64 << 20
+# Typical compression ratio of the SQuAD files, used to estimate the size of the compressed ones
+COMPRESSION_RATIO = 5
+
+
+# 64-bit hash used to detect duplicated questions and paragraphs without storing them
+def hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf8'), digest_size=8).digest(), 'little')
+
+
+# Size of the content of a file, estimated for the compressed files
+def content_size(filename):
+    return os.path.getsize(filename) * (COMPRESSION_RATIO if file_compression(filename) else 1)
+
+
+# Incremental JSON decoder over a text file that decodes one value at a time
+class JSONStreamReader:
+    def __init__(self, fn, read_size=READ_SIZE):
+        self.fn = fn
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        data = self.fn.read(self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Invalid SQuAD file {}: expected {!r}'.format(getattr(self.fn, 'name', ''), char))
+        self.pos += 1
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A value ending with the buffer might be truncated (e.g. a number)
+                if end < len(self.buffer) or self.eof or not self._fill():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+
+# Stream the articles of a SQuAD file one at a time.
+# The other top-level fields (i.e. the version) are stored in header
+def iter_squad_articles(squad_file, header):
+    with open_file(squad_file) as sf:
+        reader = JSONStreamReader(sf)
+        reader.expect('{')
+        while reader.peek() != '}':
+            key = reader.decode()
+            reader.expect(':')
+            if key == 'data':
+                reader.expect('[')
+                while reader.peek() != ']':
+                    yield reader.decode()
+                    if reader.peek() == ',':
+                        reader.expect(',')
+                reader.expect(']')
+            else:
+                header[key] = reader.decode()
+            if reader.peek() == ',':
+                reader.expect(',')
+        reader.expect('}')
+
+
+# Remove the paragraphs already seen and the questions with an id already seen.
+# Return None when nothing is left in the article
+def deduplicate_article(article, paragraphs_seen, questions_seen, stats):
+    paragraphs = []
+    for paragraph in article['paragraphs']:
+        paragraph_hash = hash64(json.dumps(paragraph, sort_keys=True))
+        if paragraph_hash in paragraphs_seen:
+            stats['duplicated paragraphs'] += 1
+            continue
+        paragraphs_seen.add(paragraph_hash)
+
+        qas = []
+        for qa in paragraph['qas']:
+            question_hash = hash64(qa['id'])
+            if question_hash in questions_seen:
+                stats['duplicated questions'] += 1
+                continue
+            questions_seen.add(question_hash)
+            qas.append(qa)
+        if qas:
+            paragraph['qas'] = qas
+            paragraphs.append(paragraph)
+
+    if paragraphs:
+        article['paragraphs'] = paragraphs
+        return article
+    return None
+
+
+# Write the articles to SQuAD files holding at most shard_size bytes of articles each
+# (a single file when shard_size is None). The output is identical to json.dump
+class ShardedSquadWriter:
+    def __init__(self, output_file, version, shard_size=None):
+        self.output_file = output_file
+        self.version = version
+        self.shard_size = shard_size
+        self.shard_files = []
+        self.fn = None
+        self.size = 0
+
+    def _open_shard(self):
+        self._close_shard()
+        if self.shard_size:
+            compression = file_compression(self.output_file)
+            root, ext = os.path.splitext(self.output_file[:len(self.output_file) - len(compression)])
+            ext += compression
+            shard_file = '{}_{:03d}{}'.format(root, len(self.shard_files), ext)
+        else:
+            shard_file = self.output_file
+        self.shard_files.append(shard_file)
+        self.fn = open_file(shard_file, 'w')
+        self.fn.write('{{"version": {}, "data": ['.format(json.dumps(self.version)))
+        self.size = 0
+
+    def write(self, article):
+        article_json = json.dumps(article)
+        if self.fn is None or (self.shard_size and self.size and self.size + len(article_json) > self.shard_size):
+            self._open_shard()
+        elif self.size:
+            self.fn.write(', ')
+        self.fn.write(article_json)
+        self.size += len(article_json)
+
+    def _close_shard(self):
+        if self.fn is not None:
+            self.fn.write(']}')
+            self.fn.close()
+            self.fn = None
+
+    def close(self):
+        if not self.shard_files:
+            self._open_shard()
+        self._close_shard()
+
+
+def join(squad_files, output_file=None, seed=10, shard_size=None, bucket_size=BUCKET_SIZE):
+    if output_file is None:
+        output_file = os.path.join(os.path.dirname(squad_files[-1]),
+                                   'joint_{}.json'.format('_'.join(os.path.basename(f) for f in squad_files)))
+
+    # Shuffle the data with fixed seed without holding all the articles in memory:
+    # the articles are first spread over random buckets written to disk,
+    # then every bucket is loaded and shuffled on its own
+    rng = random.Random(seed)
+    num_buckets = max(1, sum(content_size(f) for f in squad_files) // bucket_size)
+    bucket_dir = tempfile.mkdtemp(prefix='join_squad_', dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        bucket_files = [os.path.join(bucket_dir, 'bucket_{}'.format(i)) for i in range(num_buckets)]
+        buckets = [open(bucket_file, 'w') for bucket_file in bucket_files]
+        version = None
+        paragraphs_seen, questions_seen = set(), set()
+        stats = {'articles': 0, 'duplicated paragraphs': 0, 'duplicated questions': 0}
+        for squad_file in squad_files:
+            header = {}
+            for article in iter_squad_articles(squad_file, header):
+                article = deduplicate_article(article, paragraphs_seen, questions_seen, stats)
+                if article is not None:
+                    stats['articles'] += 1
+                    buckets[rng.randrange(num_buckets)].write(json.dumps(article) + '\n')
+            if version is None:
+                version = header.get('version')
+            elif header.get('version') != version:
+                raise ValueError('All the SQUAD files must have the same version!')
+        for bucket in buckets:
+            bucket.close()
+        logging.info('{} articles joined, {} duplicated paragraphs and {} duplicated questions removed'.format(
+            stats['articles'], stats['duplicated paragraphs'], stats['duplicated questions']))
+
+        writer = ShardedSquadWriter(output_file, version, shard_size)
+        for bucket_file in bucket_files:
+            with open(bucket_file, 'rb') as bf:
+                articles = [json_loads(line) for line in bf]
+            rng.shuffle(articles)
+            for article in articles:
+                writer.write(article)
+        writer.close()
+    finally:
+        shutil.rmtree(bucket_dir)
+    return writer.shard_files
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('squad_file1', type=str, help='SQUAD file number 1')
-    parser.add_argument('squad_file2', type=str, help='SQUAD file number 2')
+    parser.add_argument('squad_files', type=str, nargs='+', help='SQUAD files to join')
+    parser.add_argument('-output', type=str, default=None,
+                        help='joint SQUAD file (default: joint_<file1>_..._<fileN>.json '
+                             'in the directory of the last file), compressed when it ends with .gz or .zst')
+    parser.add_argument('-seed', type=int, default=10, help='seed of the shuffling')
+    parser.add_argument('-shard_size', type=int, default=None,
+                        help='write shards of at most this size in MB instead of one file')
+    parser.add_argument('-bucket_size', type=int, default=BUCKET_SIZE >> 20,
+                        help='size in MB of the shuffling buckets held in memory')
     args = parser.parse_args()
-    logging.info('Join {} and {}'.format(args.squad_file1, args.squad_file2))
-    join(args.squad_file1, args.squad_file2)
\ No newline at end of file
+    logging.info('Join {}'.format(' and '.join(args.squad_files)))
+    shard_size = args.shard_size << 20 if args.shard_size else None
+    output_files = join(args.squad_files, args.output, args.seed, shard_size, args.bucket_size << 20)
+    logging.info('Joint SQUAD written to {}'.format(', '.join(output_files)))
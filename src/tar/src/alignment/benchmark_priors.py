@@ -0,0 +1,129 @@
+# This script compares the startup time and peak memory (RSS) of the alignment priors loading:
+#  - text: eflomal parses the whole text priors file
+#  - binary: the compiled priors (compile_priors.py) are memory-mapped, the priors of the words of the sentences
+#    to align are extracted and eflomal parses them
+# Each measure runs in a new process. Without priors, synthetic priors and sentences are generated
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import compile_priors
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+# Parse text priors as eflomal's align.py does
+def parse_text_priors(priors_file):
+    lex, ferf, ferr, hmmf, hmmr = [], [], [], {}, {}
+    with open(priors_file, encoding='utf8') as fn:
+        for line in fn:
+            fields = line.rstrip('\n').split('\t')
+            alpha = float(fields[-1])
+            if fields[0] == 'LEX' and len(fields) == 4:
+                lex.append((fields[1], fields[2], alpha))
+            elif fields[0] == 'HMMF' and len(fields) == 3:
+                hmmf[int(fields[1])] = alpha
+            elif fields[0] == 'HMMR' and len(fields) == 3:
+                hmmr[int(fields[1])] = alpha
+            elif fields[0] == 'FERF' and len(fields) == 4:
+                ferf.append((fields[1], int(fields[2]), alpha))
+            elif fields[0] == 'FERR' and len(fields) == 4:
+                ferr.append((fields[1], int(fields[2]), alpha))
+    return lex, ferf, ferr, hmmf, hmmr
+
+
+def peak_rss_mb():
+    with open('/proc/self/status') as fn:
+        for line in fn:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+# Zipfian sampling of word indexes
+def zipf_words(rng, prefix, vocab_size, num_words):
+    weights = [1 / (rank + 1) for rank in range(vocab_size)]
+    return ['{}{}'.format(prefix, index) for index in rng.choices(range(vocab_size), weights, k=num_words)]
+
+
+def write_synthetic(priors_file, source_file, target_file, num_lex_entries, vocab_size, num_sentences, seed=1):
+    rng = random.Random(seed)
+    with open(priors_file, 'w', encoding='utf8') as fn:
+        sources = zipf_words(rng, 's', vocab_size, num_lex_entries)
+        targets = zipf_words(rng, 't', vocab_size, num_lex_entries)
+        for source, target in sorted(set(zip(sources, targets))):
+            fn.write('LEX\t{}\t{}\t{}\n'.format(source, target, rng.randint(1, 1000)))
+        for name in ['HMMF', 'HMMR']:
+            for jump in range(-100, 101):
+                fn.write('{}\t{}\t{}\n'.format(name, jump, rng.randint(1, 100000)))
+        for name, prefix in [('FERF', 's'), ('FERR', 't')]:
+            for index in range(vocab_size):
+                for fertility in range(3):
+                    fn.write('{}\t{}{}\t{}\t{}\n'.format(name, prefix, index, fertility, rng.randint(1, 100)))
+    for file, prefix in [(source_file, 's'), (target_file, 't')]:
+        with open(file, 'w', encoding='utf8') as fn:
+            for _ in range(num_sentences):
+                fn.write(' '.join(zipf_words(rng, prefix, vocab_size, 20)) + '\n')
+
+
+# Load the priors (in this process) and print the time and peak RSS
+def measure(mode, priors, source_file, target_file):
+    start = time.time()
+    if mode == 'text':
+        lex = parse_text_priors(priors)[0]
+    else:
+        with tempfile.NamedTemporaryFile(suffix='.priors') as tmp:
+            compile_priors.extract_priors(priors, source_file, target_file, tmp.name)
+            lex = parse_text_priors(tmp.name)[0]
+    print('{:.3f}\t{:.1f}\t{}'.format(time.time() - start, peak_rss_mb(), len(lex)))
+
+
+def run_measure(mode, priors, source_file, target_file):
+    output = subprocess.run([sys.executable, os.path.realpath(__file__), '-measure', mode, '-priors', priors,
+                             '-source', source_file, '-target', target_file],
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    load_time, rss, lex_entries = output.split()
+    return float(load_time), float(rss), int(lex_entries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-priors', type=str, default=None, help='text priors (default: synthetic priors)')
+    parser.add_argument('-source', type=str, default=None, help='tokenized source sentences to align')
+    parser.add_argument('-target', type=str, default=None, help='tokenized target sentences to align')
+    parser.add_argument('-max_lex_entries', type=int, default=None, help='prune the compiled priors to this size')
+    parser.add_argument('-synthetic_lex_entries', type=int, default=5000000,
+                        help='number of lexical priors of the synthetic priors')
+    parser.add_argument('-synthetic_vocab_size', type=int, default=200000,
+                        help='vocabulary size of the synthetic priors')
+    parser.add_argument('-synthetic_sentences', type=int, default=2000,
+                        help='number of synthetic sentence pairs to align')
+    parser.add_argument('-measure', type=str, default=None, choices=['text', 'binary'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.priors, args.source, args.target)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        priors, source_file, target_file = args.priors, args.source, args.target
+        if priors is None:
+            priors = os.path.join(tmp_dir, 'align.priors')
+            source_file = os.path.join(tmp_dir, 'source')
+            target_file = os.path.join(tmp_dir, 'target')
+            print('Generate synthetic priors...', file=sys.stderr)
+            write_synthetic(priors, source_file, target_file, args.synthetic_lex_entries,
+                            args.synthetic_vocab_size, args.synthetic_sentences)
+        priors_bin = os.path.join(tmp_dir, 'align.priors.bin')
+        start = time.time()
+        compile_priors.compile_priors(priors, priors_bin, max_lex_entries=args.max_lex_entries)
+        print('Compiled the priors in {:.1f} s'.format(time.time() - start))
+
+        print('Priors\tSize (MB)\tStartup (s)\tPeak RSS (MB)\tLexical priors loaded')
+        for mode, file in [('text', priors), ('binary', priors_bin)]:
+            load_time, rss, lex_entries = run_measure(mode, file, source_file, target_file)
+            print('{}\t{:.1f}\t{:.3f}\t{:.1f}\t{}'.format(mode, os.path.getsize(file) / (1 << 20), load_time, rss,
+                                                          lex_entries))
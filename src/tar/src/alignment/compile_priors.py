@@ -0,0 +1,297 @@
+# Compile the eflomal alignment priors (the text file written by makepriors.py) into a binary file that is
+# memory-mapped instead of parsed, and extract from it the priors of the words of the sentences to align.
+#
+# The text priors hold millions of lines (LEX <source word> <target word> <count>, HMMF/HMMR <jump> <count>,
+# FERF <source word> <fertility> <count> and FERR <target word> <fertility> <count>) and eflomal parses all of them
+# at every alignment, although it only uses the ones of the words of the aligned sentences. The binary priors hold:
+#  - the source and target vocabularies: the sorted 64-bit hashes of the words (the id of a word is the position
+#    of its hash) and the words themselves (a string table of UTF-8 bytes and the offsets of each word)
+#  - the packed arrays of each type of priors, sorted by word id
+# The ids of the words to align are found by binary search of their hashes, and their priors are read in slices
+# of the arrays: the extraction only touches the pages it needs.
+#
+#   compile_priors.py compile -priors align.priors.en-es -output align.priors.en-es.bin [-max_lex_entries N]
+#   compile_priors.py extract -priors_bin align.priors.en-es.bin -source <file> -target <file> -output <file>
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import uuid
+from array import array
+import numpy as np
+
+MAGIC = b'TARPRI01'
+# Alignment of the arrays in the binary file
+ALIGNMENT = 64
+
+# Arrays of the binary priors by type: word ids (or jumps), fertilities and counts
+LEX_ARRAYS = ['lex_src', 'lex_tgt', 'lex_count']
+FER_ARRAYS = {'FERF': ['ferf_src', 'ferf_fertility', 'ferf_count'],
+              'FERR': ['ferr_tgt', 'ferr_fertility', 'ferr_count']}
+HMM_ARRAYS = {'HMMF': ['hmmf_jump', 'hmmf_count'], 'HMMR': ['hmmr_jump', 'hmmr_count']}
+
+
+def word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word, digest_size=8).digest(), 'little')
+
+
+class Vocabulary:
+    def __init__(self):
+        self.ids = {}
+
+    def id(self, word):
+        word_id = self.ids.get(word)
+        if word_id is None:
+            word_id = self.ids[word] = len(self.ids)
+        return word_id
+
+    # Sort the words by hash. Return the arrays of the vocabulary and the new id of each word
+    def compile(self, name, used=None):
+        words = list(self.ids)
+        if used is not None:
+            words = [word for word, used_word in zip(words, used) if used_word]
+        hashes = np.array([word_hash(word) for word in words], dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        if len(hashes) > 1 and np.any(hashes[1:] == hashes[:-1]):
+            raise ValueError('Hash collision in the {} vocabulary'.format(name))
+        words = [words[i] for i in order]
+        offsets = np.zeros(len(words) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(word) for word in words])
+        new_ids = np.full(len(self.ids), -1, dtype=np.int64)
+        old_ids = np.array([self.ids[word] for word in words], dtype=np.int64)
+        new_ids[old_ids] = np.arange(len(words))
+        return ({'{}_hashes'.format(name): hashes, '{}_offsets'.format(name): offsets,
+                 '{}_strings'.format(name): np.frombuffer(b''.join(words), dtype=np.uint8)}, new_ids)
+
+
+# Parse the text priors in one pass
+def read_text_priors(priors_file):
+    src_vocab, tgt_vocab = Vocabulary(), Vocabulary()
+    lex = [array('I'), array('I'), array('f')]
+    fer = {name: [array('I'), array('i'), array('f')] for name in FER_ARRAYS}
+    hmm = {name: [array('i'), array('f')] for name in HMM_ARRAYS}
+    with open(priors_file, 'rb') as fn:
+        for line_number, line in enumerate(fn, 1):
+            fields = line.rstrip(b'\n').split(b'\t')
+            if fields[0] == b'LEX' and len(fields) == 4:
+                lex[0].append(src_vocab.id(fields[1]))
+                lex[1].append(tgt_vocab.id(fields[2]))
+                lex[2].append(float(fields[3]))
+            elif fields[0] in (b'FERF', b'FERR') and len(fields) == 4:
+                vocab = src_vocab if fields[0] == b'FERF' else tgt_vocab
+                arrays = fer[fields[0].decode()]
+                arrays[0].append(vocab.id(fields[1]))
+                arrays[1].append(int(fields[2]))
+                arrays[2].append(float(fields[3]))
+            elif fields[0] in (b'HMMF', b'HMMR') and len(fields) == 3:
+                arrays = hmm[fields[0].decode()]
+                arrays[0].append(int(fields[1]))
+                arrays[1].append(float(fields[2]))
+            elif line.strip():
+                raise ValueError('Invalid priors line {} in {}: {!r}'.format(line_number, priors_file, line))
+    as_numpy = lambda values: np.frombuffer(values, dtype=values.typecode) if len(values) else \
+        np.zeros(0, dtype=values.typecode)
+    return (src_vocab, tgt_vocab, [as_numpy(values) for values in lex],
+            {name: [as_numpy(values) for values in arrays] for name, arrays in fer.items()},
+            {name: [as_numpy(values) for values in arrays] for name, arrays in hmm.items()})
+
+
+# Keep the entries with at least min_count and at most the max_lex_entries lexical priors with the highest counts
+def prune(lex, fer, min_count=0.0, max_lex_entries=None):
+    keep = lex[2] >= min_count
+    if max_lex_entries is not None and np.count_nonzero(keep) > max_lex_entries:
+        counts = np.where(keep, lex[2], -np.inf)
+        top = np.argpartition(-counts, max_lex_entries - 1)[:max_lex_entries]
+        keep = np.zeros(len(counts), dtype=bool)
+        keep[top] = True
+    lex = [values[keep] for values in lex]
+    fer = {name: [values[arrays[2] >= min_count] for values in arrays] for name, arrays in fer.items()}
+    return lex, fer
+
+
+def write_binary_priors(arrays, output_file):
+    header = {}
+    offset = 0
+    for name, values in arrays.items():
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        header[name] = {'dtype': values.dtype.str, 'count': len(values), 'offset': offset}
+        offset += values.nbytes
+    header_bytes = json.dumps(header).encode('utf8')
+    data_start = (len(MAGIC) + 8 + len(header_bytes) + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    # A unique temporary file, removed when the writing fails, so that concurrent or failed runs leave no partial file
+    tmp_file = '{}.{}.tmp'.format(output_file, uuid.uuid4().hex)
+    try:
+        with open(tmp_file, 'wb') as fn:
+            fn.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+            for name, values in arrays.items():
+                fn.seek(data_start + header[name]['offset'])
+                fn.write(values.tobytes())
+            # The empty arrays at the end have their offset at the end of the file
+            fn.truncate(data_start + offset)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def compile_priors(priors_file, output_file, min_count=0.0, max_lex_entries=None):
+    src_vocab, tgt_vocab, lex, fer, hmm = read_text_priors(priors_file)
+    num_lex = len(lex[0])
+    lex, fer = prune(lex, fer, min_count, max_lex_entries)
+
+    # Only the words of the priors kept are written
+    src_used = np.zeros(len(src_vocab.ids), dtype=bool)
+    src_used[lex[0]] = True
+    src_used[fer['FERF'][0]] = True
+    tgt_used = np.zeros(len(tgt_vocab.ids), dtype=bool)
+    tgt_used[lex[1]] = True
+    tgt_used[fer['FERR'][0]] = True
+    arrays, src_ids = src_vocab.compile('src', src_used)
+    tgt_arrays, tgt_ids = tgt_vocab.compile('tgt', tgt_used)
+    arrays.update(tgt_arrays)
+
+    lex = [src_ids[lex[0]].astype(np.uint32), tgt_ids[lex[1]].astype(np.uint32), lex[2]]
+    order = np.lexsort((lex[1], lex[0]))
+    arrays.update({name: values[order] for name, values in zip(LEX_ARRAYS, lex)})
+    for name, ids in (('FERF', src_ids), ('FERR', tgt_ids)):
+        values = [ids[fer[name][0]].astype(np.uint32), fer[name][1], fer[name][2]]
+        order = np.lexsort((values[1], values[0]))
+        arrays.update({array_name: array_values[order] for array_name, array_values in zip(FER_ARRAYS[name], values)})
+    for name, values in hmm.items():
+        arrays.update(dict(zip(HMM_ARRAYS[name], values)))
+    write_binary_priors(arrays, output_file)
+    return {'lex_entries': num_lex, 'lex_entries_kept': len(lex[0]),
+            'src_words': int(src_used.sum()), 'tgt_words': int(tgt_used.sum())}
+
+
+# Memory-mapped binary priors
+class BinaryPriors:
+    def __init__(self, priors_bin):
+        self.fn = open(priors_bin, 'rb')
+        self.mm = mmap.mmap(self.fn.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a binary priors file'.format(priors_bin))
+        header_size, = struct.unpack('<Q', self.mm[len(MAGIC):len(MAGIC) + 8])
+        header = json.loads(self.mm[len(MAGIC) + 8:len(MAGIC) + 8 + header_size].decode('utf8'))
+        data_start = (len(MAGIC) + 8 + header_size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        self.arrays = {name: np.frombuffer(self.mm, dtype=info['dtype'], count=info['count'],
+                                           offset=data_start + info['offset'])
+                       for name, info in header.items()}
+
+    def close(self):
+        # The views on the memory map must be released before it is closed
+        self.arrays = {}
+        self.mm.close()
+        self.fn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def word(self, name, word_id):
+        offsets = self.arrays['{}_offsets'.format(name)]
+        return self.arrays['{}_strings'.format(name)][int(offsets[word_id]):int(offsets[word_id + 1])].tobytes()
+
+    # Ids of the words in the vocabulary. Return a dictionary from id to word
+    def lookup(self, name, words):
+        words = list(words)
+        hashes = self.arrays['{}_hashes'.format(name)]
+        query = np.array([word_hash(word) for word in words], dtype=np.uint64)
+        positions = np.searchsorted(hashes, query)
+        ids = {}
+        for word, position, word_hash_value in zip(words, positions, query):
+            if position < len(hashes) and hashes[position] == word_hash_value and self.word(name, position) == word:
+                ids[int(position)] = word
+        return ids
+
+    # Indexes of the entries of the arrays sorted by word id with one of the ids
+    @staticmethod
+    def entries(sorted_ids, ids):
+        ids = np.array(sorted(ids), dtype=sorted_ids.dtype)
+        starts = np.searchsorted(sorted_ids, ids, side='left')
+        ends = np.searchsorted(sorted_ids, ids, side='right')
+        if not len(ids):
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+
+    # Write the text priors of the source and target words
+    def extract(self, src_words, tgt_words, fn):
+        src_ids = self.lookup('src', src_words)
+        tgt_ids = self.lookup('tgt', tgt_words)
+        stats = {'src_words': len(src_ids), 'tgt_words': len(tgt_ids)}
+
+        lex_src, lex_tgt, lex_count = (self.arrays[name] for name in LEX_ARRAYS)
+        entries = self.entries(lex_src, src_ids)
+        entries = entries[np.isin(lex_tgt[entries], np.array(list(tgt_ids), dtype=lex_tgt.dtype))]
+        # The counts are written with the precision of float32
+        fn.write(b''.join(b'LEX\t%s\t%s\t%.9g\n' % (src_ids[src_id], tgt_ids[tgt_id], count)
+                          for src_id, tgt_id, count in zip(lex_src[entries].tolist(), lex_tgt[entries].tolist(),
+                                                           lex_count[entries].tolist())))
+        stats['lex_entries'] = len(entries)
+
+        for name in HMM_ARRAYS:
+            jumps, counts = (self.arrays[array_name] for array_name in HMM_ARRAYS[name])
+            fn.write(b''.join(b'%s\t%d\t%.9g\n' % (name.encode(), jump, count)
+                              for jump, count in zip(jumps.tolist(), counts.tolist())))
+        for name, ids in (('FERF', src_ids), ('FERR', tgt_ids)):
+            word_ids, fertilities, counts = (self.arrays[array_name] for array_name in FER_ARRAYS[name])
+            entries = self.entries(word_ids, ids)
+            fn.write(b''.join(b'%s\t%s\t%d\t%.9g\n' % (name.encode(), ids[word_id], fertility, count)
+                              for word_id, fertility, count in zip(word_ids[entries].tolist(),
+                                                                   fertilities[entries].tolist(),
+                                                                   counts[entries].tolist())))
+        return stats
+
+
+# Words of a tokenized text file
+def file_words(file):
+    words = set()
+    with open(file, 'rb') as fn:
+        for line in fn:
+            words.update(line.split())
+    return words
+
+
+def extract_priors(priors_bin, source_file, target_file, output_file):
+    with BinaryPriors(priors_bin) as priors, open(output_file, 'wb') as fn:
+        return priors.extract(file_words(source_file), file_words(target_file), fn)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    compile_parser = subparsers.add_parser('compile', help='compile the text priors of makepriors.py')
+    compile_parser.add_argument('-priors', type=str, required=True, help='text priors')
+    compile_parser.add_argument('-output', type=str, required=True, help='binary priors')
+    compile_parser.add_argument('-min_count', type=float, default=0.0,
+                                help='prune the lexical and fertility priors with a lower count')
+    compile_parser.add_argument('-max_lex_entries', type=int, default=None,
+                                help='keep this number of lexical priors at most, the ones with the highest counts '
+                                     '(12 bytes each)')
+    extract_parser = subparsers.add_parser('extract', help='extract the text priors of the words of a corpus')
+    extract_parser.add_argument('-priors_bin', type=str, required=True, help='binary priors')
+    extract_parser.add_argument('-source', type=str, required=True, help='tokenized source sentences')
+    extract_parser.add_argument('-target', type=str, required=True, help='tokenized target sentences')
+    extract_parser.add_argument('-output', type=str, required=True, help='text priors of their words')
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.command == 'compile':
+        stats = compile_priors(args.priors, args.output, args.min_count, args.max_lex_entries)
+        print('Compiled {} into {} ({:.1f} MB): {} of {} lexical priors, {} source and {} target words in {:.1f} s'
+              .format(args.priors, args.output, os.path.getsize(args.output) / (1 << 20), stats['lex_entries_kept'],
+                      stats['lex_entries'], stats['src_words'], stats['tgt_words'], time.time() - start),
+              file=sys.stderr)
+    elif args.command == 'extract':
+        stats = extract_priors(args.priors_bin, args.source, args.target, args.output)
+        print('Extracted {} lexical priors of {} source and {} target words in {:.2f} s'.format(
+            stats['lex_entries'], stats['src_words'], stats['tgt_words'], time.time() - start), file=sys.stderr)
+    else:
+        parser.print_help()
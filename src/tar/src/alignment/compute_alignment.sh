@@ -5,12 +5,47 @@ source ${ENV_DIR}/bin/activate
 
 # Compute the source-translation alignment with eflomal
 # The text should be tokenized before computing alignment.
+# With - as source and target files, the sentence pairs are read from the standard input,
+# one "source<TAB>target" pair per line. With - as output file, the alignment is written
+# to the standard output. The log messages are written to the standard error
 FILE_SRC=$1
 LANG_SRC=$2
 FILE_TGT=$3
 LANG_TGT=$4
 ALIGNMENT_TYPE=$5
 OUTPUT_FILE=$6
+# Alignment profile trading quality for speed:
+#   fast: HMM model (2) with half the sampling iterations, forward alignment
+#   balanced: fertility model (3), forward alignment
+#   quality: fertility model (3), forward and reverse alignments symmetrized with grow-diag-final-and
+# Only the alignment directions needed by the alignment type (forward, reverse or symmetric,
+# by default the one of the profile) are computed
+ALIGNMENT_PROFILE=${7:-balanced}
+
+case ${ALIGNMENT_PROFILE} in
+  fast)
+    MODEL=2
+    LENGTH=0.5
+    DEFAULT_ALIGNMENT_TYPE=forward
+    ;;
+  balanced)
+    MODEL=3
+    LENGTH=1.0
+    DEFAULT_ALIGNMENT_TYPE=forward
+    ;;
+  quality)
+    MODEL=3
+    LENGTH=1.0
+    DEFAULT_ALIGNMENT_TYPE=symmetric
+    ;;
+  *)
+    echo "Unknown alignment profile: ${ALIGNMENT_PROFILE}" >&2
+    exit 1
+    ;;
+esac
+if [[ -z "${ALIGNMENT_TYPE}" || "${ALIGNMENT_TYPE}" == "default" ]]; then
+  ALIGNMENT_TYPE=${DEFAULT_ALIGNMENT_TYPE}
+fi
 
 export LC_ALL=en_US.UTF8
 
@@ -20,34 +55,84 @@ EFLOMAL_DIR=${TOOLS_DIR}/eflomal
 FASTALIGN_DIR=${TOOLS_DIR}/fast_align
 MOSES_DIR=${TOOLS_DIR}/mosesdecoder
 
-echo 'Compute alignments...'
+if [[ "${OUTPUT_FILE}" == "-" ]]; then
+  OUTPUT_FILE=/dev/stdout
+fi
+
+# eflomal samples the alignment of the whole corpus at once: the streamed pairs are collected first
+PAIRS_SRC=""
+if [[ "${FILE_SRC}" == "-" && "${FILE_TGT}" == "-" ]]; then
+  PAIRS_SRC=$(mktemp)
+  PAIRS_TGT=$(mktemp)
+  awk -F '\t' -v src=${PAIRS_SRC} -v tgt=${PAIRS_TGT} '{print $1 > src; print $2 > tgt}'
+  FILE_SRC=${PAIRS_SRC}
+  FILE_TGT=${PAIRS_TGT}
+fi
+
+echo "Compute ${ALIGNMENT_TYPE} alignments with the ${ALIGNMENT_PROFILE} profile..." >&2
 FWD_ALIGN=$(mktemp)
 REV_ALIGN=$(mktemp)
 SYM_ALIGN=$(mktemp)
 
+if [[ "$ALIGNMENT_TYPE" == "forward" ]]; then
+  DIRECTION_ARGS="-f ${FWD_ALIGN}"
+elif [[ "$ALIGNMENT_TYPE" == "reverse" ]]; then
+  DIRECTION_ARGS="-r ${REV_ALIGN}"
+else
+  DIRECTION_ARGS="-f ${FWD_ALIGN} -r ${REV_ALIGN}"
+fi
+
 PRIORS_DIR=${SCRIPT_DIR}/../alignment/data
+# Priors of the language pair (train_priors.py). With compiled priors (compile_priors.py), only the priors of the
+# words of the sentences to align are extracted and parsed by eflomal instead of the whole text priors.
+# The priors can also be given already extracted in PRIORS_FILE (e.g. by the online translator, which keeps the
+# compiled priors loaded)
+PRIORS_TEXT=${PRIORS_DIR}/align.priors.${LANG_SRC}-${LANG_TGT}
+PRIORS_BIN=${PRIORS_TEXT}.bin
+PRIORS_EXTRACTED=""
+if [[ -n "${PRIORS_FILE}" ]]; then
+  echo "Using the priors ${PRIORS_FILE}" >&2
+elif [[ -f "${PRIORS_BIN}" ]]; then
+  PRIORS_EXTRACTED=$(mktemp)
+  python ${SCRIPT_DIR}/compile_priors.py extract \
+        -priors_bin ${PRIORS_BIN} \
+        -source ${FILE_SRC} \
+        -target ${FILE_TGT} \
+        -output ${PRIORS_EXTRACTED} >&2
+  PRIORS_FILE=${PRIORS_EXTRACTED}
+elif [[ -f "${PRIORS_TEXT}" ]]; then
+  PRIORS_FILE=${PRIORS_TEXT}
+else
+  echo "No priors ${PRIORS_TEXT} or ${PRIORS_BIN}" >&2
+  exit 1
+fi
 python ${EFLOMAL_DIR}/align.py \
         -s ${FILE_SRC} \
         -t ${FILE_TGT} \
-        --priors ${PRIORS_DIR}/align.priors*\
-        --model 3 \
-        -f ${FWD_ALIGN} \
-        -r ${REV_ALIGN} \
-        -v --overwrite
-
-echo "Symmetrize alignments..."
-${FASTALIGN_DIR}/build/atools \
-    -c grow-diag-final-and \
-    -i ${FWD_ALIGN} \
-    -j ${REV_ALIGN} \
-    > ${SYM_ALIGN}
+        --priors ${PRIORS_FILE} \
+        --model ${MODEL} \
+        --length ${LENGTH} \
+        ${DIRECTION_ARGS} \
+        -v --overwrite >&2
 
 if [[ "$ALIGNMENT_TYPE" == "forward" ]]; then
   cp ${FWD_ALIGN} ${OUTPUT_FILE}
 elif [[ "$ALIGNMENT_TYPE" == "reverse" ]]; then
   cp ${REV_ALIGN} ${OUTPUT_FILE}
 elif [[ "$ALIGNMENT_TYPE" == "symmetric" ]]; then
+  echo "Symmetrize alignments..." >&2
+  ${FASTALIGN_DIR}/build/atools \
+      -c grow-diag-final-and \
+      -i ${FWD_ALIGN} \
+      -j ${REV_ALIGN} \
+      > ${SYM_ALIGN}
   cp ${SYM_ALIGN} ${OUTPUT_FILE}
 fi
 
-rm ${FWD_ALIGN} ${REV_ALIGN} ${SYM_ALIGN}
\ No newline at end of file
+rm ${FWD_ALIGN} ${REV_ALIGN} ${SYM_ALIGN}
+if [[ -n "${PAIRS_SRC}" ]]; then
+  rm ${PAIRS_SRC} ${PAIRS_TGT}
+fi
+if [[ -n "${PRIORS_EXTRACTED}" ]]; then
+  rm ${PRIORS_EXTRACTED}
+fi
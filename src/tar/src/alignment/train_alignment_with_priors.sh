@@ -30,34 +30,26 @@ mkdir -p ${DATA_DIR}
 export LC_ALL=en_US.UTF8
 
 echo 'Train the alignment model...'
-FWD_ALIGN=$(mktemp)
-REV_ALIGN=$(mktemp)
-SYM_ALIGN=$(mktemp)
-
-# Tokenize and convert into FastAlign format
-FILE_SRC_TGT_TOK=$(mktemp)
-paste -d '|' ${FILE_SRC} ${FILE_TGT} \
-    | sed 's/|/ ||| /g' \
-    > ${FILE_SRC_TGT_TOK}
-
-python ${EFLOMAL_DIR}/align.py \
-    -i ${FILE_SRC_TGT_TOK} \
-    --model 3 \
-    -f ${FWD_ALIGN} \
-    -r ${REV_ALIGN} \
-    -v --overwrite
-
-cp ${FWD_ALIGN} ${DATA_DIR}/align.fwd."${LANG_SRC}"-"${LANG_TGT}"
-cp ${REV_ALIGN} ${DATA_DIR}/align.rev."${LANG_SRC}"-"${LANG_TGT}"
-
-python ${EFLOMAL_DIR}/makepriors.py \
-    -i ${FILE_SRC_TGT_TOK} \
-    -f ${DATA_DIR}/align.fwd."${LANG_SRC}"-"${LANG_TGT}" \
-    -r ${DATA_DIR}/align.rev."${LANG_SRC}"-"${LANG_TGT}" \
-    --priors ${DATA_DIR}/align.priors."${LANG_SRC}"-"${LANG_TGT}" \
-
-
-rm ${FWD_ALIGN} ${REV_ALIGN} ${SYM_ALIGN} ${FILE_SRC_TGT_TOK}
+# The corpus is split into NUM_SHARDS shards (NUM_WORKERS by default) aligned and turned into priors
+# by NUM_WORKERS processes (all the cores by default); the priors of the shards are then merged.
+# The shards trained already are skipped when the training is run again
+NUM_WORKERS=${NUM_WORKERS:-$(nproc)}
+python ${SCRIPT_DIR}/train_priors.py \
+    -source ${FILE_SRC} \
+    -target ${FILE_TGT} \
+    -lang_src ${LANG_SRC} \
+    -lang_tgt ${LANG_TGT} \
+    -data_dir ${DATA_DIR} \
+    -eflomal_dir ${EFLOMAL_DIR} \
+    -num_workers ${NUM_WORKERS} \
+    ${NUM_SHARDS:+-num_shards ${NUM_SHARDS}}
+
+# Compile the priors into the binary format memory-mapped by compute_alignment.sh
+# (prune them with MAX_LEX_ENTRIES, the number of lexical priors kept)
+python ${SCRIPT_DIR}/compile_priors.py compile \
+    -priors ${DATA_DIR}/align.priors."${LANG_SRC}"-"${LANG_TGT}" \
+    -output ${DATA_DIR}/align.priors."${LANG_SRC}"-"${LANG_TGT}".bin \
+    ${MAX_LEX_ENTRIES:+-max_lex_entries ${MAX_LEX_ENTRIES}}
 
 
 
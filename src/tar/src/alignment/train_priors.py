@@ -0,0 +1,162 @@
+# This script trains the eflomal alignment priors on a tokenized parallel corpus split into shards:
+# each shard is aligned (forward and reverse, eflomal align.py) and its priors computed (eflomal makepriors.py)
+# in parallel processes, then the priors of the shards are merged by summing their counts, and the alignments
+# concatenated in order. A shard is skipped when its content is the same as in its last completed training
+# (recorded in a stamp file) and its outputs exist, so that an interrupted training resumes at the shards
+# left to train. With a single shard, the priors are the ones of a training on the whole corpus
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+EFLOMAL_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'tools', 'eflomal')
+MODEL = 3
+# Size in bytes of the blocks read to count the lines and copy the files
+BLOCK_SIZE = 1 << 20
+# Precision of the merged counts
+COUNT_FORMAT = '{:.10g}'
+
+
+def count_lines(file):
+    num_lines = 0
+    last_block = b''
+    with open(file, 'rb') as fn:
+        for block in iter(lambda: fn.read(BLOCK_SIZE), b''):
+            num_lines += block.count(b'\n')
+            last_block = block
+    # The last line might not end with a line break
+    return num_lines + int(bool(last_block) and not last_block.endswith(b'\n'))
+
+
+# Split the corpus into num_shards shards of consecutive sentence pairs in the input format of eflomal
+# (source ||| target). Return the shard files and the hash of their content
+def split_corpus(source_file, target_file, shards_dir, num_shards):
+    num_lines = count_lines(source_file)
+    num_shards = max(1, min(num_shards, num_lines))
+    shards = []
+    with open(source_file, encoding='utf8') as sf, open(target_file, encoding='utf8') as tf:
+        for shard_index in range(num_shards):
+            shard_file = os.path.join(shards_dir, 'shard_{:03d}'.format(shard_index))
+            sha = hashlib.sha1()
+            with open(shard_file, 'w', encoding='utf8') as fn:
+                for _ in range(num_lines * (shard_index + 1) // num_shards - num_lines * shard_index // num_shards):
+                    source_line, target_line = next(sf), tf.readline()
+                    if not target_line:
+                        raise ValueError('{} has fewer lines than {}'.format(target_file, source_file))
+                    pair = '{} ||| {}\n'.format(source_line.strip(), target_line.strip())
+                    sha.update(pair.encode('utf8'))
+                    fn.write(pair)
+            shards.append((shard_file, sha.hexdigest()))
+        if tf.readline():
+            raise ValueError('{} has more lines than {}'.format(target_file, source_file))
+    return shards
+
+
+def shard_outputs(shard_file):
+    return {'fwd': shard_file + '.fwd', 'rev': shard_file + '.rev', 'priors': shard_file + '.priors'}
+
+
+# Align a shard and compute its priors, unless done already with the same content. Return the training time
+def train_shard(task):
+    shard_file, shard_hash, eflomal_dir, model = task
+    outputs = shard_outputs(shard_file)
+    stamp_file = shard_file + '.done'
+    stamp = {'input': shard_hash, 'model': model}
+    if os.path.isfile(stamp_file) and all(os.path.isfile(output) for output in outputs.values()):
+        with open(stamp_file) as fn:
+            if json.load(fn) == stamp:
+                return None
+
+    start = time.time()
+    # Remove the stamp first so that an interrupted shard is trained again
+    if os.path.isfile(stamp_file):
+        os.remove(stamp_file)
+    subprocess.run([sys.executable, os.path.join(eflomal_dir, 'align.py'), '-i', shard_file, '--model', str(model),
+                    '-f', outputs['fwd'], '-r', outputs['rev'], '--overwrite'], check=True)
+    subprocess.run([sys.executable, os.path.join(eflomal_dir, 'makepriors.py'), '-i', shard_file,
+                    '-f', outputs['fwd'], '-r', outputs['rev'], '--priors', outputs['priors']], check=True)
+    with open(stamp_file, 'w') as fn:
+        json.dump(stamp, fn)
+    return time.time() - start
+
+
+# Merge the priors of the shards by summing the counts of each entry (LEX source target, HMMF/HMMR jump,
+# FERF/FERR word fertility)
+def merge_priors(priors_files, output_file):
+    counts = defaultdict(float)
+    for priors_file in priors_files:
+        with open(priors_file, encoding='utf8') as fn:
+            for line in fn:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) > 1:
+                    counts[tuple(fields[:-1])] += float(fields[-1])
+    tmp_file = '{}.{}.tmp'.format(output_file, uuid.uuid4().hex)
+    try:
+        with open(tmp_file, 'w', encoding='utf8') as fn:
+            for key, count in counts.items():
+                fn.write('{}\t{}\n'.format('\t'.join(key), COUNT_FORMAT.format(count)))
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return len(counts)
+
+
+def concatenate(files, output_file):
+    with open(output_file, 'wb') as fout:
+        for file in files:
+            with open(file, 'rb') as fin:
+                shutil.copyfileobj(fin, fout, BLOCK_SIZE)
+
+
+def train_priors(source_file, target_file, lang_src, lang_tgt, data_dir, eflomal_dir=EFLOMAL_DIR,
+                 num_workers=os.cpu_count(), num_shards=None, model=MODEL):
+    shards_dir = os.path.join(data_dir, 'shards.{}-{}'.format(lang_src, lang_tgt))
+    os.makedirs(shards_dir, exist_ok=True)
+    start = time.time()
+    shards = split_corpus(source_file, target_file, shards_dir, num_shards or num_workers)
+    print('Split the corpus into {} shards in {:.1f} s'.format(len(shards), time.time() - start))
+
+    tasks = [(shard_file, shard_hash, eflomal_dir, model) for shard_file, shard_hash in shards]
+    with ThreadPool(num_workers) as pool:
+        for (shard_file, _), shard_time in zip(shards, pool.imap(train_shard, tasks)):
+            if shard_time is None:
+                print('Skip {}: trained already'.format(os.path.basename(shard_file)))
+            else:
+                print('Trained {} in {:.1f} s'.format(os.path.basename(shard_file), shard_time))
+
+    outputs = [shard_outputs(shard_file) for shard_file, _ in shards]
+    suffix = '{}-{}'.format(lang_src, lang_tgt)
+    for direction in ['fwd', 'rev']:
+        concatenate([output[direction] for output in outputs],
+                    os.path.join(data_dir, 'align.{}.{}'.format(direction, suffix)))
+    priors_file = os.path.join(data_dir, 'align.priors.{}'.format(suffix))
+    num_entries = merge_priors([output['priors'] for output in outputs], priors_file)
+    print('Merged {} priors into {} in {:.1f} s in total'.format(num_entries, priors_file, time.time() - start))
+    return priors_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-source', type=str, required=True, help='tokenized source sentences')
+    parser.add_argument('-target', type=str, required=True, help='tokenized target sentences')
+    parser.add_argument('-lang_src', type=str, default='en', help='source language')
+    parser.add_argument('-lang_tgt', type=str, default='es', help='target language')
+    parser.add_argument('-data_dir', type=str, default=os.path.join(SCRIPT_DIR, 'data'),
+                        help='output directory of the alignments and the priors')
+    parser.add_argument('-eflomal_dir', type=str, default=EFLOMAL_DIR, help='directory of eflomal')
+    parser.add_argument('-num_workers', type=int, default=os.cpu_count(), help='number of shards trained in parallel')
+    parser.add_argument('-num_shards', type=int, default=None, help='number of shards (default: num_workers)')
+    parser.add_argument('-model', type=int, default=MODEL, help='eflomal model (1: IBM1, 2: HMM, 3: fertility)')
+    args = parser.parse_args()
+
+    train_priors(args.source, args.target, args.lang_src, args.lang_tgt, args.data_dir, args.eflomal_dir,
+                 args.num_workers, args.num_shards, args.model)
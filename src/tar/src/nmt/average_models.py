@@ -0,0 +1,114 @@
+# This script averages the parameters of OpenNMT-py model checkpoints with bounded memory.
+# The checkpoints are loaded one at a time, memory-mapped when torch supports it (torch >= 2.1),
+# so that only the model and generator tensors are read and the optimizer state is never loaded.
+# The mean is accumulated parameter by parameter in a single copy of the model: the peak memory
+# is about one model plus the parameters of the checkpoint being read, whatever the number of checkpoints
+import argparse
+import glob
+import inspect
+import os
+import re
+import resource
+import sys
+import uuid
+import torch
+
+STEP_REGEX = re.compile(r'_step_(\d+)\.pt$')
+
+
+# Step of a checkpoint from its name (<prefix>_step_<step>.pt)
+def checkpoint_step(checkpoint):
+    match = STEP_REGEX.search(checkpoint)
+    return int(match.group(1)) if match else -1
+
+
+# Expand the checkpoint files and glob patterns, sorted by step, and keep the last k
+def select_checkpoints(patterns, last_k=None):
+    checkpoints = sorted(set(checkpoint for pattern in patterns for checkpoint in glob.glob(pattern)),
+                         key=lambda checkpoint: (checkpoint_step(checkpoint), checkpoint))
+    if last_k:
+        checkpoints = checkpoints[-last_k:]
+    return checkpoints
+
+
+def load_checkpoint(checkpoint, mmap=True):
+    parameters = inspect.signature(torch.load).parameters
+    kwargs = {'map_location': 'cpu'}
+    if mmap and 'mmap' in parameters:
+        kwargs['mmap'] = True
+    # The checkpoints also store the vocabulary and the training options, which are not plain tensors
+    if 'weights_only' in parameters:
+        kwargs['weights_only'] = False
+    return torch.load(checkpoint, **kwargs)
+
+
+# Update the running mean of a state dict with the i-th (0-based) state dict
+def update_mean(mean, state_dict, i):
+    for name, parameter in state_dict.items():
+        if i == 0:
+            mean[name] = parameter.detach().to(torch.float32, copy=True)
+        else:
+            mean[name].mul_(i / (i + 1)).add_(parameter.to(torch.float32), alpha=1 / (i + 1))
+
+
+def average_models(checkpoints, output, mmap=True):
+    mean_model, mean_generator = {}, {}
+    dtypes = {}
+    vocab, opt = None, None
+    for i, checkpoint in enumerate(checkpoints):
+        print('Average {}'.format(checkpoint), file=sys.stderr)
+        model = load_checkpoint(checkpoint, mmap)
+        if i == 0:
+            vocab, opt = model['vocab'], model['opt']
+            dtypes = {name: parameter.dtype
+                      for state_dict in (model['model'], model['generator'])
+                      for name, parameter in state_dict.items()}
+        update_mean(mean_model, model['model'], i)
+        update_mean(mean_generator, model['generator'], i)
+        # Release the checkpoint (and unmap its file) before loading the next one
+        del model
+
+    # Store the parameters with the precision of the checkpoints
+    for mean in (mean_model, mean_generator):
+        for name, parameter in mean.items():
+            mean[name] = parameter.to(dtypes[name])
+
+    final = {'vocab': vocab, 'opt': opt, 'optim': None, 'model': mean_model, 'generator': mean_generator}
+    # Write to a temporary file replaced at once, so that a reader never sees a partial model
+    tmp_output = '{}.{}.tmp'.format(output, uuid.uuid4().hex)
+    try:
+        torch.save(final, tmp_output)
+        os.replace(tmp_output, output)
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+
+
+# Peak resident set size of the process in MB
+def peak_rss():
+    # On Linux, ru_maxrss keeps the peak of the parent process when it was forked, unlike VmHWM
+    if os.path.isfile('/proc/self/status'):
+        with open('/proc/self/status') as fn:
+            for line in fn:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-models', type=str, nargs='+', required=True,
+                        help='model checkpoints or glob patterns (e.g. "train/model_step_*.pt")')
+    parser.add_argument('-last_k', type=int, default=None,
+                        help='average only the last k checkpoints by training step')
+    parser.add_argument('-output', type=str, required=True, help='averaged model')
+    parser.add_argument('-no_mmap', action='store_true', help='load the checkpoints fully into memory')
+    args = parser.parse_args()
+
+    checkpoints = select_checkpoints(args.models, args.last_k)
+    if not checkpoints:
+        parser.error('no checkpoint matches {}'.format(' '.join(args.models)))
+    average_models(checkpoints, args.output, not args.no_mmap)
+    print('Averaged {} checkpoints into {}, peak RSS: {:.1f} MB'.format(len(checkpoints), args.output, peak_rss()))
@@ -1,31 +1,26 @@
-# Average at most three model checkpoints to obtain the best model
+# Average the last model checkpoints to obtain the best model
 #!/bin/bash
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 ENV_DIR=${SCRIPT_DIR}/../../env/bin
 source $ENV_DIR/activate
 
-MODEL1=$1
-MODEL2=$2
-MODEL3=$3
-LANG_SRC=$4
-LANG_TGT=$5
+LANG_SRC=${1:-en}
+LANG_TGT=${2:-es}
+# Number of checkpoints averaged, the last ones by training step
+LAST_K=${3:-3}
 
-if [[ $# -eq 0 ]]
-  then
-  MODEL1=/content/gdrive/MyDrive/NMT_Test/nmt/data/exp/model.en-es_step_100000.pt
-  MODEL2=/content/gdrive/MyDrive/NMT_Test/nmt/data/exp/model.en-es_step_99000.pt
-  MODEL3=/content/gdrive/MyDrive/NMT_Test/nmt/data/exp/model.en-es_step_96000.pt
-  LANG_SRC=en
-  LANG_TGT=es
-fi
+TRANSLATION_DIR=${LANG_SRC}"2"${LANG_TGT}
+TRAIN_DIR=${SCRIPT_DIR}/data/${TRANSLATION_DIR}/train
+CHECKPOINTS=${CHECKPOINTS:-${TRAIN_DIR}/${TRANSLATION_DIR}_transformer_shared_vocab_embs_step_*.pt}
+MODEL_DIR=${TRAIN_DIR}/shared
+AVERAGE_MODEL=${MODEL_DIR}/${TRANSLATION_DIR}_average_model.pt
+mkdir -p ${MODEL_DIR}
 
-echo -e "Averaging models...\n${MODEL1}\n${MODEL2}\n${MODEL3}"
-
-MODEL_DIR=/content/gdrive/MyDrive/NMT_Test/nmt/data/exp/
-AVERAGE_MODEL=${MODEL_DIR}/${LANG_SRC}"2"${LANG_TGT}_average_model.pt
-
-python ${SCRIPT_DIR}/../../tools/OpenNMT-py/tools/average_models.py \
-    -models ${MODEL1} ${MODEL2} ${MODEL3} \
-    -output ${MODEL_DIR}/en2es_average_model.pt
+echo "Averaging the last ${LAST_K} models of ${CHECKPOINTS}..."
+# The checkpoints are read one at a time and averaged parameter by parameter with bounded memory
+python ${SCRIPT_DIR}/average_models.py \
+    -models "${CHECKPOINTS}" \
+    -last_k ${LAST_K} \
+    -output ${AVERAGE_MODEL}
 
 echo -e "Average model:${AVERAGE_MODEL}"
@@ -0,0 +1,55 @@
+# This script benchmarks the peak memory (RSS) of average_models.py against the number of checkpoints.
+# Synthetic checkpoints with the layout of the OpenNMT-py checkpoints (model, generator, vocab, options
+# and an Adam optimizer state twice the size of the model) are averaged with memory-mapped loading
+# and with full loading of each checkpoint
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import torch
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+# Number of float32 parameters of each synthetic tensor (4 MB)
+TENSOR_SIZE = 1 << 20
+
+
+def write_checkpoints(checkpoint_dir, num_checkpoints, model_size_mb):
+    num_tensors = max(1, model_size_mb * 2 ** 20 // (4 * TENSOR_SIZE))
+    for step in range(1, num_checkpoints + 1):
+        model = {'encoder.layer{}.weight'.format(i): torch.randn(TENSOR_SIZE) for i in range(num_tensors)}
+        generator = {'0.weight': torch.randn(TENSOR_SIZE)}
+        optim = {'exp_avg': [torch.randn(TENSOR_SIZE) for _ in range(num_tensors)],
+                 'exp_avg_sq': [torch.randn(TENSOR_SIZE) for _ in range(num_tensors)]}
+        torch.save({'model': model, 'generator': generator, 'vocab': {'src': ['<unk>', '<blank>']},
+                    'opt': {'layers': 6}, 'optim': optim},
+                   os.path.join(checkpoint_dir, 'model_step_{}.pt'.format(step * 1000)))
+
+
+# Run average_models.py in a new process and return its peak RSS in MB
+def average_peak_rss(checkpoint_dir, num_checkpoints, mmap):
+    cmd = [sys.executable, os.path.join(SCRIPT_DIR, 'average_models.py'),
+           '-models', os.path.join(checkpoint_dir, 'model_step_*.pt'), '-last_k', str(num_checkpoints),
+           '-output', os.path.join(checkpoint_dir, 'average_model.pt')]
+    if not mmap:
+        cmd.append('-no_mmap')
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True, check=True).stdout
+    return float(re.search(r'peak RSS: ([\d.]+) MB', output).group(1))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-model_size_mb', type=int, default=256, help='size of the model parameters in MB')
+    parser.add_argument('-num_checkpoints', type=int, nargs='+', default=[2, 4, 8],
+                        help='numbers of checkpoints to average')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        write_checkpoints(checkpoint_dir, max(args.num_checkpoints), args.model_size_mb)
+        print('Checkpoints\tPeak RSS mmap (MB)\tPeak RSS full load (MB)')
+        for num_checkpoints in args.num_checkpoints:
+            print('{}\t{:.1f}\t{:.1f}'.format(num_checkpoints,
+                                              average_peak_rss(checkpoint_dir, num_checkpoints, mmap=True),
+                                              average_peak_rss(checkpoint_dir, num_checkpoints, mmap=False)))
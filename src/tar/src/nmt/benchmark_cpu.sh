@@ -0,0 +1,40 @@
+#!/bin/bash
+# Benchmark the CPU inference of the average model on the test set with the evaluate.sh flow:
+# the fp32 OpenNMT-py model against its CTranslate2 int8 export, in sentences/s and BLEU
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
+MODEL_CHECKPOINT=${1:-${SCRIPT_DIR}/data/en2es/train/shared/en2es_average_model.pt}
+THREADS=${2:-$(nproc)}
+export BEAM_SIZE=${3:-5}
+TEST_SRC=${SCRIPT_DIR}/data/en2es/datasets/test.en
+TEST_TGT=${SCRIPT_DIR}/data/en2es/datasets/test.es
+
+CT2_MODEL=${MODEL_CHECKPOINT%.pt}_ct2_int8
+if [[ ! -d ${CT2_MODEL} ]]; then
+  ${SCRIPT_DIR}/convert_ct2.sh ${MODEL_CHECKPOINT} int8 ${CT2_MODEL}
+fi
+
+export OMP_NUM_THREADS=${THREADS}
+export INTRA_THREADS=${THREADS}
+export INTER_THREADS=1
+
+evaluate() {
+  ${SCRIPT_DIR}/evaluate.sh ${TEST_SRC} en ${TEST_TGT} es $1 cpu | tee /dev/stderr
+}
+
+FP32_OUTPUT=$(evaluate ${MODEL_CHECKPOINT})
+INT8_OUTPUT=$(evaluate ${CT2_MODEL})
+
+field() {
+  echo "$1" | grep -oP "$2 = \K[\d.]+" | tail -n 1
+}
+FP32_SPEED=$(field "${FP32_OUTPUT}" SENTS_PER_SEC)
+FP32_BLEU=$(field "${FP32_OUTPUT}" BLEU_SCORE_DETOK)
+INT8_SPEED=$(field "${INT8_OUTPUT}" SENTS_PER_SEC)
+INT8_BLEU=$(field "${INT8_OUTPUT}" BLEU_SCORE_DETOK)
+
+echo -e "\nCPU inference on $(basename ${TEST_SRC}) with ${THREADS} threads and beam size ${BEAM_SIZE}"
+echo -e "Model\tSentences/s\tBLEU\tSpeed-up\tBLEU delta"
+echo -e "OpenNMT-py fp32\t${FP32_SPEED}\t${FP32_BLEU}\t1.00\t0.00"
+awk -v s="${INT8_SPEED}" -v b="${INT8_BLEU}" -v fs="${FP32_SPEED}" -v fb="${FP32_BLEU}" \
+    'BEGIN {printf "CTranslate2 int8\t%s\t%s\t%.2f\t%+.2f\n", s, b, s / fs, b - fb}'
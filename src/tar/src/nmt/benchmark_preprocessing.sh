@@ -0,0 +1,89 @@
+#!/bin/bash
+# Check that the in-process Python preprocessing (preprocessing.py) gives the same output as the
+# Moses Perl and subword-nmt chain, and compare their throughput in lines/s.
+# The postprocessing is checked on the preprocessed target side of the test set
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+ENV_DIR=${SCRIPT_DIR}/../../env
+source ${ENV_DIR}/bin/activate
+
+export LC_ALL=en_US.UTF-8
+TEST_SRC=${1:-${SCRIPT_DIR}/data/en2es/datasets/test.en}
+TEST_TGT=${2:-${SCRIPT_DIR}/data/en2es/datasets/test.es}
+NUM_WORKERS=${3:-$(nproc)}
+LANG_SRC=en
+LANG_TGT=es
+
+PREPROCESS_DIR=${SCRIPT_DIR}/data/en2es/preprocess
+JOINT_BPE=${PREPROCESS_DIR}/joint_bpe
+TOOLS_DIR=${SCRIPT_DIR}/../../tools
+MOSES_DIR=${TOOLS_DIR}/mosesdecoder
+
+WORK_DIR=$(mktemp -d)
+trap "rm -rf ${WORK_DIR}" EXIT
+
+preprocess_perl() {
+  cat $1 |
+  perl ${MOSES_DIR}/scripts/tokenizer/normalize-punctuation.perl -l $2 |
+  perl ${MOSES_DIR}/scripts/tokenizer/tokenizer.perl -l $2 -no-escape |
+  perl ${MOSES_DIR}/scripts/recaser/truecase.perl --model ${PREPROCESS_DIR}/truecase-model.$2 |
+  subword-nmt apply-bpe -c ${JOINT_BPE} --vocabulary ${PREPROCESS_DIR}/vocab.$2 --vocabulary-threshold 50
+}
+
+preprocess_python() {
+  python ${SCRIPT_DIR}/preprocessing.py preprocess -lang $2 -input $1 \
+         -truecase_model ${PREPROCESS_DIR}/truecase-model.$2 -bpe_codes ${JOINT_BPE} \
+         -vocabulary ${PREPROCESS_DIR}/vocab.$2 -vocabulary_threshold 50 -num_workers $3
+}
+
+postprocess_perl() {
+  sed -r 's/(@@ )|(@@ ?$)//g' $1 |
+  perl ${MOSES_DIR}/scripts/recaser/detruecase.perl |
+  perl ${MOSES_DIR}/scripts/tokenizer/detokenizer.perl -l $2
+}
+
+postprocess_python() {
+  python ${SCRIPT_DIR}/preprocessing.py postprocess -lang $2 -input $1 -num_workers $3
+}
+
+# Run a command writing its output to a file and print its throughput in lines/s
+run() {
+  OUTPUT=$1
+  shift
+  START=$(date +%s.%N)
+  "$@" > ${OUTPUT}
+  END=$(date +%s.%N)
+  awk -v n=$(wc -l < ${OUTPUT}) "BEGIN {printf \"%.1f\", n / ($END - $START)}"
+}
+
+# Number of lines that differ between two files
+num_diff_lines() {
+  diff <(cat -n $1) <(cat -n $2) | grep -c '^<'
+}
+
+PARITY=0
+echo -e "Step\tLanguage\tPerl (lines/s)\tPython 1 worker (lines/s)\tPython ${NUM_WORKERS} workers (lines/s)\tDifferent lines"
+for side in "${TEST_SRC} ${LANG_SRC}" "${TEST_TGT} ${LANG_TGT}"; do
+  set -- ${side}
+  PERL_SPEED=$(run ${WORK_DIR}/bpe.perl.$2 preprocess_perl $1 $2)
+  PYTHON_SPEED=$(run ${WORK_DIR}/bpe.python.$2 preprocess_python $1 $2 1)
+  PARALLEL_SPEED=$(run ${WORK_DIR}/bpe.parallel.$2 preprocess_python $1 $2 ${NUM_WORKERS})
+  DIFF=$(( $(num_diff_lines ${WORK_DIR}/bpe.perl.$2 ${WORK_DIR}/bpe.python.$2) +
+           $(num_diff_lines ${WORK_DIR}/bpe.perl.$2 ${WORK_DIR}/bpe.parallel.$2) ))
+  echo -e "preprocess\t$2\t${PERL_SPEED}\t${PYTHON_SPEED}\t${PARALLEL_SPEED}\t${DIFF}"
+  PARITY=$(( PARITY + DIFF ))
+done
+
+BPE_TGT=${WORK_DIR}/bpe.perl.${LANG_TGT}
+PERL_SPEED=$(run ${WORK_DIR}/post.perl postprocess_perl ${BPE_TGT} ${LANG_TGT})
+PYTHON_SPEED=$(run ${WORK_DIR}/post.python postprocess_python ${BPE_TGT} ${LANG_TGT} 1)
+PARALLEL_SPEED=$(run ${WORK_DIR}/post.parallel postprocess_python ${BPE_TGT} ${LANG_TGT} ${NUM_WORKERS})
+DIFF=$(( $(num_diff_lines ${WORK_DIR}/post.perl ${WORK_DIR}/post.python) +
+         $(num_diff_lines ${WORK_DIR}/post.perl ${WORK_DIR}/post.parallel) ))
+echo -e "postprocess\t${LANG_TGT}\t${PERL_SPEED}\t${PYTHON_SPEED}\t${PARALLEL_SPEED}\t${DIFF}"
+PARITY=$(( PARITY + DIFF ))
+
+if [[ ${PARITY} -ne 0 ]]; then
+  echo "The Python and the Perl chains differ on ${PARITY} lines"
+  exit 1
+fi
+echo "The Python and the Perl chains give the same output"
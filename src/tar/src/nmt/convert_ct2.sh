@@ -0,0 +1,19 @@
+#!/bin/bash
+# Export the average model to CTranslate2 for fast CPU inference.
+# The weights are quantized to int8 by default (use float for the unquantized model)
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+ENV_DIR=${SCRIPT_DIR}/../../env/bin
+source $ENV_DIR/activate
+
+MODEL_CHECKPOINT=${1:-${SCRIPT_DIR}/data/en2es/train/shared/en2es_average_model.pt}
+QUANTIZATION=${2:-int8}
+OUTPUT_DIR=${3:-${MODEL_CHECKPOINT%.pt}_ct2_${QUANTIZATION}}
+
+echo "Converting ${MODEL_CHECKPOINT} to CTranslate2 (${QUANTIZATION})..."
+if [[ "${QUANTIZATION}" == "float" ]]; then
+  ct2-opennmt-py-converter --model_path ${MODEL_CHECKPOINT} --output_dir ${OUTPUT_DIR} --force
+else
+  ct2-opennmt-py-converter --model_path ${MODEL_CHECKPOINT} --output_dir ${OUTPUT_DIR} \
+                           --quantization ${QUANTIZATION} --force
+fi
+echo "CTranslate2 model: ${OUTPUT_DIR}"
@@ -3,70 +3,222 @@
 # then splits it up into train/dev/test datasets
 import fasttext
 import argparse
+import hashlib
+import heapq
 import os
-import random
 import time
+from array import array
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
 from tqdm import tqdm
+from utils import open_file
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 
 FASTTEXT_LANG_DETECT_MODEL = SCRIPT_DIR + '/data/fastText/lid.176.bin'
-langdetect = fasttext.load_model(FASTTEXT_LANG_DETECT_MODEL)
+# The model is loaded once per process: in the main process before forking the
+# pool (so that workers share its pages) or in the pool initializer otherwise
+langdetect = None
+
+# Number of sentence pairs sent to fastText in a single predict call
+LANG_DETECT_CHUNK_SIZE = 10000
+
+
+def load_langdetect_model():
+    global langdetect
+    if langdetect is None:
+        langdetect = fasttext.load_model(FASTTEXT_LANG_DETECT_MODEL)
+    return langdetect
 
 
 def check_correct_target_language(text, target_language):
-    prediction = langdetect.predict(text)
+    prediction = load_langdetect_model().predict(text)
     label_language = prediction[0][0]
     return label_language.endswith(target_language)
 
 
-def create_datasets(source_file, target_file, source_lang, target_lang, output_dir, test_size, valid_size):
-    with open(source_file) as sf, open(target_file) as tf:
-        source_target_lines = [(s.strip(), t.strip()) for (s, t) in tqdm(zip(sf.readlines(), tf.readlines()))]
-
-    # Remove pairs duplicates
-    source_target_lines = set(source_target_lines)
-
-    # Remove pairs containing source or target duplicates
-    source_seen = set()
-    target_seen = set()
-    source_target_lines_clean = set()
-    for st in tqdm(source_target_lines):
-        if st[0] not in source_seen and st[1] not in target_seen:
-            source_seen.add(st[0])
-            target_seen.add(st[1])
-            source_target_lines_clean.add(st)
-
-    # Remove pairs with wrongly aligned (uncorrect translations)
-    source_target_lines_clean = [st for st in tqdm(source_target_lines_clean)
-                                 if check_correct_target_language(st[0], source_lang)
-                                 and check_correct_target_language(st[1], target_lang)
-                                 and st[0] != st[1]]
-
-    # Shuffle and split
-    random.seed(10)
-    random.shuffle(source_target_lines_clean)
-    source_target_lines_test = source_target_lines_clean[:test_size+1]
-    source_target_lines_valid = source_target_lines_clean[test_size+1:(valid_size+test_size)+2]
-    source_target_lines_train = source_target_lines_clean[(valid_size+test_size)+2:]
-
-    source_test = os.path.join(output_dir, 'test.{}'.format(source_lang))
-    target_test = os.path.join(output_dir, 'test.{}'.format(target_lang))
-    with open(source_test, 'w', encoding='utf8') as sf, open(target_test, 'w') as tf:
-        sf.writelines('\n'.join(st[0] for st in tqdm(source_target_lines_test)))
-        tf.writelines('\n'.join(st[1] for st in tqdm(source_target_lines_test)))
-
-    source_valid = os.path.join(output_dir, 'valid.{}'.format(source_lang))
-    target_valid = os.path.join(output_dir, 'valid.{}'.format(target_lang))
-    with open(source_valid, 'w', encoding='utf8') as sf, open(target_valid, 'w') as tf:
-        sf.writelines('\n'.join(st[0] for st in tqdm(source_target_lines_valid)))
-        tf.writelines('\n'.join(st[1] for st in tqdm(source_target_lines_valid)))
-
-    source_train = os.path.join(output_dir, 'train.{}'.format(source_lang))
-    target_train = os.path.join(output_dir, 'train.{}'.format(target_lang))
-    with open(source_train, 'w', encoding='utf8') as sf, open(target_train, 'w') as tf:
-        sf.writelines('\n'.join(st[0] for st in tqdm(source_target_lines_train)))
-        tf.writelines('\n'.join(st[1] for st in tqdm(source_target_lines_train)))
+# Check the language of a chunk of sentence pairs with one batched prediction per side.
+# Return the rejection reason of each pair or None for the pairs to keep
+def check_language_chunk(source_target_lines, source_lang, target_lang):
+    model = load_langdetect_model()
+    source_labels, _ = model.predict([st[0] for st in source_target_lines])
+    target_labels, _ = model.predict([st[1] for st in source_target_lines])
+    reasons = []
+    for st, source_label, target_label in zip(source_target_lines, source_labels, target_labels):
+        if st[0] == st[1]:
+            reasons.append('identical source and target')
+        elif not source_label[0].endswith(source_lang):
+            reasons.append('source language {}'.format(source_label[0].replace('__label__', '')))
+        elif not target_label[0].endswith(target_lang):
+            reasons.append('target language {}'.format(target_label[0].replace('__label__', '')))
+        else:
+            reasons.append(None)
+    return reasons
+
+
+# Split an iterable into lists of chunk_size elements
+def chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Filter out the pairs that are not in the correct source/target language.
+# The language detection runs on a process pool keeping at most two chunks per worker
+# in flight, so the input is consumed as a stream and the output keeps the input order.
+# The rejected pairs are passed to on_reject together with the reason.
+def filter_language(source_target_lines, source_lang, target_lang, num_workers=1,
+                    chunk_size=LANG_DETECT_CHUNK_SIZE, on_reject=None):
+    check_chunk = partial(check_language_chunk, source_lang=source_lang, target_lang=target_lang)
+    load_langdetect_model()
+    pool = Pool(num_workers, initializer=load_langdetect_model) if num_workers > 1 else None
+    pending = deque()
+
+    def flush():
+        chunk, result = pending.popleft()
+        reasons = result.get() if pool else result
+        for st, reason in zip(chunk, reasons):
+            if reason is None:
+                yield st
+            elif on_reject:
+                on_reject(st, reason)
+
+    try:
+        for chunk in chunks(source_target_lines, chunk_size):
+            result = pool.apply_async(check_chunk, (chunk,)) if pool else check_chunk(chunk)
+            pending.append((chunk, result))
+            if len(pending) >= 2 * num_workers:
+                yield from flush()
+        while pending:
+            yield from flush()
+    finally:
+        if pool:
+            pool.terminate()
+
+
+# 64-bit hash of a text, used instead of the full strings to keep track of the seen sentences
+def hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf8'), digest_size=8).digest(), 'little')
+
+
+# Set of 64-bit hashes with open addressing over a flat array: about 16 bytes per entry
+# (at the maximum load factor of 1/2) instead of a hundred or more for a set of strings
+class HashSet64:
+    def __init__(self, capacity=1 << 20):
+        self.table = array('Q', bytes(8 * capacity))
+        self.mask = capacity - 1
+        self.size = 0
+
+    def _slot(self, value):
+        # The zero value marks the empty slots
+        value = value or 1
+        idx = value & self.mask
+        while self.table[idx] and self.table[idx] != value:
+            idx = (idx + 1) & self.mask
+        return idx, value
+
+    def __contains__(self, value):
+        idx, _ = self._slot(value)
+        return self.table[idx] != 0
+
+    def add(self, value):
+        idx, value = self._slot(value)
+        if not self.table[idx]:
+            self.table[idx] = value
+            self.size += 1
+            if 2 * self.size > self.mask:
+                self._grow()
+
+    def _grow(self):
+        old_table = self.table
+        self.table = array('Q', bytes(16 * len(old_table)))
+        self.mask = len(self.table) - 1
+        for value in old_table:
+            if value:
+                idx, _ = self._slot(value)
+                self.table[idx] = value
+
+    def __len__(self):
+        return self.size
+
+
+# Remove pairs containing source or target duplicates (and therefore pairs duplicates)
+# while streaming the input files
+def deduplicate(source_target_lines, on_reject=None):
+    source_seen = HashSet64()
+    target_seen = HashSet64()
+    for st in source_target_lines:
+        source_hash, target_hash = hash64(st[0]), hash64(st[1])
+        if source_hash in source_seen:
+            if on_reject:
+                on_reject(st, 'duplicate source')
+        elif target_hash in target_seen:
+            if on_reject:
+                on_reject(st, 'duplicate target')
+        else:
+            source_seen.add(source_hash)
+            target_seen.add(target_hash)
+            yield st
+
+
+# The corpora and the datasets are (de)compressed on the fly according to their extension (.gz or .zst)
+def create_datasets(source_file, target_file, source_lang, target_lang, output_dir, test_size, valid_size,
+                    num_workers=1, rejected_file=None, compression=''):
+    if rejected_file is None:
+        rejected_file = os.path.join(output_dir, 'rejected.{}-{}{}'.format(source_lang, target_lang, compression))
+
+    def dataset_files(dataset):
+        return (open_file(os.path.join(output_dir, '{}.{}{}'.format(dataset, source_lang, compression)), 'w',
+                          encoding='utf8'),
+                open_file(os.path.join(output_dir, '{}.{}{}'.format(dataset, target_lang, compression)), 'w',
+                          encoding='utf8'))
+
+    def write_pair(files, st):
+        files[0].write(st[0] + '\n')
+        files[1].write(st[1] + '\n')
+
+    # The test and valid pairs are the ones with the smallest pair hashes, which gives a
+    # deterministic random split without shuffling the corpus in memory. The candidates are
+    # kept in a max-heap bounded to the test and valid sizes, and the pairs pushed out of it
+    # are written to the train dataset right away.
+    heldout_size = test_size + valid_size + 2
+    heldout = []
+    train_files = dataset_files('train')
+    with open_file(rejected_file, 'w', encoding='utf8') as rf, \
+            open_file(source_file) as sf, open_file(target_file) as tf, train_files[0], train_files[1]:
+        def write_rejected(st, reason):
+            rf.write('{}\t{}\t{}\n'.format(reason, st[0], st[1]))
+
+        source_target_lines = ((s.strip(), t.strip()) for s, t in tqdm(zip(sf, tf)))
+        source_target_lines = deduplicate(source_target_lines, on_reject=write_rejected)
+        # Remove pairs with wrongly aligned (uncorrect translations)
+        source_target_lines = filter_language(source_target_lines, source_lang, target_lang,
+                                              num_workers=num_workers, on_reject=write_rejected)
+        for st in source_target_lines:
+            pair_hash = hash64('{}\t{}'.format(st[0], st[1]))
+            if len(heldout) < heldout_size:
+                heapq.heappush(heldout, (-pair_hash, st))
+            else:
+                _, st = heapq.heappushpop(heldout, (-pair_hash, st))
+                write_pair(train_files, st)
+
+    # Split the held out pairs
+    source_target_lines_heldout = [st for _, st in sorted(heldout, reverse=True)]
+    test_files = dataset_files('test')
+    with test_files[0], test_files[1]:
+        for st in source_target_lines_heldout[:test_size+1]:
+            write_pair(test_files, st)
+
+    valid_files = dataset_files('valid')
+    with valid_files[0], valid_files[1]:
+        for st in source_target_lines_heldout[test_size+1:]:
+            write_pair(valid_files, st)
 
 
 if __name__ == '__main__':
@@ -78,6 +230,13 @@ if __name__ == '__main__':
     parser.add_argument('--output_dir', type=str, help='Output directory')
     parser.add_argument('--test_size', type=int, help='Test dataset size')
     parser.add_argument('--valid_size', type=int, help='Valid dataset size')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(),
+                        help='Number of processes used for the language detection')
+    parser.add_argument('--rejected_file', type=str, default=None,
+                        help='File where the rejected pairs are written with the rejection reason '
+                             '(default: <output_dir>/rejected.<source_lang>-<target_lang>)')
+    parser.add_argument('--compression', type=str, default='', choices=['', 'gz', 'zst'],
+                        help='compression of the datasets written (the corpora are read according to their extension)')
     args = parser.parse_args()
 
     if not os.path.isdir(args.output_dir):
@@ -85,7 +244,9 @@ if __name__ == '__main__':
     start = time.time()
     create_datasets(args.source_file, args.target_file, args.source_lang, args.target_lang,
                     args.output_dir,
-                    args.test_size, args.valid_size)
+                    args.test_size, args.valid_size,
+                    num_workers=args.num_workers, rejected_file=args.rejected_file,
+                    compression='.' + args.compression if args.compression else '')
     end = time.time()
     print('Total time: {} s'.format(end-start))
 
@@ -0,0 +1,97 @@
+# Translate a preprocessed (BPE) file with a CTranslate2 model, the CPU inference path of the NMT model.
+# The output is the same as the one of OpenNMT-py translate.py: one line of BPE tokens per source line.
+# With - as source or output file, the lines are streamed from the standard input to the standard output
+import argparse
+import os
+import sys
+import time
+import ctranslate2
+
+# Same defaults as OpenNMT-py translate.py
+BEAM_SIZE = 5
+BATCH_SIZE = 30
+# Number of batches read at once when streaming: the sentences are sorted by length within them
+STREAM_BATCHES = 8
+
+
+def chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Translate the lines as they are read and write the translations of every chunk as soon as it is done
+def ct2_translate_stream(translator, input_file, output_file, beam_size=BEAM_SIZE, batch_size=BATCH_SIZE):
+    num_sentences = 0
+    for chunk in chunks(input_file, batch_size * STREAM_BATCHES):
+        results = translator.translate_batch([line.split() for line in chunk], max_batch_size=batch_size,
+                                             beam_size=beam_size, replace_unknowns=True)
+        output_file.write(''.join(' '.join(result.hypotheses[0]) + '\n' for result in results))
+        output_file.flush()
+        num_sentences += len(chunk)
+    return num_sentences
+
+
+def ct2_translate(model_dir, src_file, output_file, beam_size=BEAM_SIZE, batch_size=BATCH_SIZE,
+                  intra_threads=0, inter_threads=1, device='cpu', compute_type='default'):
+    """
+    Translate a file with a CTranslate2 model
+    :param model_dir: directory of the CTranslate2 model (see convert_ct2.sh)
+    :param src_file: preprocessed source file (- for the standard input)
+    :param output_file: translated file (- for the standard output)
+    :param beam_size: beam size (1 for greedy search)
+    :param batch_size: maximum number of sentences translated at once
+    :param intra_threads: number of threads used by each translation (0 to use OMP_NUM_THREADS or all the cores)
+    :param inter_threads: number of batches translated in parallel
+    :param device: cpu or cuda
+    :param compute_type: type of the computations (default: the quantization of the model)
+    :return: number of translated sentences and translation time in seconds
+    """
+    translator = ctranslate2.Translator(model_dir, device=device, compute_type=compute_type,
+                                        inter_threads=inter_threads, intra_threads=intra_threads)
+    if src_file == '-' or output_file == '-':
+        start = time.time()
+        input_file = sys.stdin if src_file == '-' else open(src_file)
+        output_fn = sys.stdout if output_file == '-' else open(output_file, 'w')
+        try:
+            num_sentences = ct2_translate_stream(translator, input_file, output_fn, beam_size, batch_size)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_fn is not sys.stdout:
+                output_fn.close()
+        return num_sentences, time.time() - start
+
+    with open(src_file) as sf:
+        num_sentences = sum(1 for _ in sf)
+    start = time.time()
+    translator.translate_file(src_file, output_file, max_batch_size=batch_size, beam_size=beam_size,
+                              replace_unknowns=True)
+    return num_sentences, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-model', type=str, help='CTranslate2 model directory')
+    parser.add_argument('-src', type=str, help='preprocessed source file')
+    parser.add_argument('-output', type=str, help='translated file')
+    parser.add_argument('-beam_size', type=int, default=BEAM_SIZE, help='beam size')
+    parser.add_argument('-batch_size', type=int, default=BATCH_SIZE, help='maximum batch size')
+    parser.add_argument('-intra_threads', type=int, default=int(os.environ.get('OMP_NUM_THREADS') or 0),
+                        help='threads per translation (default: OMP_NUM_THREADS, 0 for all the cores)')
+    parser.add_argument('-inter_threads', type=int, default=1, help='batches translated in parallel')
+    parser.add_argument('-device', type=str, default='cpu', help='cpu or cuda')
+    parser.add_argument('-compute_type', type=str, default='default',
+                        help='computation type (default: the quantization of the converted model)')
+    args = parser.parse_args()
+
+    num_sentences, translation_time = ct2_translate(args.model, args.src, args.output, args.beam_size,
+                                                    args.batch_size, args.intra_threads, args.inter_threads,
+                                                    args.device, args.compute_type)
+    print('Translated {} sentences in {:.1f} s ({:.1f} sentences/s)'.format(
+        num_sentences, translation_time, num_sentences / max(translation_time, 1e-9)), file=sys.stderr)
@@ -4,8 +4,27 @@ ENV_DIR=${SCRIPT_DIR}/../../env
 source ${ENV_DIR}/bin/activate
 
 export LC_ALL=en_US.UTF-8
+# Input and output files, - for the standard input and output (one sentence per line).
+# The log messages are written to the standard error
 INPUT_SRC=$1
 OUTPUT_FILE=$2
+if [[ "${OUTPUT_FILE}" == "-" ]]; then
+  OUTPUT_FILE=/dev/stdout
+fi
+BATCH_SIZE=${3:-30}
+# GPU index, or cpu to translate on the CPU
+DEVICE=${4:-0}
+# CPU inference: CTranslate2 model (see convert_ct2.sh), used when it exists, beam size and threads
+CT2_MODEL=${CT2_MODEL:-${SCRIPT_DIR}/data/en2es/train/shared/en2es_average_model_ct2_int8}
+BEAM_SIZE=${BEAM_SIZE:-5}
+INTRA_THREADS=${INTRA_THREADS:-${OMP_NUM_THREADS:-0}}
+INTER_THREADS=${INTER_THREADS:-1}
+# Pre/postprocessing: the Moses Perl scripts (perl) or the in-process Python chain (python, preprocessing.py).
+# The Perl scripts stay the default until benchmark_preprocessing.sh reports the same output on the test set
+PREPROCESSING=${PREPROCESSING:-perl}
+PREPROCESSING_WORKERS=${PREPROCESSING_WORKERS:-1}
+# Lines processed at once by preprocessing.py: the translations are streamed out chunk by chunk
+PREPROCESSING_CHUNK_SIZE=${PREPROCESSING_CHUNK_SIZE:-1000}
 
 #Preprocess functions
 PREPROCESS_DIR=${SCRIPT_DIR}/data/en2es/preprocess
@@ -22,40 +41,75 @@ preprocess_src() {
   INPUT_FILE=$1
   LANG=$2
 
-  cat ${INPUT_FILE} |
-  perl ${MOSES_DIR}/scripts/tokenizer/normalize-punctuation.perl -l $LANG |
-  perl ${MOSES_DIR}/scripts/tokenizer/tokenizer.perl -l ${LANG} -no-escape |
-  perl ${MOSES_DIR}/scripts/recaser/truecase.perl --model ${TRUECASE_EN} |
-  subword-nmt apply-bpe -c ${JOINT_BPE} --vocabulary ${VOCAB_EN} --vocabulary-threshold 50
+  if [[ "${PREPROCESSING}" == "perl" ]]; then
+    cat ${INPUT_FILE} |
+    perl ${MOSES_DIR}/scripts/tokenizer/normalize-punctuation.perl -l $LANG |
+    perl ${MOSES_DIR}/scripts/tokenizer/tokenizer.perl -l ${LANG} -no-escape |
+    perl ${MOSES_DIR}/scripts/recaser/truecase.perl --model ${TRUECASE_EN} |
+    subword-nmt apply-bpe -c ${JOINT_BPE} --vocabulary ${VOCAB_EN} --vocabulary-threshold 50
+  else
+    python ${SCRIPT_DIR}/preprocessing.py preprocess -lang ${LANG} -input ${INPUT_FILE} \
+           -truecase_model ${TRUECASE_EN} -bpe_codes ${JOINT_BPE} \
+           -vocabulary ${VOCAB_EN} -vocabulary_threshold 50 \
+           -num_workers ${PREPROCESSING_WORKERS} -chunk_size ${PREPROCESSING_CHUNK_SIZE}
+  fi
 }
 
 postprocess_pred() {
   INPUT_FILE=$1
   LANG=$2
-  cat ${INPUT_FILE} |
-  sed -r 's/(@@ )|(@@ ?$)//g' ${INPUT_FILE} |
-  perl ${MOSES_DIR}/scripts/recaser/detruecase.perl |
-  perl ${MOSES_DIR}/scripts/tokenizer/detokenizer.perl -l $LANG
-}
 
-TEST_SRC_BPE=$(mktemp)
-preprocess_src ${INPUT_SRC} en > ${TEST_SRC_BPE}
+  if [[ "${PREPROCESSING}" == "perl" ]]; then
+    cat ${INPUT_FILE} |
+    sed -r 's/(@@ )|(@@ ?$)//g' ${INPUT_FILE} |
+    perl ${MOSES_DIR}/scripts/recaser/detruecase.perl |
+    perl ${MOSES_DIR}/scripts/tokenizer/detokenizer.perl -l $LANG
+  else
+    python ${SCRIPT_DIR}/preprocessing.py postprocess -lang ${LANG} -input ${INPUT_FILE} \
+           -num_workers ${PREPROCESSING_WORKERS} -chunk_size ${PREPROCESSING_CHUNK_SIZE}
+  fi
+}
 
 #Translate Transformer
-echo "Translate..."
+echo "Translate..." >&2
 # Select the model
 MODEL_CHECKPOINT=${SCRIPT_DIR}/../nmt/data/en2es/train/shared/en2es_average_model.pt
-echo "Using average model across checkpoints: ${MODEL_CHECKPOINT}"
 
-PREDS_BPE=$(mktemp)
-python ${ONMT_DIR}/translate.py \
-       -model ${MODEL_CHECKPOINT} \
-       -src ${TEST_SRC_BPE} \
-       -output ${PREDS_BPE} \
-  	   -verbose -replace_unk \
-       -gpu 0
+if [[ "${DEVICE}" == "cpu" && -d "${CT2_MODEL}" ]]; then
+  # The sentences are streamed through preprocessing, translation and postprocessing
+  echo "Using CTranslate2 model on CPU: ${CT2_MODEL}" >&2
+  preprocess_src ${INPUT_SRC} en |
+  python ${SCRIPT_DIR}/ct2_translate.py \
+         -model ${CT2_MODEL} \
+         -src - \
+         -output - \
+         -beam_size ${BEAM_SIZE} \
+         -batch_size ${BATCH_SIZE} \
+         -intra_threads ${INTRA_THREADS} \
+         -inter_threads ${INTER_THREADS} |
+  postprocess_pred - es > ${OUTPUT_FILE}
+else
+  # OpenNMT-py reads its input from a file: only the postprocessing is streamed
+  echo "Using average model across checkpoints: ${MODEL_CHECKPOINT}" >&2
+  if [[ "${DEVICE}" == "cpu" ]]; then
+    DEVICE_ARGS=""
+  else
+    DEVICE_ARGS="-gpu ${DEVICE}"
+  fi
+  TEST_SRC_BPE=$(mktemp)
+  PREDS_BPE=$(mktemp)
+  preprocess_src ${INPUT_SRC} en > ${TEST_SRC_BPE}
+  python ${ONMT_DIR}/translate.py \
+         -model ${MODEL_CHECKPOINT} \
+         -src ${TEST_SRC_BPE} \
+         -output ${PREDS_BPE} \
+         -verbose -replace_unk \
+         -beam_size ${BEAM_SIZE} \
+         -batch_size ${BATCH_SIZE} \
+         ${DEVICE_ARGS} >&2
 
-#Postprocess predictions
-postprocess_pred $PREDS_BPE es > $OUTPUT_FILE
+  #Postprocess predictions
+  postprocess_pred ${PREDS_BPE} es > ${OUTPUT_FILE}
 
-rm $PREDS_BPE $TEST_SRC_BPE
\ No newline at end of file
+  rm ${PREDS_BPE} ${TEST_SRC_BPE}
+fi
@@ -0,0 +1,245 @@
+# This script evaluates a list of NMT models (OpenNMT-py checkpoints or CTranslate2 model directories)
+# on a test set with BLEU and prints a comparison table. Unlike evaluate.sh, which preprocesses the test set
+# and starts a translation process for each model:
+#  - the test set is preprocessed once and cached, keyed by the hash of the test file and of the truecase model,
+#    BPE codes and vocabulary. The pre- and postprocessing use the Moses Perl scripts and subword-nmt as
+#    evaluate.sh (-preprocessing python for preprocessing.py, once benchmark_preprocessing.sh gives the same output)
+#  - the models are translated in this process: the vocabulary of the OpenNMT-py checkpoints is loaded
+#    from the first one and shared by the others, which must come from the same training
+#  - the BLEU score is computed with sacrebleu, lowercased as the multi-bleu-detok.perl -lc of evaluate.sh
+import argparse
+import glob
+import hashlib
+import os
+import shlex
+import subprocess
+import sys
+import time
+import uuid
+import sacrebleu
+import preprocessing
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+MOSES_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'tools', 'mosesdecoder')
+PREPROCESSING = 'perl'
+BEAM_SIZE = 5
+BATCH_SIZE = 30
+# Size in bytes of the blocks read to hash the files
+BLOCK_SIZE = 1 << 20
+
+
+def files_hash(files, *values):
+    sha = hashlib.sha1()
+    for file in files:
+        with open(file, 'rb') as fn:
+            for block in iter(lambda: fn.read(BLOCK_SIZE), b''):
+                sha.update(block)
+    for value in values:
+        sha.update(str(value).encode('utf8'))
+    return sha.hexdigest()
+
+
+def write_lines(lines, file):
+    tmp_file = '{}.{}.tmp'.format(file, uuid.uuid4().hex)
+    try:
+        with open(tmp_file, 'w', encoding='utf8') as fn:
+            fn.write(''.join(line + '\n' for line in lines))
+        os.replace(tmp_file, file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def read_lines(file):
+    with open(file, encoding='utf8') as fn:
+        return list(preprocessing.read_lines(fn))
+
+
+# Run lines through a shell pipeline, one output line for each input line
+def run_pipeline(commands, lines):
+    output = subprocess.run(' | '.join(commands), shell=True, executable='/bin/bash', check=True,
+                            input=''.join(line + '\n' for line in lines).encode('utf8'),
+                            stdout=subprocess.PIPE).stdout.decode('utf8')
+    return output.split('\n')[:-1]
+
+
+# Same pre- and postprocessing as evaluate.sh
+def preprocess_perl(lines, lang, truecase_model, bpe_codes, vocabulary):
+    scripts = os.path.join(MOSES_DIR, 'scripts')
+    return run_pipeline(['perl {} -l {}'.format(shlex.quote(os.path.join(scripts, 'tokenizer',
+                                                                         'normalize-punctuation.perl')), lang),
+                         'perl {} -l {} -no-escape'.format(shlex.quote(os.path.join(scripts, 'tokenizer',
+                                                                                    'tokenizer.perl')), lang),
+                         'perl {} --model {}'.format(shlex.quote(os.path.join(scripts, 'recaser', 'truecase.perl')),
+                                                     shlex.quote(truecase_model)),
+                         'subword-nmt apply-bpe -c {} --vocabulary {} --vocabulary-threshold {}'.format(
+                             shlex.quote(bpe_codes), shlex.quote(vocabulary), preprocessing.VOCABULARY_THRESHOLD)],
+                        lines)
+
+
+def postprocess_perl(lines, lang):
+    scripts = os.path.join(MOSES_DIR, 'scripts')
+    return run_pipeline(["sed -r 's/(@@ )|(@@ ?$)//g'",
+                         'perl {}'.format(shlex.quote(os.path.join(scripts, 'recaser', 'detruecase.perl'))),
+                         'perl {} -l {}'.format(shlex.quote(os.path.join(scripts, 'tokenizer', 'detokenizer.perl')),
+                                                lang)],
+                        lines)
+
+
+# Preprocess the test set (normalization, tokenization, truecasing and BPE) or load it from the cache
+def preprocess_test_set(test_src, lang_src, preprocess_dir, cache_dir, num_workers=1,
+                        preprocessing_chain=PREPROCESSING):
+    truecase_model = os.path.join(preprocess_dir, 'truecase-model.{}'.format(lang_src))
+    bpe_codes = os.path.join(preprocess_dir, 'joint_bpe')
+    vocabulary = os.path.join(preprocess_dir, 'vocab.{}'.format(lang_src))
+    key = files_hash([test_src, truecase_model, bpe_codes, vocabulary], lang_src, preprocessing.VOCABULARY_THRESHOLD,
+                     preprocessing_chain)
+    cache_file = os.path.join(cache_dir, '{}.{}.bpe'.format(os.path.basename(test_src), key[:16]))
+    if os.path.isfile(cache_file):
+        print('Use the cached preprocessed test set {}'.format(cache_file), file=sys.stderr)
+        return read_lines(cache_file)
+
+    print('Preprocess the test set {}...'.format(test_src), file=sys.stderr)
+    os.makedirs(cache_dir, exist_ok=True)
+    if preprocessing_chain == 'perl':
+        test_src_bpe = preprocess_perl(read_lines(test_src), lang_src, truecase_model, bpe_codes, vocabulary)
+    else:
+        test_src_bpe = list(preprocessing.preprocess(read_lines(test_src), lang_src, truecase_model, bpe_codes,
+                                                     vocabulary, num_workers=num_workers))
+    write_lines(test_src_bpe, cache_file)
+    return test_src_bpe
+
+
+# Expand the model files and glob patterns, in order
+def expand_models(patterns):
+    models = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        models.extend(model for model in matches if model not in models)
+    return models
+
+
+# Translate the preprocessed sentences with OpenNMT-py checkpoints sharing the vocabulary of the first one
+class ONMTTranslator:
+    def __init__(self, gpu=-1, beam_size=BEAM_SIZE, batch_size=BATCH_SIZE):
+        # OpenNMT-py (and torch) are only needed for the checkpoints
+        from onmt.utils.parse import ArgumentParser
+        import onmt.opts as opts
+
+        self.gpu = gpu
+        self.batch_size = batch_size
+        parser = ArgumentParser()
+        opts.config_opts(parser)
+        opts.translate_opts(parser)
+        # Same options as the translation of evaluate.sh
+        self.opt = parser.parse_args(['-model', 'model.pt', '-src', 'src', '-replace_unk',
+                                      '-beam_size', str(beam_size), '-batch_size', str(batch_size),
+                                      '-gpu', str(gpu)])
+        ArgumentParser.validate_translate_opts(self.opt)
+        self.fields = None
+
+    def load(self, checkpoint):
+        import torch
+        from onmt.utils.parse import ArgumentParser
+        from onmt.model_builder import build_base_model, load_test_model
+        from onmt.translate.translator import Translator
+        from onmt.translate import GNMTGlobalScorer
+
+        if self.fields is None:
+            self.fields, model, model_opt = load_test_model(self.opt, checkpoint)
+        else:
+            # Same as load_test_model without loading the vocabulary again
+            checkpoint_dict = torch.load(checkpoint, map_location=lambda storage, loc: storage)
+            model_opt = ArgumentParser.ckpt_model_opts(checkpoint_dict['opt'])
+            ArgumentParser.update_model_opts(model_opt)
+            ArgumentParser.validate_model_opts(model_opt)
+            model = build_base_model(model_opt, self.fields, self.gpu >= 0, checkpoint_dict, self.gpu)
+            del checkpoint_dict
+            model.eval()
+            model.generator.eval()
+        return Translator.from_opt(model, self.fields, self.opt, model_opt,
+                                   global_scorer=GNMTGlobalScorer.from_opt(self.opt),
+                                   out_file=open(os.devnull, 'w'), report_score=False)
+
+    def translate(self, checkpoint, sentences):
+        translator = self.load(checkpoint)
+        start = time.time()
+        _, predictions = translator.translate(src=sentences, batch_size=self.batch_size)
+        translation_time = time.time() - start
+        translator.out_file.close()
+        return [prediction[0] for prediction in predictions], translation_time
+
+
+def ct2_translate_lines(model_dir, sentences, beam_size=BEAM_SIZE, batch_size=BATCH_SIZE):
+    import ctranslate2
+
+    translator = ctranslate2.Translator(model_dir, device='cpu')
+    start = time.time()
+    results = translator.translate_batch([sentence.split() for sentence in sentences], max_batch_size=batch_size,
+                                         beam_size=beam_size, replace_unknowns=True)
+    translation_time = time.time() - start
+    return [' '.join(result.hypotheses[0]) for result in results], translation_time
+
+
+def evaluate(models, test_src, test_tgt, lang_src, lang_tgt, preprocess_dir, evaluate_dir, gpu=-1,
+             beam_size=BEAM_SIZE, batch_size=BATCH_SIZE, num_workers=1, lowercase=True,
+             preprocessing_chain=PREPROCESSING):
+    test_src_bpe = preprocess_test_set(test_src, lang_src, preprocess_dir, os.path.join(evaluate_dir, 'cache'),
+                                       num_workers, preprocessing_chain)
+    references = read_lines(test_tgt)
+    onmt_translator = None
+    results = []
+    for model in models:
+        print('Translate with {}...'.format(model), file=sys.stderr)
+        # A CTranslate2 model (see convert_ct2.sh) is a directory and is always evaluated on the CPU
+        if os.path.isdir(model):
+            predictions_bpe, translation_time = ct2_translate_lines(model, test_src_bpe, beam_size, batch_size)
+        else:
+            if onmt_translator is None:
+                onmt_translator = ONMTTranslator(gpu, beam_size, batch_size)
+            predictions_bpe, translation_time = onmt_translator.translate(model, test_src_bpe)
+
+        if preprocessing_chain == 'perl':
+            predictions = postprocess_perl(predictions_bpe, lang_tgt)
+        else:
+            predictions = list(preprocessing.postprocess(predictions_bpe, lang_tgt, num_workers=num_workers))
+        write_lines(predictions, os.path.join(evaluate_dir, '{}.preds.{}'.format(os.path.basename(model.rstrip('/')),
+                                                                                 lang_tgt)))
+        bleu = sacrebleu.corpus_bleu(predictions, [references], lowercase=lowercase)
+        results.append({'model': model, 'bleu': bleu.score,
+                        'sents_per_sec': len(test_src_bpe) / max(translation_time, 1e-9)})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-models', type=str, nargs='+', required=True,
+                        help='OpenNMT-py checkpoints, CTranslate2 model directories or glob patterns')
+    parser.add_argument('-lang_src', type=str, default='en', help='source language')
+    parser.add_argument('-lang_tgt', type=str, default='es', help='target language')
+    parser.add_argument('-test_src', type=str, default=None, help='source test set (default: datasets/test.<lang_src>)')
+    parser.add_argument('-test_tgt', type=str, default=None, help='target test set (default: datasets/test.<lang_tgt>)')
+    parser.add_argument('-gpu', type=int, default=-1, help='GPU index of the OpenNMT-py translation (-1 for the CPU)')
+    parser.add_argument('-beam_size', type=int, default=BEAM_SIZE, help='beam size')
+    parser.add_argument('-batch_size', type=int, default=BATCH_SIZE, help='translation batch size')
+    parser.add_argument('-num_workers', type=int, default=1,
+                        help='processes of the pre- and postprocessing with preprocessing.py')
+    parser.add_argument('-preprocessing', type=str, default=PREPROCESSING, choices=['perl', 'python'],
+                        help='pre- and postprocessing with the Moses Perl scripts (as evaluate.sh) or preprocessing.py')
+    parser.add_argument('-cased', action='store_true', help='case-sensitive BLEU')
+    args = parser.parse_args()
+
+    translation_dir = os.path.join(SCRIPT_DIR, 'data', '{}2{}'.format(args.lang_src, args.lang_tgt))
+    test_src = args.test_src or os.path.join(translation_dir, 'datasets', 'test.{}'.format(args.lang_src))
+    test_tgt = args.test_tgt or os.path.join(translation_dir, 'datasets', 'test.{}'.format(args.lang_tgt))
+    evaluate_dir = os.path.join(translation_dir, 'evaluate')
+    os.makedirs(evaluate_dir, exist_ok=True)
+
+    results = evaluate(expand_models(args.models), test_src, test_tgt, args.lang_src, args.lang_tgt,
+                       os.path.join(translation_dir, 'preprocess'), evaluate_dir, args.gpu, args.beam_size,
+                       args.batch_size, args.num_workers, not args.cased, args.preprocessing)
+
+    print('Model\tBLEU\tSentences/s')
+    for result in results:
+        print('{}\t{:.2f}\t{:.2f}'.format(os.path.basename(result['model'].rstrip('/')), result['bleu'],
+                                          result['sents_per_sec']))
@@ -8,6 +8,11 @@ LANG_SRC=$2
 TEST_TGT=$3
 LANG_TGT=$4
 MODEL_CHECKPOINT=$5
+# GPU index, or cpu. A CTranslate2 model directory (see convert_ct2.sh) is always evaluated on the CPU
+DEVICE=${6:-0}
+BEAM_SIZE=${BEAM_SIZE:-5}
+INTRA_THREADS=${INTRA_THREADS:-${OMP_NUM_THREADS:-0}}
+INTER_THREADS=${INTER_THREADS:-1}
 
 if [[ $# -eq 0 ]]
   then
@@ -55,11 +60,31 @@ preprocess_src $TEST_SRC $LANG_SRC > $TEST_SRC_BPE
 #Translate Transformer
 echo "Translate..."
 PREDS_BPE=$(mktemp)
-python $ONMT_DIR/translate.py -model $MODEL_CHECKPOINT \
-                              -src $TEST_SRC_BPE \
-                              -output $PREDS_BPE \
-			                  -verbose -replace_unk \
-			                  -gpu 0
+TRANSLATION_START=$(date +%s.%N)
+if [[ -d $MODEL_CHECKPOINT ]]; then
+  python $SCRIPT_DIR/ct2_translate.py -model $MODEL_CHECKPOINT \
+                                      -src $TEST_SRC_BPE \
+                                      -output $PREDS_BPE \
+                                      -beam_size $BEAM_SIZE \
+                                      -intra_threads $INTRA_THREADS \
+                                      -inter_threads $INTER_THREADS
+else
+  if [[ "$DEVICE" == "cpu" ]]; then
+    DEVICE_ARGS=""
+  else
+    DEVICE_ARGS="-gpu $DEVICE"
+  fi
+  python $ONMT_DIR/translate.py -model $MODEL_CHECKPOINT \
+                                -src $TEST_SRC_BPE \
+                                -output $PREDS_BPE \
+                                -verbose -replace_unk \
+                                -beam_size $BEAM_SIZE \
+                                $DEVICE_ARGS
+fi
+TRANSLATION_END=$(date +%s.%N)
+NUM_SENTENCES=$(wc -l < $TEST_SRC_BPE)
+SENTS_PER_SEC=$(awk "BEGIN {printf \"%.2f\", $NUM_SENTENCES / ($TRANSLATION_END - $TRANSLATION_START)}")
+echo SENTS_PER_SEC = $SENTS_PER_SEC, MODEL = $(basename $MODEL_CHECKPOINT), DEVICE = $DEVICE
 
 #Postprocess predictions
 postprocess_pred $PREDS_BPE $LANG_TGT > $EVALUATE_DIR/$(basename $MODEL_CHECKPOINT).preds.$LANG_TGT
@@ -0,0 +1,249 @@
+# This script preprocesses the train/valid/test datasets for the NMT training with the same
+# stages as the original preprocess.sh: normalize-punctuation.perl and tokenizer.perl, clean-corpus-n.perl,
+# train-truecaser.perl and truecase.perl, subword-nmt learn-joint-bpe-and-vocab and apply-bpe.
+# The per-line stages (tokenize, truecase and apply-bpe) split each file into line-aligned shards
+# processed on a pool of processes and reassemble the outputs in order, so that the outputs are the same
+# as with a single process. A stage is skipped when its commands and the content of its inputs
+# are the same as in its last run (recorded in a stamp file) and its outputs exist
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+MOSES_DIR = os.path.join(SCRIPT_DIR, '..', '..', 'tools', 'mosesdecoder')
+BPE_OPERATIONS = 50000
+VOCABULARY_THRESHOLD = 50
+MAX_SENTENCE_LENGTH = 80
+# Size in bytes of the blocks read to hash and copy the files
+BLOCK_SIZE = 1 << 20
+
+
+# A job of a stage: a shell command with its input and output files.
+# A sharded job is a filter reading its first input from the standard input and writing
+# its single output to the standard output; the other inputs are files it reads (e.g. models)
+def job(command, inputs, outputs, sharded=False):
+    return {'command': command, 'inputs': inputs, 'outputs': outputs, 'sharded': sharded}
+
+
+def moses_script(moses_dir, script):
+    return 'perl {}'.format(os.path.join(moses_dir, 'scripts', script))
+
+
+# The stages of the preprocessing, in order, as (name, jobs)
+def preprocessing_stages(datasets_dir, preprocess_dir, lang_src, lang_tgt, moses_dir=MOSES_DIR,
+                         tokenizer_threads=1):
+    langs = [lang_src, lang_tgt]
+
+    def path(name):
+        return os.path.join(preprocess_dir, name)
+
+    # Tokenize (also normalize the punctuation to avoid breaking the tokenizer)
+    tokenize = [job('{} -l {} | {} -l {} -no-escape -threads {}'.format(
+                        moses_script(moses_dir, 'tokenizer/normalize-punctuation.perl'), lang,
+                        moses_script(moses_dir, 'tokenizer/tokenizer.perl'), lang, tokenizer_threads),
+                    [os.path.join(datasets_dir, '{}.{}'.format(data, lang))],
+                    [path('{}.tok.{}'.format(data, lang))],
+                    sharded=True)
+                for data in ['train', 'valid', 'test'] for lang in langs]
+
+    # Clean empty and long sentences, and sentences with high source-target ratio (training corpus only)
+    clean = [job('{} {} {} {} {} 1 {}'.format(moses_script(moses_dir, 'training/clean-corpus-n.perl'),
+                                              path('train.tok'), lang_src, lang_tgt, path('train.tok.clean'),
+                                              MAX_SENTENCE_LENGTH),
+                 [path('train.tok.{}'.format(lang)) for lang in langs],
+                 [path('train.tok.clean.{}'.format(lang)) for lang in langs])]
+
+    # Learn the truecase model of the source and target languages
+    train_truecaser = [job('{} -corpus {} -model {}'.format(moses_script(moses_dir, 'recaser/train-truecaser.perl'),
+                                                            path('train.tok.clean.{}'.format(lang)),
+                                                            path('truecase-model.{}'.format(lang))),
+                           [path('train.tok.clean.{}'.format(lang))],
+                           [path('truecase-model.{}'.format(lang))])
+                       for lang in langs]
+
+    # Apply the truecase model to the cleaned train set and to the valid and test sets
+    truecase = [job('{} --model {}'.format(moses_script(moses_dir, 'recaser/truecase.perl'),
+                                           path('truecase-model.{}'.format(lang))),
+                    [path('{}.{}'.format('train.tok.clean' if data == 'train' else data + '.tok', lang)),
+                     path('truecase-model.{}'.format(lang))],
+                    [path('{}.tc.{}'.format(data, lang))],
+                    sharded=True)
+                for data in ['train', 'valid', 'test'] for lang in langs]
+
+    # Learn bpe on both source and target training set
+    learn_bpe = [job('subword-nmt learn-joint-bpe-and-vocab --input {} -s {} -o {} --write-vocabulary {}'.format(
+                         ' '.join(path('train.tc.{}'.format(lang)) for lang in langs), BPE_OPERATIONS,
+                         path('joint_bpe'), ' '.join(path('vocab.{}'.format(lang)) for lang in langs)),
+                     [path('train.tc.{}'.format(lang)) for lang in langs],
+                     [path('joint_bpe')] + [path('vocab.{}'.format(lang)) for lang in langs])]
+
+    # Apply bpe to the train and valid sets
+    apply_bpe = [job('subword-nmt apply-bpe -c {} --vocabulary {} --vocabulary-threshold {}'.format(
+                         path('joint_bpe'), path('vocab.{}'.format(lang)), VOCABULARY_THRESHOLD),
+                     [path('{}.tc.{}'.format(data, lang)), path('joint_bpe'), path('vocab.{}'.format(lang))],
+                     [path('{}.bpe.{}'.format(data, lang))],
+                     sharded=True)
+                 for data in ['train', 'valid'] for lang in langs]
+
+    return [('tokenize', tokenize),
+            ('clean', clean),
+            ('train_truecaser', train_truecaser),
+            ('truecase', truecase),
+            ('learn_bpe', learn_bpe),
+            ('apply_bpe', apply_bpe)]
+
+
+def file_hash(file):
+    sha = hashlib.sha1()
+    with open(file, 'rb') as fn:
+        for block in iter(lambda: fn.read(BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+# Byte offsets splitting a file into at most num_shards line-aligned shards of about the same size
+def shard_offsets(file, num_shards):
+    size = os.path.getsize(file)
+    offsets = [0]
+    with open(file, 'rb') as fn:
+        for i in range(1, num_shards):
+            fn.seek(max(size * i // num_shards, offsets[-1]))
+            if fn.tell() > 0:
+                # Move to the start of the next line, unless the previous byte ends a line
+                fn.seek(fn.tell() - 1)
+                fn.readline()
+            if offsets[-1] < fn.tell() < size:
+                offsets.append(fn.tell())
+    return offsets + [size]
+
+
+def copy_range(src, dst, start, end):
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        fin.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = fin.read(min(BLOCK_SIZE, remaining))
+            fout.write(block)
+            remaining -= len(block)
+
+
+# Run a shell command (the pipes fail if any of their commands fails) with optional input and output files
+def run_command(task):
+    command, stdin_file, stdout_file = task
+    stdin = open(stdin_file, 'rb') if stdin_file else subprocess.DEVNULL
+    stdout = open(stdout_file, 'wb') if stdout_file else None
+    try:
+        subprocess.run('set -o pipefail; ' + command, shell=True, executable='/bin/bash',
+                       stdin=stdin, stdout=stdout, check=True)
+    finally:
+        if stdin_file:
+            stdin.close()
+        if stdout_file:
+            stdout.close()
+
+
+# Concatenate the shard outputs in order into the output file, replaced at once when complete
+def concatenate(files, output):
+    tmp_output = '{}.{}.tmp'.format(output, uuid.uuid4().hex)
+    try:
+        with open(tmp_output, 'wb') as fout:
+            for file in files:
+                with open(file, 'rb') as fin:
+                    shutil.copyfileobj(fin, fout, BLOCK_SIZE)
+        os.replace(tmp_output, output)
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+
+
+# Run the jobs of a stage on the pool, the sharded jobs with num_shards shards each
+def run_jobs(jobs, pool, num_shards, work_dir):
+    tasks = []
+    sharded_outputs = []
+    for job_index, stage_job in enumerate(jobs):
+        if not stage_job['sharded']:
+            tasks.append((stage_job['command'], None, None))
+            continue
+        input_file = stage_job['inputs'][0]
+        offsets = shard_offsets(input_file, num_shards)
+        shard_outputs = []
+        for shard_index, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+            shard_file = os.path.join(work_dir, '{}.{}'.format(job_index, shard_index))
+            copy_range(input_file, shard_file, start, end)
+            tasks.append((stage_job['command'], shard_file, shard_file + '.out'))
+            shard_outputs.append(shard_file + '.out')
+        sharded_outputs.append((shard_outputs, stage_job['outputs'][0]))
+
+    for _ in pool.imap_unordered(run_command, tasks):
+        pass
+    for shard_outputs, output in sharded_outputs:
+        concatenate(shard_outputs, output)
+
+
+# Run a stage unless its commands and inputs are the same as in its last run.
+# Return the time taken by the stage or None when it is skipped
+def run_stage(name, jobs, pool, num_shards, preprocess_dir, force=False):
+    stamp_file = os.path.join(preprocess_dir, '.stamps', '{}.json'.format(name))
+    inputs = sorted(set(input_file for stage_job in jobs for input_file in stage_job['inputs']))
+    outputs = [output for stage_job in jobs for output in stage_job['outputs']]
+    stamp = {'commands': [stage_job['command'] for stage_job in jobs],
+             'inputs': {input_file: file_hash(input_file) for input_file in inputs}}
+
+    if not force and os.path.isfile(stamp_file) and all(os.path.isfile(output) for output in outputs):
+        with open(stamp_file) as fn:
+            if json.load(fn) == stamp:
+                print('Skip {}: its inputs have not changed'.format(name))
+                return None
+
+    print('Run {}...'.format(name))
+    start = time.time()
+    # Remove the stamp first so that an interrupted stage is run again
+    if os.path.isfile(stamp_file):
+        os.remove(stamp_file)
+    with tempfile.TemporaryDirectory(dir=preprocess_dir) as work_dir:
+        run_jobs(jobs, pool, num_shards, work_dir)
+    os.makedirs(os.path.dirname(stamp_file), exist_ok=True)
+    with open(stamp_file, 'w') as fn:
+        json.dump(stamp, fn, indent=1)
+    return time.time() - start
+
+
+def preprocess(datasets_dir, preprocess_dir, lang_src, lang_tgt, moses_dir=MOSES_DIR, num_workers=os.cpu_count(),
+               num_shards=None, tokenizer_threads=1, force=False):
+    os.makedirs(preprocess_dir, exist_ok=True)
+    stages = preprocessing_stages(datasets_dir, preprocess_dir, lang_src, lang_tgt, moses_dir, tokenizer_threads)
+    timings = []
+    with ThreadPool(num_workers) as pool:
+        for name, jobs in stages:
+            timings.append((name, run_stage(name, jobs, pool, num_shards or num_workers, preprocess_dir, force)))
+
+    print('Stage\tTime (s)')
+    for name, stage_time in timings:
+        print('{}\t{}'.format(name, 'skipped' if stage_time is None else round(stage_time, 1)))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datasets_dir', type=str, help='directory of the train/valid/test datasets')
+    parser.add_argument('--preprocess_dir', type=str, help='output directory of the preprocessed datasets')
+    parser.add_argument('--lang_src', type=str, default='en', help='source language')
+    parser.add_argument('--lang_tgt', type=str, default='es', help='target language')
+    parser.add_argument('--moses_dir', type=str, default=MOSES_DIR, help='directory of the Moses decoder')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count(),
+                        help='number of commands run in parallel')
+    parser.add_argument('--num_shards', type=int, default=None,
+                        help='number of shards of each file processed by a per-line stage (default: num_workers)')
+    parser.add_argument('--tokenizer_threads', type=int, default=1, help='threads of each tokenizer.perl command')
+    parser.add_argument('--force', action='store_true', help='run all the stages even if their inputs are unchanged')
+    args = parser.parse_args()
+
+    preprocess(args.datasets_dir, args.preprocess_dir, args.lang_src, args.lang_tgt, args.moses_dir,
+               args.num_workers, args.num_shards, args.tokenizer_threads, args.force)
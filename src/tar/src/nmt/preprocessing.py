@@ -0,0 +1,160 @@
+# This script preprocesses the sentences to translate and postprocesses the translations in-process,
+# with the same chain as the Moses Perl scripts and subword-nmt used by en2es_translate.sh:
+# normalize-punctuation.perl -> tokenizer.perl -no-escape -> truecase.perl -> subword-nmt apply-bpe
+# and its inverse: remove the BPE separators -> detruecase.perl -> detokenizer.perl.
+# The models (truecase model, BPE merges and vocabulary) are loaded once and the lines are processed
+# in chunks on a pool of processes
+import argparse
+import re
+import sys
+from collections import deque
+from multiprocessing import Pool
+from sacremoses import MosesPunctNormalizer, MosesTokenizer, MosesTruecaser, MosesDetruecaser, MosesDetokenizer
+from subword_nmt.apply_bpe import BPE, read_vocabulary
+
+# Number of lines processed at once by a worker
+CHUNK_SIZE = 10000
+VOCABULARY_THRESHOLD = 50
+BPE_SEPARATOR = '@@'
+# Same as sed -r 's/(@@ )|(@@ ?$)//g'
+BPE_SEPARATOR_REGEX = re.compile(r'(@@ )|(@@ ?$)')
+
+
+class Preprocessor:
+    def __init__(self, lang, truecase_model=None, bpe_codes=None, vocabulary=None,
+                 vocabulary_threshold=VOCABULARY_THRESHOLD):
+        self.normalizer = MosesPunctNormalizer(lang=lang)
+        self.tokenizer = MosesTokenizer(lang=lang)
+        self.truecaser = MosesTruecaser(load_from=truecase_model) if truecase_model else None
+        self.bpe = None
+        if bpe_codes:
+            vocab = None
+            if vocabulary:
+                with open(vocabulary, encoding='utf8') as vf:
+                    vocab = read_vocabulary(vf, vocabulary_threshold)
+            with open(bpe_codes, encoding='utf8') as cf:
+                self.bpe = BPE(cf, separator=BPE_SEPARATOR, vocab=vocab)
+
+    def __call__(self, line):
+        text = self.normalizer.normalize(line)
+        text = self.tokenizer.tokenize(text, return_str=True, escape=False)
+        if self.truecaser:
+            # Like truecase.perl, keep the known casings of the words that do not start a sentence
+            text = self.truecaser.truecase(text, return_str=True, use_known=True)
+        if self.bpe:
+            text = self.bpe.process_line(text)
+        return text
+
+
+class Postprocessor:
+    def __init__(self, lang, bpe=True, truecase=True):
+        self.bpe = bpe
+        self.detruecaser = MosesDetruecaser() if truecase else None
+        self.detokenizer = MosesDetokenizer(lang=lang)
+
+    def __call__(self, line):
+        text = BPE_SEPARATOR_REGEX.sub('', line) if self.bpe else line
+        if self.detruecaser:
+            text = self.detruecaser.detruecase(text, return_str=True)
+        return self.detokenizer.detokenize(text.split(), return_str=True)
+
+
+# The processor of the current process: set in the main process before forking the pool
+# (so that workers share the loaded models) and in the pool initializer otherwise
+processor = None
+
+
+def init_processor(line_processor):
+    global processor
+    processor = line_processor
+
+
+def process_chunk(chunk):
+    return [processor(line) for line in chunk]
+
+
+def chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Process the lines in order with at most 2 chunks per worker in flight
+def process_lines(lines, line_processor, num_workers=1, chunk_size=CHUNK_SIZE):
+    init_processor(line_processor)
+    if num_workers <= 1:
+        for chunk in chunks(lines, chunk_size):
+            yield from process_chunk(chunk)
+        return
+
+    pool = Pool(num_workers, initializer=init_processor, initargs=(line_processor,))
+    pending = deque()
+    try:
+        for chunk in chunks(lines, chunk_size):
+            pending.append(pool.apply_async(process_chunk, (chunk,)))
+            if len(pending) >= 2 * num_workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def preprocess(lines, lang, truecase_model=None, bpe_codes=None, vocabulary=None,
+               vocabulary_threshold=VOCABULARY_THRESHOLD, num_workers=1, chunk_size=CHUNK_SIZE):
+    preprocessor = Preprocessor(lang, truecase_model, bpe_codes, vocabulary, vocabulary_threshold)
+    return process_lines(lines, preprocessor, num_workers, chunk_size)
+
+
+def postprocess(lines, lang, bpe=True, truecase=True, num_workers=1, chunk_size=CHUNK_SIZE):
+    postprocessor = Postprocessor(lang, bpe, truecase)
+    return process_lines(lines, postprocessor, num_workers, chunk_size)
+
+
+def read_lines(fn):
+    for line in fn:
+        yield line.rstrip('\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mode', type=str, choices=['preprocess', 'postprocess'],
+                        help='preprocess the sentences to translate or postprocess the translations')
+    parser.add_argument('-lang', type=str, help='language of the text')
+    parser.add_argument('-input', type=str, default='-', help='input file (default: standard input)')
+    parser.add_argument('-output', type=str, default='-', help='output file (default: standard output)')
+    parser.add_argument('-truecase_model', type=str, default=None, help='truecase model (preprocess)')
+    parser.add_argument('-bpe_codes', type=str, default=None, help='BPE merge operations (preprocess)')
+    parser.add_argument('-vocabulary', type=str, default=None, help='BPE vocabulary (preprocess)')
+    parser.add_argument('-vocabulary_threshold', type=int, default=VOCABULARY_THRESHOLD,
+                        help='minimum frequency of the vocabulary words (preprocess)')
+    parser.add_argument('-no_bpe', action='store_true', help='the text has no BPE separators (postprocess)')
+    parser.add_argument('-no_truecase', action='store_true', help='do not detruecase the text (postprocess)')
+    parser.add_argument('-num_workers', type=int, default=1, help='number of processes')
+    parser.add_argument('-chunk_size', type=int, default=CHUNK_SIZE, help='number of lines processed at once')
+    args = parser.parse_args()
+
+    input_file = sys.stdin if args.input == '-' else open(args.input, encoding='utf8')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf8')
+    try:
+        lines = read_lines(input_file)
+        if args.mode == 'preprocess':
+            processed_lines = preprocess(lines, args.lang, args.truecase_model, args.bpe_codes, args.vocabulary,
+                                         args.vocabulary_threshold, args.num_workers, args.chunk_size)
+        else:
+            processed_lines = postprocess(lines, args.lang, not args.no_bpe, not args.no_truecase,
+                                          args.num_workers, args.chunk_size)
+        # Flush every chunk so that the lines are streamed out when writing to a pipe
+        for chunk in chunks(processed_lines, args.chunk_size):
+            output_file.write(''.join(line + '\n' for line in chunk))
+            output_file.flush()
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
@@ -1,15 +1,135 @@
-import statistics as stat
+import argparse
+import mmap
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
+
+# The compressed files (.gz or .zst) are read and written with the I/O module of the translate-retrieve pipeline
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'retrieve'))
+from translate_retrieve_io import file_compression, open_file
+
+# Size in bytes of the chunks of a memory-mapped corpus processed at once
+CHUNK_SIZE = 1 << 24
+# Same threshold as MAX_NUM_TOKENS in retrieve/translate_retrieve_utils.py:
+# longer sentences are split at delimiters before being translated
+MAX_NUM_TOKENS = 10
+PERCENTILES = (50, 90, 95, 99)
+HISTOGRAM_BINS = range(0, 90, 10)
+
+# Lookup table of the ASCII white-space bytes separating the tokens
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[list(b' \t\n\r\x0b\x0c')] = True
+
+
+# Count the white-spaced tokens of each line in a chunk of bytes made of whole lines
+def count_tokens_chunk(chunk):
+    is_space = WHITESPACE[chunk]
+    token_start = ~is_space
+    token_start[1:] &= is_space[:-1]
+    newlines = np.flatnonzero(chunk == ord('\n'))
+    # The last line might not end with a line break
+    line_ends = newlines if chunk[-1] == ord('\n') else np.append(newlines, len(chunk) - 1)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+    return np.add.reduceat(token_start, line_starts, dtype=np.int32)
+
+
+# Compute the number of tokens of every line of a corpus in a single pass.
+# The file is memory-mapped and processed in chunks cut at line breaks
+# (a compressed file is decompressed on the fly instead)
+def tokens_per_line(file, chunk_size=CHUNK_SIZE):
+    if file_compression(file):
+        return tokens_per_line_compressed(file, chunk_size)
+    size = os.path.getsize(file)
+    if size == 0:
+        return np.zeros(0, dtype=np.int32)
+
+    lengths = []
+    with open(file, 'rb') as fn, mmap.mmap(fn.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = min(start + chunk_size, size)
+            if end < size:
+                line_break = mm.rfind(b'\n', start, end)
+                if line_break == -1:
+                    line_break = mm.find(b'\n', end)
+                end = size if line_break == -1 else line_break + 1
+            chunk = np.frombuffer(mm, dtype=np.uint8, count=end - start, offset=start)
+            lengths.append(count_tokens_chunk(chunk))
+            # Release the view on the memory map before it gets closed
+            del chunk
+            start = end
+    return np.concatenate(lengths)
+
+
+def tokens_per_line_compressed(file, chunk_size=CHUNK_SIZE):
+    lengths = [np.zeros(0, dtype=np.int32)]
+    rest = b''
+    with open_file(file, 'rb') as fn:
+        for block in iter(lambda: fn.read(chunk_size), b''):
+            block = rest + block
+            line_break = block.rfind(b'\n')
+            rest = block[line_break + 1:]
+            if line_break != -1:
+                lengths.append(count_tokens_chunk(np.frombuffer(block, dtype=np.uint8, count=line_break + 1)))
+    if rest:
+        lengths.append(count_tokens_chunk(np.frombuffer(rest, dtype=np.uint8)))
+    return np.concatenate(lengths)
+
+
+# Compute the sentence length statistics of a corpus
+def length_statistics(len_sentences, max_num_tokens=MAX_NUM_TOKENS, percentiles=PERCENTILES, bins=HISTOGRAM_BINS):
+    hist, bins = np.histogram(len_sentences, bins=bins)
+    return {'sentences': len(len_sentences),
+            'mean': float(np.mean(len_sentences)),
+            'std': float(np.std(len_sentences, ddof=1)) if len(len_sentences) > 1 else 0.0,
+            'max': int(np.max(len_sentences)),
+            'percentiles': dict(zip(percentiles, np.percentile(len_sentences, percentiles).tolist())),
+            'histogram': (hist, bins),
+            'over_max_num_tokens': float(np.mean(len_sentences >= max_num_tokens))}
+
+
+# Profile the sentence lengths of a parallel corpus with one pass over each file.
+# The share of sentences over max_num_tokens is the share of sentences
+# that would be split by the translate-retrieve pipeline
+def corpus_profile(source_file, target_file=None, max_num_tokens=MAX_NUM_TOKENS,
+                   percentiles=PERCENTILES, bins=HISTOGRAM_BINS):
+    profile = {}
+    source_len = tokens_per_line(source_file)
+    profile['source'] = length_statistics(source_len, max_num_tokens, percentiles, bins)
+    if target_file:
+        target_len = tokens_per_line(target_file)
+        profile['target'] = length_statistics(target_len, max_num_tokens, percentiles, bins)
+        if len(source_len) == len(target_len):
+            profile['pairs_over_max_num_tokens'] = float(np.mean((source_len >= max_num_tokens) |
+                                                                 (target_len >= max_num_tokens)))
+    return profile
+
+
+def print_corpus_profile(profile, max_num_tokens=MAX_NUM_TOKENS):
+    for side in ['source', 'target']:
+        if side not in profile:
+            continue
+        stats = profile[side]
+        print('{}: {} sentences'.format(side, stats['sentences']))
+        print('Average sentence length\tStandard deviation\tMaximum sentence length')
+        print('{}\t{}\t{}'.format(stats['mean'], stats['std'], stats['max']))
+        print('\t'.join('p{}'.format(p) for p in stats['percentiles']))
+        print('\t'.join(str(v) for v in stats['percentiles'].values()))
+        hist, bins = stats['histogram']
+        print('\t'.join(['bin {}'.format(bins[n]) for n in range(len(bins))]))
+        print('\t'.join([str(hist[n]) for n in range(len(bins)-1)]))
+        print('Sentences with {} tokens or more: {:.2f}%\n'.format(max_num_tokens,
+                                                                  stats['over_max_num_tokens'] * 100))
+    if 'pairs_over_max_num_tokens' in profile:
+        print('Pairs with {} tokens or more on any side: {:.2f}%'.format(max_num_tokens,
+                                                                        profile['pairs_over_max_num_tokens'] * 100))
 
 
 # This function computes the average sentence length for a given corpora
 def average_len(file):
-    with open(file) as fn:
-        sentences = fn.readlines()
-
-    len_sentences = [len(sentence.split()) for sentence in sentences]
-    len_avg, len_std, len_max = stat.mean(len_sentences), stat.stdev(len_sentences), max(len_sentences)
+    len_sentences = tokens_per_line(file)
+    stats = length_statistics(len_sentences)
+    len_avg, len_std, len_max = stats['mean'], stats['std'], stats['max']
     print('Average sentence length\tStandard deviation\tMaximum sentence length\n')
     print('{}\t{}\t{}'.format(len_avg, len_std, len_max))
     return len_avg, len_std, len_max
@@ -17,16 +137,26 @@ def average_len(file):
 
 # Compute the histogram for the sentence lenght in a given corpora
 def sentence_len_histogram(file, plot=False):
-    with open(file) as fn:
-        sentences = fn.readlines()
-
-    len_sentences = [len(sentence.split()) for sentence in sentences]
-    hist, bins = np.histogram(len_sentences, bins=range(0, 90, 10))
+    len_sentences = tokens_per_line(file)
+    hist, bins = np.histogram(len_sentences, bins=HISTOGRAM_BINS)
     print('\t'.join(['bin {}'.format(bins[n]) for n in range(len(bins))]))
     print('\t'.join([str(hist[n]) for n in range(len(bins)-1)]))
 
     if plot:
+        import matplotlib.pyplot as plt
         _ = plt.hist(hist, bins=bins)
         plt.title("Sentence length histogram")
         plt.show()
     return hist, bins
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source_file', type=str, help='Source file')
+    parser.add_argument('--target_file', type=str, default=None, help='Target file')
+    parser.add_argument('--max_num_tokens', type=int, default=MAX_NUM_TOKENS,
+                        help='Sentence length threshold used to split sentences before translation')
+    args = parser.parse_args()
+
+    profile = corpus_profile(args.source_file, args.target_file, max_num_tokens=args.max_num_tokens)
+    print_corpus_profile(profile, max_num_tokens=args.max_num_tokens)
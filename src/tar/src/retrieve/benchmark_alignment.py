@@ -0,0 +1,74 @@
+# This script compares the eflomal alignment profiles (fast, balanced, quality) on a SQuAD file
+# in alignment time and answer retrieval accuracy. The content is translated once, then aligned
+# with each profile and the answers are retrieved with the resulting alignments: the percentage
+# of translated answers of the full (answers retrieved from the alignment too) and small datasets
+# measures the alignment quality
+import argparse
+import logging
+import os
+import tempfile
+import time
+import translate_retrieve_utils as utils
+import translate_retrieve_squad_utils as squad_utils
+import translate_retrieve_io as tr_io
+from translate_retrieve_squad import SquadTranslator
+
+SQUAD_FILE = os.path.join(utils.SCRIPT_DIR, '..', '..', 'corpora', 'squad-en', 'dev-v2.0.json')
+
+
+def benchmark_alignment(translator, profiles):
+    content = tr_io.load_json(translator.squad_file)
+    translator.squad_version = content['version']
+    content, num_not_aligned = translator.order_content(translator.collect_content(content))
+    logging.info('Translate {} sentences...'.format(len(content)))
+    content_translated = utils.translate(content, translator.squad_file, translator.output_dir,
+                                         translator.batch_size, translator.devices)
+
+    results = {}
+    for profile in profiles:
+        logging.info('Compute the alignments with the {} profile...'.format(profile))
+        start = time.time()
+        alignments = squad_utils.compute_alignment(content[num_not_aligned:], translator.lang_source,
+                                                   content_translated[num_not_aligned:], translator.lang_target,
+                                                   None, alignment_profile=profile)
+        alignment_time = time.time() - start
+        if len(alignments) != len(content) - num_not_aligned:
+            raise RuntimeError('Got {} alignments for {} sentences'.format(len(alignments),
+                                                                          len(content) - num_not_aligned))
+        alignments = [None] * num_not_aligned + alignments
+
+        translator.content_translations_alignments = {
+            sentence: {'translation': sentence_translated, 'alignment': alignment}
+            for sentence, sentence_translated, alignment in zip(content, content_translated, alignments)}
+        translated_stats = translator.translate_retrieve()
+        results[profile] = {'time': alignment_time,
+                            'full': translated_stats[translator.translated_file(True)]['accuracy'],
+                            'small': translated_stats[translator.translated_file(False)]['accuracy']}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-squad_file', type=str, default=SQUAD_FILE,
+                        help='SQUAD dataset used for the benchmark (default: SQuAD v2.0 dev)')
+    parser.add_argument('-lang_target', type=str, default='es', help='translation language')
+    parser.add_argument('-profiles', type=str, nargs='+', default=squad_utils.ALIGNMENT_PROFILES,
+                        choices=squad_utils.ALIGNMENT_PROFILES, help='alignment profiles to compare')
+    parser.add_argument('-batch_size', type=int, default=32, help='batch_size for the translation script')
+    parser.add_argument('-devices', type=str, nargs='+', default=None,
+                        help='translation devices (see translate_retrieve_squad.py)')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        translator = SquadTranslator(args.squad_file, 'en', args.lang_target, output_dir,
+                                     alignment_type=None,
+                                     answers_from_alignment=True,
+                                     batch_size=args.batch_size,
+                                     all_outputs=True,
+                                     devices=args.devices)
+        results = benchmark_alignment(translator, args.profiles)
+
+    print('Profile\tAlignment time (s)\tTranslated answers full (%)\tTranslated answers small (%)')
+    for profile, result in results.items():
+        print('{}\t{:.1f}\t{}\t{}'.format(profile, result['time'], result['full'], result['small']))
@@ -0,0 +1,131 @@
+# This script compares the answer retrieval with and without the approximate matching of the answers translated
+# (-approximate_threshold) on a SQuAD file, in percentage of retrieved answers by strategy and latency per answer.
+# The content is translated and aligned once (reused from the output directory when given), then the answers are
+# retrieved with each threshold. With -synthetic, the translation and the alignment are replaced by the identity
+# and a part of the answers are perturbed like an independent translation of the answer would be (inflection,
+# article, punctuation), so that the percentage of answers retrieved at their original position is also reported
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+import translate_retrieve_utils as utils
+import translate_retrieve_squad_utils as squad_utils
+import translate_retrieve_io as tr_io
+import translate_retrieve_online as online
+from benchmark_retrieve import identity_translations_alignments
+from translate_retrieve_squad import SquadTranslator
+
+SQUAD_FILE = os.path.join(utils.SCRIPT_DIR, '..', '..', 'corpora', 'squad-en', 'dev-v1.1.json')
+STRATEGIES = [squad_utils.EXACT_MATCH_NEAR_ALIGNMENT, squad_utils.EXACT_MATCH, squad_utils.APPROXIMATE_MATCH,
+              squad_utils.ALIGNMENT, squad_utils.NOT_FOUND]
+ARTICLES = ['the', 'a', 'el', 'la', 'los', 'las', 'un', 'una']
+
+
+# Perturb an answer with an inflection (plural), an article or a trailing punctuation difference
+def perturb_answer(text, rng):
+    words = text.split()
+    perturbation = rng.randrange(3)
+    if perturbation == 0 and words[-1].isalpha():
+        words[-1] = words[-1][:-1] if words[-1].endswith('s') else words[-1] + 's'
+    elif perturbation == 1:
+        words = words[1:] if len(words) > 1 and words[0].lower() in ARTICLES else [rng.choice(ARTICLES)] + words
+    else:
+        return text[:-1] if text[-1] in '.,' else text + rng.choice('.,')
+    return ' '.join(words)
+
+
+# Collect the examples of the retrieval: each answer with its translation, and the translated and aligned context
+def retrieval_examples(translator, synthetic=False, perturbation_rate=0.5, seed=0):
+    rng = random.Random(seed)
+    content = tr_io.load_json(translator.squad_file)
+    examples = []
+    for data in content['data']:
+        for paragraph in data['paragraphs']:
+            context = paragraph['context']
+            context_translated, context_alignment_tok = translator.translate_context(context)
+            for answer in [answer for qa in paragraph['qas']
+                           for answer in qa['answers'] + qa.get('plausible_answers', [])]:
+                answer_translated = translator.content_translations_alignments[answer['text']]['translation']
+                if synthetic and answer_translated and rng.random() < perturbation_rate:
+                    answer_translated = perturb_answer(answer_translated, rng)
+                examples.append((answer, answer_translated, context, context_translated, context_alignment_tok))
+    return examples
+
+
+def benchmark_approximate(examples, approximate_threshold):
+    counts = {strategy: 0 for strategy in STRATEGIES}
+    latencies = []
+    # Latencies of the answers not found verbatim, retrieved by the fallbacks
+    fallback_latencies = []
+    num_original = 0
+    for answer, answer_translated, context, context_translated, context_alignment_tok in examples:
+        start = time.time()
+        answer_translated, answer_translated_start, strategy = squad_utils.retrieve_answer_translated(
+            answer, answer_translated, context, context_translated, context_alignment_tok, True,
+            approximate_threshold)
+        latencies.append(time.time() - start)
+        if strategy not in [squad_utils.EXACT_MATCH_NEAR_ALIGNMENT, squad_utils.EXACT_MATCH]:
+            fallback_latencies.append(latencies[-1])
+        counts[strategy] += 1
+        # With the identity translation, the answer retrieved is right when it is the original one
+        num_original += answer_translated == answer['text'] and answer_translated_start == answer['answer_start']
+    return {'counts': counts, 'latencies': latencies, 'fallback_latencies': fallback_latencies,
+            'original': num_original}
+
+
+def percentage(count, total):
+    return round(100 * count / total, 2) if total else 0.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-squad_file', type=str, default=SQUAD_FILE, help='SQuAD file used for the benchmark')
+    parser.add_argument('-lang_target', type=str, default='es', help='translation language')
+    parser.add_argument('-thresholds', type=float, nargs='+', default=[0.9, 0.8, 0.7],
+                        help='similarity thresholds of the approximate matching to compare with the current retrieval')
+    parser.add_argument('-output_dir', type=str, default=None,
+                        help='directory of the translations and alignments (reused when present)')
+    parser.add_argument('-batch_size', type=int, default=32, help='batch_size for the translation script')
+    parser.add_argument('-devices', type=str, nargs='+', default=None,
+                        help='translation devices (see translate_retrieve_squad.py)')
+    parser.add_argument('-synthetic', action='store_true',
+                        help='identity translation and alignment, with perturbed answers')
+    parser.add_argument('-perturbation_rate', type=float, default=0.5,
+                        help='fraction of the answers perturbed with -synthetic')
+    parser.add_argument('-seed', type=int, default=0, help='seed of the perturbations')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = args.output_dir or tmp_dir
+        os.makedirs(output_dir, exist_ok=True)
+        translator = SquadTranslator(args.squad_file, 'en', args.lang_target, output_dir,
+                                     alignment_type=None,
+                                     answers_from_alignment=True,
+                                     batch_size=args.batch_size,
+                                     devices=args.devices)
+        if args.synthetic:
+            translator.content_translations_alignments = identity_translations_alignments(translator)
+        else:
+            translator.translate_align_content()
+        examples = retrieval_examples(translator, args.synthetic, args.perturbation_rate, args.seed)
+
+    print('Threshold\tRetrieved small (%)\tRetrieved full (%)\t{}\t{}Mean (ms)\tp99 (ms)\tFallback mean (ms)'.format(
+        '\t'.join('{} (%)'.format(strategy) for strategy in STRATEGIES),
+        'Original answers (%)\t' if args.synthetic else ''))
+    for threshold in [None] + args.thresholds:
+        result = benchmark_approximate(examples, threshold)
+        counts, latencies = result['counts'], result['latencies']
+        retrieved_full = len(examples) - counts[squad_utils.NOT_FOUND]
+        fallback_latencies = result['fallback_latencies']
+        print('{}\t{}\t{}\t{}\t{}{:.3f}\t{:.3f}\t{:.3f}'.format(
+            threshold or 'current',
+            percentage(retrieved_full - counts[squad_utils.ALIGNMENT], len(examples)),
+            percentage(retrieved_full, len(examples)),
+            '\t'.join(str(percentage(counts[strategy], len(examples))) for strategy in STRATEGIES),
+            '{}\t'.format(percentage(result['original'], len(examples))) if args.synthetic else '',
+            1000 * sum(latencies) / max(1, len(latencies)),
+            1000 * (online.percentile(latencies, 99) or 0),
+            1000 * sum(fallback_latencies) / max(1, len(fallback_latencies))))
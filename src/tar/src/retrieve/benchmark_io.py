@@ -0,0 +1,77 @@
+# This script compares the load and dump times of the standard json module and of the
+# serialization layer (translate_retrieve_io) on SQuAD files, and checks that the outputs are identical.
+# It then compares the load and dump times and the file size of the uncompressed, gzip and zstd files
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+import translate_retrieve_io as tr_io
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+SQUAD_ES_FILES = sorted(glob.glob(os.path.join(SCRIPT_DIR, '../../../../SQuAD-es-v*/*.json')))
+
+
+def json_load(filename):
+    with open(filename) as fn:
+        return json.load(fn)
+
+
+def json_dump(obj, filename):
+    with open(filename, 'w') as fn:
+        json.dump(obj, fn)
+
+
+# Return the fastest time of a function over a number of runs
+def timeit(function, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_io(squad_file, repeat=5):
+    content = json_load(squad_file)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_file = os.path.join(tmp_dir, 'json.json')
+        tr_io_file = os.path.join(tmp_dir, 'tr_io.json')
+        result = {'json load': timeit(json_load, repeat, squad_file),
+                  '{} load'.format(tr_io.JSON_BACKEND): timeit(tr_io.load_json, repeat, squad_file),
+                  'json dump': timeit(json_dump, repeat, content, json_file),
+                  'tr_io dump': timeit(tr_io.dump_json, repeat, content, tr_io_file)}
+        with open(json_file, 'rb') as jf, open(tr_io_file, 'rb') as tf:
+            result['identical output'] = jf.read() == tf.read()
+        result['identical content'] = tr_io.load_json(squad_file) == content
+    return result
+
+
+def benchmark_compression(squad_file, repeat=5, compressions=('', '.gz', '.zst')):
+    content = tr_io.load_json(squad_file)
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for compression in compressions:
+            output_file = os.path.join(tmp_dir, 'squad.json' + compression)
+            name = compression.lstrip('.') or 'uncompressed'
+            result['{} dump'.format(name)] = timeit(tr_io.dump_json, repeat, content, output_file)
+            result['{} load'.format(name)] = timeit(tr_io.load_json, repeat, output_file)
+            result['{} size'.format(name)] = '{:.2f} MB'.format(os.path.getsize(output_file) / (1 << 20))
+            result['{} identical content'.format(name)] = tr_io.load_json(output_file) == content
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('squad_files', type=str, nargs='*', default=SQUAD_ES_FILES,
+                        help='SQUAD files used for the benchmark (default: the SQuAD-es dev files)')
+    parser.add_argument('-repeat', type=int, default=5, help='number of runs (the fastest is reported)')
+    args = parser.parse_args()
+
+    for squad_file in args.squad_files:
+        result = benchmark_io(squad_file, args.repeat)
+        result.update(benchmark_compression(squad_file, args.repeat))
+        print(os.path.basename(squad_file))
+        for name, value in result.items():
+            print('\t{}: {}'.format(name, '{:.3f} s'.format(value) if isinstance(value, float) else value))
@@ -0,0 +1,132 @@
+# This script benchmarks the answer retrieval step (translate_retrieve) of the SquadTranslator
+# in wall-clock time and peak memory. The translation and the alignment are replaced
+# by the identity (each sentence is its own translation, aligned token by token), so that
+# only the retrieval and the cleaning of the dataset are measured.
+# With -baseline, the retrieval code of another git revision (e.g. the commit before a change) is benchmarked
+# too on the same file, and the translated datasets of both are compared
+import argparse
+import filecmp
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+import translate_retrieve_utils as utils
+import translate_retrieve_io as tr_io
+from translate_retrieve_squad import SquadTranslator
+
+
+# Build identity translations and alignments for all the content of a SQuAD file
+def identity_translations_alignments(translator):
+    content = tr_io.load_json(translator.squad_file)
+
+    sentences = set()
+    for data in content['data']:
+        sentences.add(data['title'])
+        for paragraph in data['paragraphs']:
+            sentences.update(translator.context_sentences(paragraph['context']))
+            for qa in paragraph['qas']:
+                sentences.add(qa['question'])
+                for answer in qa['answers'] + qa.get('plausible_answers', []):
+                    sentences.add(answer['text'])
+
+    content_translations_alignments = {}
+    for sentence in sentences:
+        num_tokens = len(utils.token_offsets(sentence, translator.lang_source))
+        content_translations_alignments[sentence] = {
+            'translation': sentence,
+            'alignment': ' '.join('{}-{}'.format(i, i) for i in range(num_tokens))}
+    return content_translations_alignments
+
+
+def benchmark_retrieve(translator, repeat=1):
+    translator.content_translations_alignments = identity_translations_alignments(translator)
+    # Older revisions read the version in translate_align_content and do not return the statistics
+    translator.squad_version = tr_io.load_json(translator.squad_file)['version']
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        stats = list((translator.translate_retrieve() or {None: {'accuracy': None}}).values())[0]
+        timings.append(time.time() - start)
+
+    # Measure the peak memory on a separate run since tracing slows down the execution
+    tracemalloc.start()
+    translator.translate_retrieve()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'time': min(timings), 'peak_memory': peak_memory, 'accuracy': stats['accuracy']}
+
+
+# Run the benchmark on the retrieval code of a git revision in a separate process: the retrieve directory of the
+# revision is exported next to a copy of this script (and of translate_retrieve_io.py, which older revisions lack)
+def benchmark_revision(revision, squad_file, output_dir, answers_from_alignment=False, repeat=1):
+    # The directory is archived from the top of the repository (git archive restricts the tree to the current one)
+    top_dir, prefix = subprocess.run(['git', 'rev-parse', '--show-toplevel', '--show-prefix'], cwd=utils.SCRIPT_DIR,
+                                     stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.splitlines()
+    archive = subprocess.run(['git', 'archive', '{}:{}'.format(revision, prefix)], cwd=top_dir,
+                             stdout=subprocess.PIPE, check=True).stdout
+    with tempfile.TemporaryDirectory() as code_dir:
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            tar.extractall(code_dir)
+        shutil.copy(os.path.realpath(__file__), code_dir)
+        if not os.path.exists(os.path.join(code_dir, 'translate_retrieve_io.py')):
+            shutil.copy(os.path.join(utils.SCRIPT_DIR, 'translate_retrieve_io.py'), code_dir)
+        cmd = [sys.executable, os.path.join(code_dir, os.path.basename(__file__)), '-squad_file',
+               os.path.abspath(squad_file), '-output_dir', output_dir, '-repeat', str(repeat), '-json']
+        if answers_from_alignment:
+            cmd.append('-answers_from_alignment')
+        return json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout.splitlines()[-1])
+
+
+# Compare the translated datasets written by two runs
+def same_outputs(output_dir, baseline_dir):
+    files = [file for file in os.listdir(output_dir) if file.endswith('.json') and '-sample' not in file]
+    return all(os.path.exists(os.path.join(baseline_dir, file)) and
+               filecmp.cmp(os.path.join(output_dir, file), os.path.join(baseline_dir, file), shallow=False)
+               for file in files)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-squad_file', type=str, help='SQUAD dataset used for the benchmark')
+    parser.add_argument('-answers_from_alignment', action='store_true',
+                        help='retrieve translated answers only from the alignment')
+    parser.add_argument('-repeat', type=int, default=3, help='number of timed runs (the fastest is reported)')
+    parser.add_argument('-baseline', type=str, default=None,
+                        help='git revision whose retrieval is benchmarked too, e.g. the commit before a change')
+    parser.add_argument('-output_dir', type=str, default=None,
+                        help='directory of the translated datasets (default: a temporary directory)')
+    parser.add_argument('-json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = args.output_dir or os.path.join(tmp_dir, 'current')
+        os.makedirs(output_dir, exist_ok=True)
+        translator = SquadTranslator(args.squad_file, 'en', 'es', output_dir,
+                                     alignment_type='forward',
+                                     answers_from_alignment=args.answers_from_alignment,
+                                     batch_size=32)
+        results = [('current', benchmark_retrieve(translator, args.repeat))]
+        if args.json:
+            print(json.dumps(results[0][1]))
+            sys.exit()
+        if args.baseline:
+            baseline_dir = os.path.join(tmp_dir, 'baseline')
+            os.makedirs(baseline_dir)
+            results.insert(0, (args.baseline, benchmark_revision(args.baseline, args.squad_file, baseline_dir,
+                                                                 args.answers_from_alignment, args.repeat)))
+            same = same_outputs(output_dir, baseline_dir)
+
+    print('File\tCode\tTime (s)\tPeak memory (MB)\tRetrieved answers (%)')
+    for code, result in results:
+        print('{}\t{}\t{:.2f}\t{:.1f}\t{}'.format(args.squad_file, code, result['time'],
+                                                 result['peak_memory'] / 2 ** 20, result['accuracy'] or '-'))
+    if args.baseline:
+        print('Same translated datasets: {}'.format('yes' if same else 'no'))
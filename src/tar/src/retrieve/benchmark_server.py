@@ -0,0 +1,116 @@
+# Load test of the translation server (translate_retrieve_server.py) with stub models: concurrent clients
+# send the paragraphs of a SQuAD file (or a sample example) and the throughput, the client latencies and the
+# server metrics (latency by stage and micro-batch sizes) are reported for each maximum batch size.
+# The stub models take a fixed time per batch, like a translation model on a GPU, so that
+# the micro-batching shows in the throughput
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import translate_retrieve_io as tr_io
+import translate_retrieve_online as online
+from translate_retrieve_server import make_server
+
+SAMPLE_EXAMPLE = {'context': 'The Normans were the people who in the 10th and 11th centuries gave their name '
+                             'to Normandy, a region in France. They were descended from Norse raiders and pirates '
+                             'from Denmark, Iceland and Norway.',
+                  'qas': [{'id': '1', 'question': 'In what country is Normandy located?',
+                           'answers': [{'text': 'France', 'answer_start': 104}]},
+                          {'id': '2', 'question': 'From which countries did the Norse originate?',
+                           'answers': [{'text': 'Denmark, Iceland and Norway', 'answer_start': 168}]}]}
+
+
+def post_json(url, obj):
+    request = urllib.request.Request(url, data=json.dumps(obj).encode('utf8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def load_test(url, examples, num_clients, num_requests):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(client_index):
+        for i in range(num_requests):
+            example = examples[(client_index * num_requests + i) % len(examples)]
+            start = time.time()
+            try:
+                post_json(url + '/translate', example)
+            except urllib.error.HTTPError as e:
+                # The server reports the error in the body
+                with lock:
+                    errors.append('{}: {}'.format(e, e.read().decode('utf8', 'replace')))
+                continue
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.time() - start)
+
+    start = time.time()
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(num_clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return {'time': time.time() - start, 'latencies': latencies, 'errors': errors}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-squad_file', type=str, default=None,
+                        help='SQuAD file whose paragraphs are sent (default: a sample example)')
+    parser.add_argument('-num_clients', type=int, default=16, help='number of concurrent clients')
+    parser.add_argument('-num_requests', type=int, default=50, help='number of requests sent by each client')
+    parser.add_argument('-max_batch_sizes', type=int, nargs='+', default=[1, online.MAX_BATCH_SIZE],
+                        help='maximum micro-batch sizes to compare (1 disables the batching)')
+    parser.add_argument('-max_wait_ms', type=float, default=online.MAX_WAIT * 1000,
+                        help='maximum wait of the micro-batching, in milliseconds')
+    parser.add_argument('-stub_latency_ms', type=float, default=20, help='latency of each batch of the stub models')
+    args = parser.parse_args()
+
+    if args.squad_file:
+        examples = [paragraph for data in tr_io.load_json(args.squad_file)['data'] for paragraph in data['paragraphs']]
+    else:
+        examples = [SAMPLE_EXAMPLE]
+
+    print('Max batch size\tRequests/s\tp50 (ms)\tp99 (ms)\tErrors\tMean translation batch\tMean alignment batch')
+    for max_batch_size in args.max_batch_sizes:
+        translator = online.OnlineTranslator(online.stub_translator(args.stub_latency_ms / 1000),
+                                             online.stub_aligner('en', args.stub_latency_ms / 1000),
+                                             max_batch_size=max_batch_size, max_wait=args.max_wait_ms / 1000)
+        # Listen on a free port
+        server = make_server(translator, port=0)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            result = load_test(url, examples, args.num_clients, args.num_requests)
+            metrics = get_json(url + '/metrics')
+        finally:
+            server.shutdown()
+            server.server_close()
+            translator.close()
+
+        latencies, errors = result['latencies'], result['errors']
+        # Without any successful request, there are no latency percentiles
+        p50, p99 = ((round(online.percentile(latencies, q) * 1000, 1) for q in (50, 99)) if latencies
+                    else ('-', '-'))
+        print('{}\t{:.1f}\t{}\t{}\t{}\t{}\t{}'.format(max_batch_size, len(latencies) / result['time'], p50, p99,
+                                                      len(errors),
+                                                      metrics['translation_batches']['mean_size'],
+                                                      metrics['alignment_batches']['mean_size']))
+        if errors:
+            print('Errors: {}'.format('; '.join(sorted({str(e) for e in errors}))))
+        print('Server latencies: {}'.format(json.dumps({stage: value for stage, value in metrics.items()
+                                                        if isinstance(value, dict) and 'p50_ms' in value})))
@@ -0,0 +1,180 @@
+# Serialization of the datasets.
+# The datasets are decoded with the fastest available JSON library: orjson or msgspec when they are
+# installed, the standard library otherwise. They are always encoded with the standard library,
+# the only encoder producing the same bytes as json.dump (ASCII escapes and ', ' ': ' separators),
+# but in one shot instead of the many small writes done by json.dump.
+# The files are compressed according to their extension (.gz or .zst), with a streaming (de)compressor
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import uuid
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# zstandard is optional: without it, the .zst files are (de)compressed with the zstd command
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+    loads = orjson.loads
+elif msgspec is not None:
+    JSON_BACKEND = 'msgspec'
+    loads = msgspec.json.decode
+else:
+    JSON_BACKEND = 'json'
+    loads = json.loads
+
+# Number of JSON lines written at once
+JSON_LINES_BATCH_SIZE = 1000
+
+# Compression levels by file extension
+COMPRESSION_LEVELS = {'.gz': 6, '.zst': 3}
+# Threads of the compression: zstd compresses in parallel, and so does gzip when pigz is installed
+COMPRESSION_THREADS = os.cpu_count()
+
+
+# Compression extension of a file (.gz or .zst) or an empty string for an uncompressed file
+def file_compression(filename):
+    extension = os.path.splitext(filename)[1]
+    return extension if extension in COMPRESSION_LEVELS else ''
+
+
+# Binary stream over the output (reading) or the input (writing) of a compression command
+class CommandStream(io.RawIOBase):
+    def __init__(self, cmd, filename, mode):
+        if mode == 'rb':
+            self.process = subprocess.Popen(cmd + [filename], stdout=subprocess.PIPE)
+            self.pipe = self.process.stdout
+        else:
+            with open(filename, mode) as fn:
+                self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=fn)
+            self.pipe = self.process.stdin
+        self.mode = mode
+
+    def readable(self):
+        return self.mode == 'rb'
+
+    def writable(self):
+        return self.mode != 'rb'
+
+    def readinto(self, b):
+        return self.pipe.readinto(b)
+
+    def write(self, b):
+        return self.pipe.write(b)
+
+    def close(self):
+        if self.closed:
+            return
+        self.pipe.close()
+        returncode = self.process.wait()
+        super().close()
+        # A reader closed before the end stops the command with a broken pipe
+        if returncode and (self.mode != 'rb' or returncode != -13):
+            raise IOError('{} failed with exit code {}'.format(' '.join(self.process.args), returncode))
+
+
+def open_compressed(filename, mode, compression):
+    level = COMPRESSION_LEVELS[compression]
+    if compression == '.gz':
+        if mode == 'rb':
+            return gzip.open(filename, 'rb')
+        if shutil.which('pigz'):
+            return io.BufferedWriter(CommandStream(['pigz', '-c', '-{}'.format(level),
+                                                    '-p', str(COMPRESSION_THREADS)], filename, mode))
+        return gzip.open(filename, mode, compresslevel=level)
+    if zstandard is not None:
+        if mode == 'rb':
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True))
+        compressor = zstandard.ZstdCompressor(level=level, threads=COMPRESSION_THREADS)
+        return compressor.stream_writer(open(filename, mode), closefd=True, write_return_read=True)
+    if mode == 'rb':
+        return io.BufferedReader(CommandStream(['zstd', '-q', '-d', '-c'], filename, mode))
+    return io.BufferedWriter(CommandStream(['zstd', '-q', '-c', '-{}'.format(level),
+                                            '-T{}'.format(COMPRESSION_THREADS)], filename, mode))
+
+
+# Open a file, (de)compressed on the fly when its extension (or the compression given) is .gz or .zst.
+# The compressed files are opened for reading or writing (r, w, rb or wb), in text mode with UTF-8
+# unless another encoding is given. This is also the compressed I/O of nmt/utils.py and qa/join_squad_datasets.py
+def open_file(filename, mode='r', compression=None, encoding=None):
+    compression = file_compression(filename) if compression is None else compression
+    if not compression:
+        return open(filename, mode, encoding=encoding)
+    if mode not in ('r', 'w', 'rb', 'wb'):
+        raise ValueError('Unsupported mode {} for the compressed file {}'.format(mode, filename))
+    fn = open_compressed(filename, mode.rstrip('b') + 'b', compression)
+    return fn if 'b' in mode else io.TextIOWrapper(fn, encoding=encoding or 'utf8')
+
+
+# Write a file atomically: the content is written to a temporary file in the same directory,
+# which replaces the file once closed without error. Readers and concurrent runs never see a partial file.
+# The file is compressed according to its extension
+@contextmanager
+def atomic_open(filename, mode='w'):
+    tmp_filename = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+    try:
+        with open_file(tmp_filename, mode, file_compression(filename)) as fn:
+            yield fn
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def dumps(obj):
+    return json.dumps(obj)
+
+
+def load_json(filename):
+    with open_file(filename, 'rb') as fn:
+        return loads(fn.read())
+
+
+def dump_json(obj, filename):
+    with atomic_open(filename) as fn:
+        fn.write(dumps(obj))
+
+
+def load_json_lines(filename):
+    with open_file(filename, 'rb') as fn:
+        return [loads(line) for line in fn if line.strip()]
+
+
+# Write JSON lines in batches. The output is the same as a json.dump followed by a line break per object
+class JSONLinesWriter:
+    def __init__(self, fn, batch_size=JSON_LINES_BATCH_SIZE):
+        self.fn = fn
+        self.batch_size = batch_size
+        self.batch = []
+
+    def write(self, obj):
+        self.batch.append(dumps(obj))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.fn.write('\n'.join(self.batch) + '\n')
+            self.batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
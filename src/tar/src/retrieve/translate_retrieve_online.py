@@ -0,0 +1,388 @@
+# Online translation of single SQuAD examples (a context with its questions and answers): the same
+# segment -> translate -> align -> retrieve path as SquadTranslator, one example at a time.
+# The sentences of concurrent examples are coalesced into micro-batches for the translator and the aligner:
+# a batch is sent when it reaches the maximum batch size or when its first example has waited the maximum wait.
+# The translator and the aligner are functions from a list of sentences (sentence pairs) to the list of their
+# translations (alignments): the NMT model and the alignment priors loaded for the life of the service,
+# the translation and alignment scripts, or stubs to test the service without models
+import copy
+import logging
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import translate_retrieve_utils as utils
+import translate_retrieve_squad_utils as squad_utils
+from translate_retrieve_squad import SquadTranslator
+
+NMT_DIR = os.path.join(utils.SCRIPT_DIR, '..', 'nmt')
+ALIGNMENT_DIR = os.path.join(utils.SCRIPT_DIR, '..', 'alignment')
+sys.path.append(NMT_DIR)
+sys.path.append(ALIGNMENT_DIR)
+
+# Models of en2es_translate.sh
+CT2_MODEL = os.path.join(NMT_DIR, 'data', 'en2es', 'train', 'shared', 'en2es_average_model_ct2_int8')
+PREPROCESS_DIR = os.path.join(NMT_DIR, 'data', 'en2es', 'preprocess')
+MOSES_DIR = os.path.join(utils.SCRIPT_DIR, '..', '..', 'tools', 'mosesdecoder')
+BEAM_SIZE = 5
+PREPROCESSING_CHAINS = ['perl', 'python']
+# Compiled priors of compute_alignment.sh (compile_priors.py), by source and target language
+PRIORS_BIN = os.path.join(ALIGNMENT_DIR, 'data', 'align.priors.{}-{}.bin')
+
+MAX_BATCH_SIZE = 64
+# Maximum time in seconds that a sentence waits for other sentences to be batched with
+MAX_WAIT = 0.01
+# Number of latencies kept to compute the percentiles
+METRICS_WINDOW = 10000
+
+
+# Coalesce the items submitted by concurrent callers into batches processed by a single worker thread
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT, name='batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batch_sizes = deque(maxlen=METRICS_WINDOW)
+        self.worker = threading.Thread(target=self.run, name=name, daemon=True)
+        self.worker.start()
+
+    # Submit a list of items. Return a future of the list of their results
+    def submit(self, items):
+        future = Future()
+        if not items:
+            future.set_result([])
+        else:
+            self.requests.put((list(items), future))
+        return future
+
+    def close(self):
+        self.requests.put(None)
+        self.worker.join()
+
+    # Take the requests of the next batch: the first one blocks, the next ones until the batch is full or
+    # the first one has waited max_wait. A request larger than the batch size is a batch on its own
+    def next_batch(self):
+        request = self.requests.get()
+        if request is None:
+            return None
+        batch = [request]
+        batch_size = len(request[0])
+        deadline = time.time() + self.max_wait
+        while batch_size < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Stop after this batch
+                self.requests.put(None)
+                break
+            batch.append(request)
+            batch_size += len(request[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            items = [item for request_items, _ in batch for item in request_items]
+            self.batch_sizes.append(len(items))
+            try:
+                results = self.process_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError('Got {} results for a batch of {} items'.format(len(results), len(items)))
+            except Exception as e:
+                logging.exception('Batch of {} items failed'.format(len(items)))
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for request_items, future in batch:
+                future.set_result(results[start:start + len(request_items)])
+                start += len(request_items)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+# Latencies of the last requests by stage, in seconds
+class LatencyMetrics:
+    def __init__(self, window=METRICS_WINDOW):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.window = window
+        self.num_requests = 0
+        self.num_errors = 0
+
+    def add(self, stage, latency):
+        with self.lock:
+            self.latencies.setdefault(stage, deque(maxlen=self.window)).append(latency)
+
+    def count(self, error=False):
+        with self.lock:
+            self.num_requests += 1
+            self.num_errors += int(error)
+
+    def summary(self):
+        with self.lock:
+            latencies = {stage: list(values) for stage, values in self.latencies.items()}
+            summary = {'requests': self.num_requests, 'errors': self.num_errors}
+        for stage, values in latencies.items():
+            summary[stage] = {'p50_ms': round(percentile(values, 50) * 1000, 2),
+                              'p99_ms': round(percentile(values, 99) * 1000, 2)}
+        return summary
+
+
+# Long-lived command giving an output line per input line as soon as it is read (e.g. the Moses scripts with -b).
+# The lines of a call are written by a thread while their outputs are read
+class LineProcess:
+    def __init__(self, cmd, env=None):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, shell=True, executable='/bin/bash', stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, env=env, universal_newlines=True, encoding='utf8')
+        self.lock = threading.Lock()
+
+    def write_lines(self, lines):
+        try:
+            self.process.stdin.write(''.join(line.replace('\n', ' ') + '\n' for line in lines))
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            # The process exited: the reader gets the end of its output
+            pass
+
+    def __call__(self, lines):
+        with self.lock:
+            writer = threading.Thread(target=self.write_lines, args=(lines,), daemon=True)
+            writer.start()
+            outputs = []
+            for _ in lines:
+                line = self.process.stdout.readline()
+                if not line:
+                    raise RuntimeError('{} exited with status {}'.format(self.cmd, self.process.wait()))
+                outputs.append(line.rstrip('\n'))
+            writer.join()
+            return outputs
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+# Translation with the NMT model loaded once for the life of the service: the CTranslate2 model of
+# en2es_translate.sh (see convert_ct2.sh) and its pre- and postprocessing, either long-lived Moses Perl
+# and subword-nmt processes (perl) or the Python chain of preprocessing.py in-process (python)
+class ModelTranslator:
+    def __init__(self, ct2_model=CT2_MODEL, device='cpu', device_index=0, beam_size=BEAM_SIZE,
+                 batch_size=MAX_BATCH_SIZE, intra_threads=0, preprocessing='perl'):
+        import ctranslate2
+        self.translator = ctranslate2.Translator(ct2_model, device=device, device_index=device_index,
+                                                 intra_threads=intra_threads)
+        self.beam_size = beam_size
+        self.batch_size = batch_size
+        truecase_model = os.path.join(PREPROCESS_DIR, 'truecase-model.en')
+        bpe_codes = os.path.join(PREPROCESS_DIR, 'joint_bpe')
+        vocabulary = os.path.join(PREPROCESS_DIR, 'vocab.en')
+        if preprocessing == 'perl':
+            moses_scripts = os.path.join(MOSES_DIR, 'scripts')
+            # Same commands as en2es_translate.sh, unbuffered
+            self.preprocess = LineProcess(
+                'perl {0}/tokenizer/normalize-punctuation.perl -b -l en | '
+                'perl {0}/tokenizer/tokenizer.perl -b -l en -no-escape | '
+                'perl {0}/recaser/truecase.perl -b --model {1} | '
+                'subword-nmt apply-bpe -c {2} --vocabulary {3} --vocabulary-threshold 50'.format(
+                    moses_scripts, truecase_model, bpe_codes, vocabulary),
+                env=dict(os.environ, PYTHONUNBUFFERED='1', LC_ALL='en_US.UTF-8'))
+            self.postprocess = LineProcess(
+                "sed -u -r 's/(@@ )|(@@ ?$)//g' | "
+                'perl {0}/recaser/detruecase.perl -b | '
+                'perl {0}/tokenizer/detokenizer.perl -b -l es'.format(moses_scripts),
+                env=dict(os.environ, LC_ALL='en_US.UTF-8'))
+        else:
+            import preprocessing as nmt_preprocessing
+            preprocessor = nmt_preprocessing.Preprocessor('en', truecase_model, bpe_codes, vocabulary)
+            postprocessor = nmt_preprocessing.Postprocessor('es')
+            self.preprocess = lambda lines: [preprocessor(line) for line in lines]
+            self.postprocess = lambda lines: [postprocessor(line) for line in lines]
+
+    def __call__(self, sentences):
+        results = self.translator.translate_batch([line.split() for line in self.preprocess(sentences)],
+                                                  max_batch_size=self.batch_size, beam_size=self.beam_size,
+                                                  replace_unknowns=True)
+        return [line.strip() for line in self.postprocess([' '.join(result.hypotheses[0]) for result in results])]
+
+    def close(self):
+        for process in (self.preprocess, self.postprocess):
+            if isinstance(process, LineProcess):
+                process.close()
+
+
+# Alignment with the compiled priors loaded once for the life of the service: the priors of the words of each
+# batch are extracted in-process and given to compute_alignment.sh. eflomal has no model to keep loaded:
+# it samples the alignment of each batch from the priors
+class PriorsAligner:
+    def __init__(self, priors_bin, lang_source, lang_target, alignment_type=None,
+                 alignment_profile=squad_utils.ALIGNMENT_PROFILE):
+        import compile_priors
+        self.priors = compile_priors.BinaryPriors(priors_bin)
+        self.lang_source = lang_source
+        self.lang_target = lang_target
+        self.alignment_type = alignment_type
+        self.alignment_profile = alignment_profile
+
+    def __call__(self, sentence_pairs):
+        source_words = {word.encode('utf8') for source, _ in sentence_pairs
+                        for word in utils.tokenize(source, self.lang_source).split()}
+        target_words = {word.encode('utf8') for _, translation in sentence_pairs
+                        for word in utils.tokenize(translation, self.lang_target).split()}
+        with tempfile.NamedTemporaryFile(suffix='.priors') as priors_file:
+            self.priors.extract(source_words, target_words, priors_file)
+            priors_file.flush()
+            return squad_utils.compute_alignment([source for source, _ in sentence_pairs], self.lang_source,
+                                                 [translation for _, translation in sentence_pairs],
+                                                 self.lang_target, self.alignment_type,
+                                                 alignment_profile=self.alignment_profile,
+                                                 priors_file=priors_file.name)
+
+    def close(self):
+        self.priors.close()
+
+
+# Translation and alignment with the scripts of the batch pipeline: the model and the priors are loaded
+# for every batch
+def script_translator(batch_size, devices=None):
+    def translate_batch(sentences):
+        return list(utils.translate_stream(sentences, batch_size, devices))
+    return translate_batch
+
+
+def script_aligner(lang_source, lang_target, alignment_type=None, alignment_profile=squad_utils.ALIGNMENT_PROFILE):
+    def align_batch(sentence_pairs):
+        return squad_utils.compute_alignment([source for source, _ in sentence_pairs], lang_source,
+                                             [translation for _, translation in sentence_pairs], lang_target,
+                                             alignment_type, alignment_profile=alignment_profile)
+    return align_batch
+
+
+# Stubs: each sentence is its own translation, aligned token by token, after a fixed latency per batch
+def stub_translator(latency=0.0):
+    def translate_batch(sentences):
+        time.sleep(latency)
+        return list(sentences)
+    return translate_batch
+
+
+def stub_aligner(lang_source, latency=0.0):
+    def align_batch(sentence_pairs):
+        time.sleep(latency)
+        return [' '.join('{}-{}'.format(i, i) for i in range(len(utils.token_offsets(source, lang_source))))
+                for source, _ in sentence_pairs]
+    return align_batch
+
+
+class OnlineTranslator:
+    def __init__(self,
+                 translate_batch,
+                 align_batch,
+                 lang_source='en',
+                 lang_target='es',
+                 answers_from_alignment=True,
+                 max_batch_size=MAX_BATCH_SIZE,
+                 max_wait=MAX_WAIT,
+                 split_delimiters=utils.SPLIT_DELIMITER,
+                 max_num_tokens=utils.MAX_NUM_TOKENS,
+                 max_segment_tokens=None,
+                 approximate_threshold=None):
+        # The retrieval of SquadTranslator, applied to the translations and alignments of one example
+        self.squad_translator = SquadTranslator(None, lang_source, lang_target, None,
+                                                alignment_type=None,
+                                                answers_from_alignment=answers_from_alignment,
+                                                batch_size=max_batch_size,
+                                                split_delimiters=split_delimiters,
+                                                max_num_tokens=max_num_tokens,
+                                                max_segment_tokens=max_segment_tokens,
+                                                approximate_threshold=approximate_threshold)
+        self.translation_batcher = MicroBatcher(translate_batch, max_batch_size, max_wait, 'translation')
+        self.alignment_batcher = MicroBatcher(align_batch, max_batch_size, max_wait, 'alignment')
+        self.metrics = LatencyMetrics()
+
+    def close(self):
+        self.translation_batcher.close()
+        self.alignment_batcher.close()
+
+    # Translate an example: a SQuAD paragraph with a context and a list of questions (qas) with their answers
+    # (and plausible answers when is_impossible is set, as in SQuAD v2.0).
+    # Return the translated paragraph, with the questions without answers retrieved removed,
+    # and the strategy that retrieved each answer
+    def translate_example(self, paragraph):
+        start = time.time()
+        try:
+            result = self._translate_example(paragraph)
+        except Exception:
+            self.metrics.count(error=True)
+            raise
+        self.metrics.count()
+        self.metrics.add('total', time.time() - start)
+        return result
+
+    def _translate_example(self, paragraph):
+        # A shallow copy of the translator holds the translations and alignments of this example
+        translator = copy.copy(self.squad_translator)
+        translator.squad_version = 'v2.0' if any('is_impossible' in qa for qa in paragraph['qas']) else 'v1.1'
+
+        start = time.time()
+        plausible = translator.squad_version == 'v2.0'
+        content_roles = {'context': [sentence for sentence in translator.context_sentences(paragraph['context'])
+                                     if sentence],
+                         'question': [qa['question'] for qa in paragraph['qas'] if qa['question']],
+                         'answer': [answer['text'] for qa in paragraph['qas'] for answer in qa['answers']
+                                    if answer['text']],
+                         'plausible_answer': [answer['text'] for qa in paragraph['qas']
+                                              if plausible and qa['is_impossible']
+                                              for answer in qa['plausible_answers']]}
+        content, num_not_aligned = translator.order_content(content_roles)
+        self.metrics.add('segment', time.time() - start)
+
+        start = time.time()
+        content_translated = self.translation_batcher.submit(content).result()
+        self.metrics.add('translate', time.time() - start)
+
+        start = time.time()
+        alignments = self.alignment_batcher.submit(list(zip(content[num_not_aligned:],
+                                                            content_translated[num_not_aligned:]))).result()
+        self.metrics.add('align', time.time() - start)
+
+        start = time.time()
+        alignments = [None] * num_not_aligned + alignments
+        translator.content_translations_alignments = {
+            sentence: {'translation': sentence_translated, 'alignment': alignment}
+            for sentence, sentence_translated, alignment in zip(content, content_translated, alignments)}
+        stats = {from_alignment: {'total_answers': 0, 'total_correct_answers': 0,
+                                  'total_correct_plausible_answers': 0}
+                 for from_alignment in translator.output_variants}
+        strategies = []
+        paragraphs_cleaned = translator.translate_retrieve_paragraph(paragraph, stats, strategies)
+        self.metrics.add('retrieve', time.time() - start)
+        return {'paragraph': paragraphs_cleaned[translator.output_variants[0]], 'strategies': strategies}
+
+    def metrics_summary(self):
+        summary = self.metrics.summary()
+        for name, batcher in (('translation', self.translation_batcher), ('alignment', self.alignment_batcher)):
+            batch_sizes = list(batcher.batch_sizes)
+            summary['{}_batches'.format(name)] = {
+                'count': len(batch_sizes),
+                'mean_size': round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else None}
+        return summary
@@ -0,0 +1,145 @@
+# Local HTTP server translating single SQuAD examples with the online translator (translate_retrieve_online.py).
+#   POST /translate with a SQuAD paragraph: {"context": ..., "qas": [{"id": ..., "question": ..., "answers": [...]}]}
+#   returns {"paragraph": <translated paragraph or null>, "strategies": [...]}
+#   GET /metrics returns the number of requests, the p50/p99 latencies by stage and the micro-batch sizes
+import argparse
+import json
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import translate_retrieve_squad_utils as squad_utils
+import translate_retrieve_online as online
+
+logging.basicConfig(level=logging.INFO)
+
+# Maximum size in bytes of a request body
+MAX_REQUEST_SIZE = 1 << 20
+
+
+# A thread per request (http.server.ThreadingHTTPServer from Python 3.7)
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # Listen backlog: the default of 5 drops (and delays by a second) the connections of concurrent clients
+    request_queue_size = 128
+
+
+class TranslateRequestHandler(BaseHTTPRequestHandler):
+    # Set by make_server
+    translator = None
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.translator.metrics_summary())
+        else:
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/translate':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_SIZE:
+            self.send_json(413, {'error': 'request larger than {} bytes'.format(MAX_REQUEST_SIZE)})
+            return
+        try:
+            paragraph = json.loads(self.rfile.read(length))
+            if not isinstance(paragraph.get('context'), str) or not isinstance(paragraph.get('qas'), list):
+                raise ValueError('the example needs a context and a list of qas')
+        except (ValueError, AttributeError) as e:
+            self.send_json(400, {'error': 'invalid example: {}'.format(e)})
+            return
+        try:
+            self.send_json(200, self.translator.translate_example(paragraph))
+        except Exception as e:
+            logging.exception('Translation failed')
+            self.send_json(500, {'error': str(e)})
+
+    # Log the requests at debug level only: the access log would slow down the server under load
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+def make_server(translator, host='127.0.0.1', port=8080):
+    handler = type('Handler', (TranslateRequestHandler,), {'translator': translator})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('-port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('-lang_source', type=str, default='en', help='language of the examples')
+    parser.add_argument('-lang_target', type=str, default='es', help='translation language')
+    parser.add_argument('-answers_from_alignment', action='store_true',
+                        help='retrieve translated answers from the alignment too')
+    parser.add_argument('-approximate_threshold', type=float, default=None,
+                        help='similarity threshold of the approximate matching of the answers')
+    parser.add_argument('-alignment_type', type=str, default=None, choices=squad_utils.ALIGNMENT_TYPES,
+                        help='alignment direction (default: the one of the alignment profile)')
+    parser.add_argument('-alignment_profile', type=str, default=squad_utils.ALIGNMENT_PROFILE,
+                        choices=squad_utils.ALIGNMENT_PROFILES, help='eflomal alignment profile')
+    parser.add_argument('-devices', type=str, nargs='+', default=None,
+                        help='translation devices (see translate_retrieve_squad.py)')
+    parser.add_argument('-ct2_model', type=str, default=online.CT2_MODEL,
+                        help='CTranslate2 model kept loaded by the server (the translation script is run for '
+                             'every batch when it does not exist)')
+    parser.add_argument('-device', type=str, default='cpu', help='device of the CTranslate2 model: cpu or cuda:<index>')
+    parser.add_argument('-preprocessing', type=str, default='perl', choices=online.PREPROCESSING_CHAINS,
+                        help='pre/postprocessing of the CTranslate2 model: the Moses Perl scripts or preprocessing.py')
+    parser.add_argument('-priors_bin', type=str, default=None,
+                        help='compiled alignment priors kept loaded by the server '
+                             '(default: alignment/data/align.priors.<lang_source>-<lang_target>.bin when it exists)')
+    parser.add_argument('-max_batch_size', type=int, default=online.MAX_BATCH_SIZE,
+                        help='maximum number of sentences translated or aligned at once')
+    parser.add_argument('-max_wait_ms', type=float, default=online.MAX_WAIT * 1000,
+                        help='maximum time a sentence waits for others to be batched with, in milliseconds')
+    parser.add_argument('-stub_models', action='store_true',
+                        help='replace the translation and alignment by the identity (to test the service)')
+    parser.add_argument('-stub_latency_ms', type=float, default=0,
+                        help='latency of each batch of the stub models, in milliseconds')
+    args = parser.parse_args()
+
+    if args.stub_models:
+        translate_batch = online.stub_translator(args.stub_latency_ms / 1000)
+        align_batch = online.stub_aligner(args.lang_source, args.stub_latency_ms / 1000)
+    else:
+        if os.path.isdir(args.ct2_model):
+            device, _, device_index = args.device.partition(':')
+            translate_batch = online.ModelTranslator(args.ct2_model, device, int(device_index or 0),
+                                                     batch_size=args.max_batch_size,
+                                                     preprocessing=args.preprocessing)
+        else:
+            logging.warning('No CTranslate2 model {}: the translation script loads the model for every '
+                            'batch'.format(args.ct2_model))
+            translate_batch = online.script_translator(args.max_batch_size, args.devices)
+        priors_bin = args.priors_bin or online.PRIORS_BIN.format(args.lang_source, args.lang_target)
+        if os.path.isfile(priors_bin):
+            align_batch = online.PriorsAligner(priors_bin, args.lang_source, args.lang_target, args.alignment_type,
+                                               args.alignment_profile)
+        else:
+            align_batch = online.script_aligner(args.lang_source, args.lang_target, args.alignment_type,
+                                                args.alignment_profile)
+    translator = online.OnlineTranslator(translate_batch, align_batch, args.lang_source, args.lang_target,
+                                         args.answers_from_alignment, args.max_batch_size, args.max_wait_ms / 1000,
+                                         approximate_threshold=args.approximate_threshold)
+    server = make_server(translator, args.host, args.port)
+    logging.info('Listening on http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        translator.close()
+        for model in (translate_batch, align_batch):
+            if hasattr(model, 'close'):
+                model.close()
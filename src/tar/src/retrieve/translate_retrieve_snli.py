@@ -1,4 +1,3 @@
-import json
 import time
 import subprocess
 import csv
@@ -8,6 +7,7 @@ from collections import defaultdict
 import pickle
 import argparse
 import translate_retrieve_utils as utils
+import translate_retrieve_io as tr_io
 from nltk import sent_tokenize
 import logging
 import stanza
@@ -51,7 +51,8 @@ class SNLITranslator:
                  output_dir,
                  alignment_type,
                  answers_from_alignment,
-                 batch_size):
+                 batch_size,
+                 devices=None):
 
         self.snli_file = snli_file
         self.lang_source = lang_source
@@ -60,6 +61,7 @@ class SNLITranslator:
         self.alignment_type = alignment_type
         self.answers_from_alignment = answers_from_alignment
         self.batch_size = batch_size
+        self.devices = utils.parse_devices(devices)
 
         # initialize content_translations_alignments
         self.content_translations_alignments = defaultdict()
@@ -78,17 +80,13 @@ class SNLITranslator:
         nlp = stanza.Pipeline('es', processors='tokenize,mwt,pos,lemma,depparse')
 
         # Load snli content and get snli contexts
-        with open(self.snli_file) as hn:
-            lines = hn.readlines()
-        content_lines = []
-        for line in lines:
-            content_lines.append(json.loads(line))
+        content_lines = tr_io.load_json_lines(self.snli_file)
 
         # Check if the content of SNLI has been translated and aligned already
         content_translations_alignments_file = os.path.join(self.output_dir,
-                                                    '{}_content_translations_alignments.{}'.format(
+                                                    '{}_content_translations_alignments.{}{}'.format(
                                                         os.path.basename(self.snli_file),
-                                                        self.lang_target))
+                                                        self.lang_target, tr_io.file_compression(self.snli_file)))
         if not os.path.isfile(content_translations_alignments_file):
             # Extract contexts, questions and answers. The context is further
             # divided into sentence in order to translate and compute the alignment.
@@ -119,9 +117,11 @@ class SNLITranslator:
                 sentences_two_binary_parse.extend(tokenize_sentences_unlimited_size(content['sentence2_binary_parse'],
                                                                            lang=self.lang_source))
 
-            sentence_one_translated = utils.translate(sentences_one, self.snli_file, self.output_dir, self.batch_size)
+            sentence_one_translated = utils.translate(sentences_one, self.snli_file, self.output_dir, self.batch_size,
+                                                      self.devices)
             sentence_two_translated = utils.translate(sentences_two, self.snli_file,
-                                                      self.output_dir, self.batch_size)
+                                                      self.output_dir, self.batch_size,
+                                                      self.devices)
 
             logging.info('Collected {} sentence to translate'.format(len(sentences_one)))
 
@@ -129,7 +129,8 @@ class SNLITranslator:
                                        os.path.basename(self.snli_file).replace(
                                            '.json',
                                            '-{}_small.json'.format(self.lang_target)))
-            with open(translated_file, 'w') as fn:
+            # Write the lines in batches
+            with tr_io.atomic_open(translated_file) as fn, tr_io.JSONLinesWriter(fn) as writer:
                 i = 0
                 for content in tqdm(content_lines):
                     content_line = {}
@@ -144,14 +145,13 @@ class SNLITranslator:
                     content_line['captionID'] = content['captionID']
                     content_line['gold_label'] = content['gold_label']
                     content_line['pairID'] = content['pairID']
-                    json.dump(content_line, fn)
-                    fn.write('\n')
+                    writer.write(content_line)
                     i = i + 1
 
         # Load content translated and aligned from file
         else:
             logging.info('Use previously content translations and alignments')
-            with open(content_translations_alignments_file, 'rb') as fn:
+            with tr_io.open_file(content_translations_alignments_file, 'rb') as fn:
                 self.content_translations_alignments = pickle.load(fn)
 
 
@@ -169,6 +169,10 @@ if __name__ == "__main__":
                         default='forward', help='use a given translation service')
     parser.add_argument('-batch_size', type=int, default='32', help='batch_size for the translation script '
                                                                     '(change this value in case of CUDA out-of-memory')
+    parser.add_argument('-devices', type=str, nargs='+', default=None,
+                        help='translation devices, each a GPU index or a CPU thread group (cpu or cpu:<cores>, '
+                             'e.g. cpu:0-3); cpus:<n> splits the CPU cores into n groups. '
+                             'The sentences are sharded among the devices (default: GPU 0)')
     args = parser.parse_args()
     # Create output directory if doesn't exist already
     try:
@@ -182,7 +186,8 @@ if __name__ == "__main__":
                                  args.output_dir,
                                  args.alignment_type,
                                  args.answers_from_alignment,
-                                 args.batch_size)
+                                 args.batch_size,
+                                 args.devices)
 
     logging.info('Translate SNLI textual content')
     translator.translate_align_content()
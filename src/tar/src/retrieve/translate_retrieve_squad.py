@@ -6,15 +6,21 @@ from tqdm import tqdm
 import os
 from collections import defaultdict
 import pickle
+import hashlib
 import argparse
 import translate_retrieve_utils as utils
 import translate_retrieve_squad_utils as squad_utils
+import translate_retrieve_io as tr_io
 from tqdm import tqdm
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
 class SquadTranslator:
+    # Roles of the content to align: the retrieval only reads the alignments of the context sentences.
+    # The titles, questions and answers are translated but not aligned
+    ALIGNED_ROLES = ['context']
+
     def __init__(self,
                  squad_file,
                  lang_source,
@@ -22,112 +28,443 @@ class SquadTranslator:
                  output_dir,
                  alignment_type,
                  answers_from_alignment,
-                 batch_size):
-
+                 batch_size,
+                 split_delimiters=utils.SPLIT_DELIMITER,
+                 max_num_tokens=utils.MAX_NUM_TOKENS,
+                 max_segment_tokens=None,
+                 all_outputs=False,
+                 devices=None,
+                 alignment_profile=squad_utils.ALIGNMENT_PROFILE,
+                 incremental=False,
+                 previous_manifest=None,
+                 sample_size=None,
+                 sample_seed=0,
+                 approximate_threshold=None):
+
+        # Sampling mode: the pipeline runs on a stratified sample of sample_size paragraphs of the dataset,
+        # written to the output directory, and the accuracy is reported with its confidence interval.
+        # The strata (thresholds and number of paragraphs in the dataset) are kept for the interval
+        self.sample_size = sample_size
+        self.sample_strata = None
+        if sample_size:
+            squad_file, self.sample_strata = self.write_sample(squad_file, output_dir, sample_size, sample_seed)
         self.squad_file = squad_file
         self.lang_source = lang_source
         self.lang_target = lang_target
         self.output_dir = output_dir
         self.alignment_type = alignment_type
+        # eflomal profile trading the alignment quality for speed (fast, balanced or quality)
+        self.alignment_profile = alignment_profile
         self.answers_from_alignment = answers_from_alignment
+        # Minimum similarity of the answers matched approximately near their aligned start when they are not
+        # found verbatim (None disables the approximate matching)
+        self.approximate_threshold = approximate_threshold
         self.batch_size = batch_size
+        self.devices = utils.parse_devices(devices)
+
+        # Output variants: with answers retrieved from the alignment (full dataset) and/or
+        # without them (small dataset). Both are built from the same retrieval with all_outputs
+        self.output_variants = [True, False] if all_outputs else [answers_from_alignment]
+
+        # Sentence splitting before translation: sentences with at least max_num_tokens tokens
+        # are split at the split delimiters, then the segments longer than max_segment_tokens
+        # are split at clause boundaries. Tune them to the translation model
+        self.split_delimiters = split_delimiters
+        self.max_num_tokens = max_num_tokens
+        self.max_segment_tokens = max_segment_tokens
 
         # initialize content_translations_alignmentss
         self.content_translations_alignments = defaultdict()
 
+        # Incremental mode: the results of the paragraphs (and the translations of the titles) unchanged since
+        # the run that wrote the previous manifest are reused, only the new or changed paragraphs are translated,
+        # aligned and retrieved. The manifest of this run is written to manifest_file.
+        # The manifest and the other intermediate files are compressed like the SQuAD file (.gz or .zst)
+        self.incremental = incremental
+        self.manifest_file = os.path.join(output_dir, '{}_manifest.{}{}'.format(
+            os.path.basename(squad_file), lang_target, tr_io.file_compression(squad_file))) if incremental else None
+        self.previous_manifest = previous_manifest or self.manifest_file
+        self.previous_results = {'titles': {}, 'paragraphs': {}}
+        self.results = {'titles': {}, 'paragraphs': {}}
+
         # initialize SQuAD version
         self.squad_version = ''
 
+    # Write the sample of a SQuAD file, named after its size and seed.
+    # Return the sample file and its strata thresholds and sizes
+    @staticmethod
+    def write_sample(squad_file, output_dir, sample_size, sample_seed):
+        content = tr_io.load_json(squad_file)
+        sample, thresholds, strata_sizes = squad_utils.sample_squad(content, sample_size, sample_seed)
+        sample_file = os.path.join(output_dir, os.path.basename(squad_file).replace(
+            '.json', '-sample{}_{}.json'.format(sample_size, sample_seed)))
+        tr_io.dump_json(sample, sample_file)
+        logging.info('Sample of {} paragraphs in {} articles of {}: {}'.format(
+            sum(len(data['paragraphs']) for data in sample['data']), len(sample['data']),
+            os.path.basename(squad_file), sample_file))
+        return sample_file, {'thresholds': thresholds, 'sizes': strata_sizes}
+
+    # Split a context into the sentences (segments) to translate and align
+    def context_sentences(self, context):
+        return squad_utils.tokenize_sentences(squad_utils.remove_line_breaks(context),
+                                              lang=self.lang_source,
+                                              delimiter=self.split_delimiters,
+                                              max_size=self.max_num_tokens,
+                                              max_segment_size=self.max_segment_tokens)
+
+    # Extract the titles, context sentences, questions, answers and plausible answers (SQuAD v2.0)
+    # to translate from the content of a SQuAD file, by role
+    def collect_content(self, content):
+        # Extract contexts, questions and answers. The context is further
+        # divided into sentence in order to translate and compute the alignment.
+        titles = [data['title']
+                  for data in tqdm(content['data'])]
+        context_sentences = [context_sentence
+                             for data in tqdm(content['data'])
+                             for paragraph in tqdm(data['paragraphs'])
+                             for context_sentence in tqdm(self.context_sentences(paragraph['context']))
+                             if context_sentence]
+
+        questions = [qa['question']
+                     for data in tqdm(content['data'])
+                     for paragraph in tqdm(data['paragraphs'])
+                     for qa in paragraph['qas']
+                     if qa['question']]
+
+        answers = [answer['text']
+                   for data in tqdm(content['data'])
+                   for paragraph in tqdm(data['paragraphs'])
+                   for qa in paragraph['qas']
+                   for answer in qa['answers']
+                   if answer['text']]
+
+        # extract plausible answers when 'is_impossible == True' for SQUAD v2.0
+        if self.squad_version == 'v2.0':
+            plausible_answers = []
+            for data in tqdm(content['data']):
+                for paragraph in tqdm(data['paragraphs']):
+                    for qa in paragraph['qas']:
+                        if qa['is_impossible']:
+                            for answer in qa['plausible_answers']:
+                                plausible_answers.append(answer['text'])
+        else:
+            plausible_answers = []
+
+        return {'title': titles,
+                'context': context_sentences,
+                'question': questions,
+                'answer': answers,
+                'plausible_answer': plausible_answers}
+
+    # Remove the duplicated sentences of the content collected by role and order them with the sentences
+    # to align last, so that the others are translated first and only the last ones are streamed to the alignment.
+    # Return the sentences and the number of sentences not aligned
+    def order_content(self, content_roles):
+        aligned = set(sentence
+                      for role in self.ALIGNED_ROLES
+                      for sentence in content_roles[role])
+        not_aligned = set(sentence
+                          for sentences in content_roles.values()
+                          for sentence in sentences) - aligned
+        return list(not_aligned) + list(aligned), len(not_aligned)
+
+    # Translate the content of a SQuAD dataset (titles, context sentences, questions and answers) and align
+    # the content of the aligned roles (the context sentences) with its translation.
+    # Return a dictionary with the sentences as keys and their translation/alignment as values
+    def translate_align(self, content):
+        content, num_not_aligned = self.order_content(self.collect_content(content))
+        logging.info('Collected {} sentence to translate, {} to align'.format(len(content),
+                                                                         len(content) - num_not_aligned))
+
+        # Translate contexts, questions and answers all together. Also remove duplicates before
+        # to translate with set. The translations of the sentences to align are streamed to the alignment
+        # as they are produced, so that they are tokenized for the alignment while the translation goes on
+        content_translated = []
+        translation_end = None
+
+        def collect_translations():
+            nonlocal translation_end
+            for sentence_translated in utils.translate_stream(content, self.batch_size, self.devices):
+                content_translated.append(sentence_translated)
+                translation_end = time.time()
+                if len(content_translated) > num_not_aligned:
+                    yield sentence_translated
+
+        translations = collect_translations()
+        content_aligned = content[num_not_aligned:]
+        if content_aligned:
+            # Compute alignments
+            alignments = squad_utils.compute_alignment(content_aligned,
+                                                       self.lang_source,
+                                                       translations,
+                                                       self.lang_target,
+                                                       self.alignment_type,
+                                                       self.squad_file,
+                                                       self.output_dir,
+                                                       self.alignment_profile)
+            alignment_end = time.time()
+        else:
+            alignments = []
+        # Translate the remaining sentences if nothing is aligned
+        for _ in translations:
+            pass
+        if len(content_translated) != len(content) or len(alignments) != len(content_aligned):
+            raise RuntimeError('Got {} translations and {} alignments for {} sentences ({} to align)'.format(
+                len(content_translated), len(alignments), len(content), len(content_aligned)))
+
+        # The alignment computation runs once its input is complete, that is, when the translation ends
+        if content_aligned:
+            alignment_time = alignment_end - translation_end
+            logging.info('Aligned {} pairs in {} s, skipped {} pairs not read by the retrieval '
+                         '(about {} s saved)'.format(len(content_aligned), round(alignment_time, 1),
+                                                     num_not_aligned,
+                                                     round(alignment_time / len(content_aligned)
+                                                           * num_not_aligned, 1)))
+
+        # Add translations and alignments. The sentences not aligned have no alignment
+        alignments = [None] * num_not_aligned + alignments
+        content_translations_alignments = {}
+        for sentence, sentence_translated, alignment in zip(content,
+                                                            content_translated,
+                                                            alignments):
+            content_translations_alignments[sentence] = {'translation': sentence_translated,
+                                                           'alignment': alignment}
+        return content_translations_alignments
+
     # Translate all the textual content in the SQUAD dataset, that are, context, questions and answers.
-    # The alignment between context and its translation is then computed.
+    # The alignment between the content of the aligned roles (the context sentences) and its translation
+    # is then computed.
     # The output is a dictionary with context, question, answer as keys and their translation/alignment as values
     def translate_align_content(self):
         # Load squad content and get squad contexts
-        with open(self.squad_file) as hn:
-            content = json.load(hn)
+        content = tr_io.load_json(self.squad_file)
 
         # Get SQuAD version
         self.squad_version = content['version']
 
-        # Check is the content of SQUAD has been translated and aligned already
-        content_translations_alignments_file = os.path.join(self.output_dir,
-                                                    '{}_content_translations_alignments.{}'.format(
-                                                        os.path.basename(self.squad_file), self.lang_target))
-        if not os.path.isfile(content_translations_alignments_file):
-            # Extract contexts, questions and answers. The context is further
-            # divided into sentence in order to translate and compute the alignment.
-            titles = [data['title']
-                      for data in tqdm(content['data'])]
-            context_sentences = [context_sentence
-                                 for data in tqdm(content['data'])
-                                 for paragraph in tqdm(data['paragraphs'])
-                                 for context_sentence in
-                                 tqdm(utils.tokenize_sentences(squad_utils.remove_line_breaks(paragraph['context']),
-                                                               lang=self.lang_source))
-                                 if context_sentence]
-
-            questions = [qa['question']
-                         for data in tqdm(content['data'])
-                         for paragraph in tqdm(data['paragraphs'])
-                         for qa in paragraph['qas']
-                         if qa['question']]
-
-            answers = [answer['text']
-                       for data in tqdm(content['data'])
-                       for paragraph in tqdm(data['paragraphs'])
-                       for qa in paragraph['qas']
-                       for answer in qa['answers']
-                       if answer['text']]
-
-            # extract plausible answers when 'is_impossible == True' for SQUAD v2.0
-            if self.squad_version == 'v2.0':
-                plausible_answers = []
-                for data in tqdm(content['data']):
-                    for paragraph in tqdm(data['paragraphs']):
-                        for qa in paragraph['qas']:
-                            if qa['is_impossible']:
-                                for answer in qa['plausible_answers']:
-                                    plausible_answers.append(answer['text'])
-            else:
-                plausible_answers = []
-
-            content = titles + context_sentences + questions + answers + plausible_answers
-
-            # Remove duplicated while keeping the order of occurrence
-            # content = sorted(set(content), key=content.index)
-            content = set(content)
-            logging.info('Collected {} sentence to translate'.format(len(content)))
-
-            # Translate contexts, questions and answers all together and write to file.
-            # Also remove duplicates before to translate with set
-            content_translated = utils.translate(content, self.squad_file, self.output_dir, self.batch_size)
+        # Only translate the content of the new or changed paragraphs in incremental mode
+        if self.incremental:
+            self.load_previous_manifest()
+            content = self.changed_content(content)
+            self.content_translations_alignments = self.translate_align(content) if content['data'] else {}
+            return
 
-            # Compute alignments
-            context_sentence_questions_answers_alignments = squad_utils.compute_alignment(content,
-                                                                                    self.lang_source,
-                                                                                    content_translated,
-                                                                                    self.lang_target,
-                                                                                    self.alignment_type,
-                                                                                    self.squad_file,
-                                                                                    self.output_dir)
-
-            # Add translations and alignments
-            for sentence, sentence_translated, alignment in zip(content,
-                                                                content_translated,
-                                                                context_sentence_questions_answers_alignments):
-                self.content_translations_alignments[sentence] = {'translation': sentence_translated,
-                                                               'alignment': alignment}
-            with open(content_translations_alignments_file, 'wb') as fn:
-                pickle.dump(self.content_translations_alignments, fn)
-
-        # Load content translated and aligned from file
+        # Check is the content of SQUAD has been translated and aligned already, with the same settings
+        content_translations_alignments_file = os.path.join(self.output_dir,
+                                                    '{}_content_translations_alignments.{}{}'.format(
+                                                        os.path.basename(self.squad_file), self.lang_target,
+                                                        tr_io.file_compression(self.squad_file)))
+        if os.path.isfile(content_translations_alignments_file):
+            with tr_io.open_file(content_translations_alignments_file, 'rb') as fn:
+                previous = pickle.load(fn)
+            if previous.get('settings') == self.translation_settings():
+                logging.info('Use previously content translations and alignments')
+                self.content_translations_alignments = previous['content_translations_alignments']
+                return
+            logging.info('The content translations and alignments {} have other settings: translate and align '
+                         'the content again'.format(content_translations_alignments_file))
+
+        self.content_translations_alignments = self.translate_align(content)
+        with tr_io.atomic_open(content_translations_alignments_file, 'wb') as fn:
+            pickle.dump({'settings': self.translation_settings(),
+                         'content_translations_alignments': self.content_translations_alignments}, fn)
+
+    # Settings of the translation and alignment: the content translated and aligned by a previous run is only
+    # reused with the same ones. The sentence splitting settings change the sentences translated
+    def translation_settings(self):
+        return {'lang_source': self.lang_source,
+                'lang_target': self.lang_target,
+                'alignment_type': self.alignment_type,
+                'alignment_profile': self.alignment_profile,
+                'split_delimiters': list(self.split_delimiters),
+                'max_num_tokens': self.max_num_tokens,
+                'max_segment_tokens': self.max_segment_tokens}
+
+    # Settings of the translation and retrieval: the results of a previous run are only reused with the same ones
+    def settings(self):
+        return {**self.translation_settings(),
+                'squad_version': self.squad_version,
+                'output_variants': self.output_variants,
+                'approximate_threshold': self.approximate_threshold}
+
+    # Fingerprint of a paragraph: its context, questions and answers
+    @staticmethod
+    def paragraph_fingerprint(paragraph):
+        return hashlib.blake2b(json.dumps(paragraph, sort_keys=True).encode('utf8'), digest_size=16).hexdigest()
+
+    def load_previous_manifest(self):
+        if not os.path.isfile(self.previous_manifest):
+            logging.info('No previous manifest {}: translate all the paragraphs'.format(self.previous_manifest))
+            return
+        with tr_io.open_file(self.previous_manifest, 'rb') as fn:
+            previous_manifest = pickle.load(fn)
+        if previous_manifest['settings'] != self.settings():
+            logging.info('The previous manifest {} has other settings: translate all the paragraphs'.format(
+                self.previous_manifest))
+            return
+        self.previous_results = previous_manifest['results']
+
+    # Keep the articles and paragraphs with content to translate: the paragraphs without previous results
+    # and the titles without previous translation
+    def changed_content(self, content):
+        changed_data = []
+        num_paragraphs, num_changed_paragraphs, num_changed_articles = 0, 0, 0
+        fingerprints = set()
+        for data in content['data']:
+            paragraphs = []
+            for paragraph in data['paragraphs']:
+                fingerprint = self.paragraph_fingerprint(paragraph)
+                fingerprints.add(fingerprint)
+                if fingerprint not in self.previous_results['paragraphs']:
+                    paragraphs.append(paragraph)
+            num_paragraphs += len(data['paragraphs'])
+            num_changed_paragraphs += len(paragraphs)
+            if paragraphs or data['title'] not in self.previous_results['titles']:
+                changed_data.append({'title': data['title'], 'paragraphs': paragraphs})
+                num_changed_articles += 1
+        num_removed = len(set(self.previous_results['paragraphs']) - fingerprints)
+        logging.info('Incremental run: {} new or changed paragraphs out of {} in {} articles, {} paragraphs '
+                     'reused, {} removed since the previous run'.format(num_changed_paragraphs, num_paragraphs,
+                                                                        num_changed_articles,
+                                                                        num_paragraphs - num_changed_paragraphs,
+                                                                        num_removed))
+        return {'version': content['version'], 'data': changed_data}
+
+    def title_translation(self, title):
+        if title in self.previous_results['titles']:
+            title_translated = self.previous_results['titles'][title]
         else:
-            logging.info('Use previously content translations and alignments')
-            with open(content_translations_alignments_file, 'rb') as fn:
-                self.content_translations_alignments = pickle.load(fn)
+            title_translated = self.content_translations_alignments[title]['translation']
+        if self.incremental:
+            self.results['titles'][title] = title_translated
+        return title_translated
+
+    # Results of a paragraph: its cleaned paragraph and retrieval stats by output variant and the strategies of its
+    # answers, reused from the previous run in incremental mode when the paragraph has not changed
+    def paragraph_results(self, paragraph):
+        fingerprint = self.paragraph_fingerprint(paragraph) if self.incremental else None
+        results = self.previous_results['paragraphs'].get(fingerprint)
+        if results is None:
+            stats = {from_alignment: {'total_answers': 0, 'total_correct_answers': 0,
+                                      'total_correct_plausible_answers': 0}
+                     for from_alignment in self.output_variants}
+            strategies = []
+            paragraphs_cleaned = self.translate_retrieve_paragraph(paragraph, stats, strategies)
+            results = {'paragraphs': paragraphs_cleaned, 'stats': stats, 'strategies': strategies}
+        if self.incremental:
+            self.results['paragraphs'][fingerprint] = results
+        return results
+
+    def write_manifest(self):
+        with tr_io.atomic_open(self.manifest_file, 'wb') as fn:
+            pickle.dump({'settings': self.settings(), 'results': self.results}, fn)
+
+    # Translate a context and compute its alignment with the translation
+    def translate_context(self, context):
+        context_sentences = self.context_sentences(context)
+        context_sentences_translated = [self.content_translations_alignments[s]['translation']
+                                        for s in context_sentences]
+        context_translated = ' '.join(context_sentences_translated)
+        # Shift the sentence alignments by the number of tokens of the previous sentences
+        sentence_lengths = [(len(utils.token_offsets(s, self.lang_source)),
+                             len(utils.token_offsets(t, self.lang_target)))
+                            for s, t in zip(context_sentences, context_sentences_translated)]
+        context_alignment_tok = squad_utils.compute_context_alignment(
+            [self.content_translations_alignments[s]['alignment']
+             for s in context_sentences],
+            sentence_lengths)
+        return context_translated, context_alignment_tok
+
+    # Retrieve the translation of a list of answers in the context translated.
+    # Return the answer translated, its start and the strategy that retrieved it for each answer.
+    # The alignment fallback is computed when any of the output variants uses it
+    def retrieve_answers(self, answers, context, context_translated, context_alignment_tok):
+        retrieve_from_alignment = any(self.output_variants)
+        results = []
+        for answer in answers:
+            answer_translated = self.content_translations_alignments[answer['text']]['translation']
+            results.append(squad_utils.retrieve_answer_translated(answer,
+                                                                  answer_translated,
+                                                                  context,
+                                                                  context_translated,
+                                                                  context_alignment_tok,
+                                                                  retrieve_from_alignment,
+                                                                  self.approximate_threshold))
+        return results
+
+    # Build the answers translated of an output variant, with or without the answers retrieved from the alignment
+    @staticmethod
+    def answers_variant(answers, results, from_alignment):
+        answers_translated = []
+        for answer, (answer_translated, answer_translated_start, strategy) in zip(answers, results):
+            if strategy == squad_utils.ALIGNMENT and not from_alignment:
+                answer_translated, answer_translated_start = '', -1
+            answers_translated.append(dict(answer, text=answer_translated, answer_start=answer_translated_start))
+        return answers_translated
+
+    # Translate a paragraph, retrieve its answers and clean it from the questions without answers.
+    # Return the cleaned paragraph of each output variant, or None when there are
+    # no question-answer examples left. The strategy of every answer is appended to strategies
+    def translate_retrieve_paragraph(self, paragraph, stats, strategies=None):
+        context = paragraph['context']
+        context_translated, context_alignment_tok = self.translate_context(context)
+
+        qas_cleaned = {from_alignment: [] for from_alignment in self.output_variants}
+        for qa in paragraph['qas']:
+            question_translated = self.content_translations_alignments[qa['question']]['translation']
+
+            # Translate plausible answers for SQUAD v2.0 and answers for SQUAD v1.1 and v2.0
+            plausible = self.squad_version == 'v2.0' and qa['is_impossible']
+            answers = qa['plausible_answers'] if plausible else qa['answers']
+            results = self.retrieve_answers(answers, context, context_translated, context_alignment_tok)
+            if strategies is not None:
+                for idx_answer, (_, _, strategy) in enumerate(results):
+                    strategies.append({'id': qa['id'], 'answer': idx_answer,
+                                       'plausible': plausible, 'strategy': strategy})
+
+            for from_alignment in self.output_variants:
+                answers_translated = self.answers_variant(answers, results, from_alignment)
+                num_correct = sum(1 for a in answers_translated if a['text'])
+                stats[from_alignment]['total_answers'] += len(answers_translated)
+                if not num_correct:
+                    continue
+
+                if plausible:
+                    stats[from_alignment]['total_correct_plausible_answers'] += num_correct
+                    qas_cleaned[from_alignment].append({'question': question_translated,
+                                                        'answers': [],
+                                                        'plausible_answers': [pa for pa in answers_translated
+                                                                              if pa['text']],
+                                                        'id': qa['id'],
+                                                        'is_impossible': qa['is_impossible']})
+                else:
+                    stats[from_alignment]['total_correct_answers'] += num_correct
+                    # Take the answers text from the context translated
+                    answers_from_context = [{'text': context_translated[a['answer_start']:
+                                                                        a['answer_start'] + len(a['text'])],
+                                             'answer_start': a['answer_start']}
+                                            for a in answers_translated]
+                    qa_cleaned = {'question': question_translated,
+                                  'answers': answers_from_context,
+                                  'id': qa['id']}
+                    if self.squad_version == 'v2.0':
+                        qa_cleaned['is_impossible'] = qa['is_impossible']
+                    qas_cleaned[from_alignment].append(qa_cleaned)
+
+        # Add the paragraph only if there are non-empty question-answer examples inside
+        return {from_alignment: {'context': context_translated, 'qas': qas} if qas else None
+                for from_alignment, qas in qas_cleaned.items()}
+
+    # Name of the translated dataset with (full) or without (small) the answers retrieved from the alignment
+    def translated_file(self, from_alignment):
+        suffix = '-{}.json' if from_alignment else '-{}_small.json'
+        return os.path.join(self.output_dir,
+                            os.path.basename(self.squad_file).replace('.json', suffix.format(self.lang_target)))
 
     # Parse the SQUAD file and replace the questions, context and answers field with their translations
-    # using the content_translations_alignments
+    # using the content_translations_alignments. The paragraphs are cleaned from the empty answers
+    # in the same pass, and the input paragraphs are released once translated.
+    # All the output variants (full and small datasets) are built in the same pass as well.
 
     # For the answer translated the following two-steps logic is applied:
     # 1) Translate the answer and find them in the context translated
@@ -137,184 +474,58 @@ class SquadTranslator:
     # 2) If the previous two steps fail, optionally extract the answer from the context translated
     # using the answer start and answer end provided by the alignment
     def translate_retrieve(self):
-        with open(self.squad_file) as fn:
-            content = json.load(fn)
-
-        for data in tqdm(content['data']):
-            title = data['title']
-            data['title'] = self.content_translations_alignments[title]['translation']
-            for paragraphs in data['paragraphs']:
-                context = paragraphs['context']
-
-                context_sentences = [s for s in utils.tokenize_sentences(squad_utils.remove_line_breaks(context),
-                                                                         lang=self.lang_source)]
-
-                context_translated = ' '.join(self.content_translations_alignments[s]['translation']
-                                              for s in context_sentences)
-                context_alignment_tok = squad_utils.compute_context_alignment(
-                    [self.content_translations_alignments[s]['alignment']
-                     for s in context_sentences])
-
-                # Translate context and replace its value back in the paragraphs
-                paragraphs['context'] = context_translated
-                for qa in paragraphs['qas']:
-                    question = qa['question']
-                    question_translated = self.content_translations_alignments[question]['translation']
-                    qa['question'] = question_translated
-
-                    # Translate answers and plausible answers for SQUAD v2.0
-                    if self.squad_version == 'v2.0':
-                        if not qa['is_impossible']:
-                            for answer in qa['answers']:
-                                answer_translated = self.content_translations_alignments[answer['text']]['translation']
-                                answer_translated, answer_translated_start = \
-                                    squad_utils.extract_answer_translated(answer,
-                                                                    answer_translated,
-                                                                    context,
-                                                                    context_translated,
-                                                                    context_alignment_tok,
-                                                                    self.answers_from_alignment)
-                                answer['text'] = answer_translated
-                                answer['answer_start'] = answer_translated_start
-
-                        else:
-                            for plausible_answer in qa['plausible_answers']:
-                                plausible_answer_translated = self.content_translations_alignments[plausible_answer['text']]['translation']
-                                answer_translated, answer_translated_start = \
-                                    squad_utils.extract_answer_translated(plausible_answer,
-                                                                    plausible_answer_translated,
-                                                                    context,
-                                                                    context_translated,
-                                                                    context_alignment_tok,
-                                                                    self.answers_from_alignment)
-                                plausible_answer['text'] = answer_translated
-                                plausible_answer['answer_start'] = answer_translated_start
-
-                    # Translate answers for SQUAD v1.1
-                    else:
-                        for answer in qa['answers']:
-                            answer_translated = self.content_translations_alignments[answer['text']]['translation']
-                            answer_translated, answer_translated_start = \
-                                squad_utils.extract_answer_translated(answer,
-                                                                answer_translated,
-                                                                context,
-                                                                context_translated,
-                                                                context_alignment_tok,
-                                                                self.answers_from_alignment)
-                            answer['text'] = answer_translated
-                            answer['answer_start'] = answer_translated_start
-
-
-
-        logging.info('Cleaning and refinements...')
-        # Parse the file, create a copy of the translated version and clean it from empty answers
-        content_translated = content
-        content_cleaned = {'version': content['version'], 'data': []}
-        total_answers = 0
-        total_correct_plausible_answers = 0
-        total_correct_answers = 0
-        for idx_data, data in tqdm(enumerate(content_translated['data'])):
-            content_title = content_translated['data'][idx_data]['title']
-            content_cleaned['data'].append({'title': content_title, 'paragraphs': []})
-            for par in data['paragraphs']:
-                qas_cleaned = []
-                for idx_qa, qa in enumerate(par['qas']):
-                    question = qa['question']
-
-                    # Extract answers and plausible answers for SQUAD v2.0
-                    if self.squad_version  == 'v2.0':
-                        if not qa['is_impossible']:
-                            correct_answers = []
-                            for a in qa['answers']:
-                                total_answers += 1
-                                if a['text']:
-                                    total_correct_answers += 1
-                                    correct_answers.append(a)
-                            correct_plausible_answers = []
-                        else:
-                            correct_plausible_answers = []
-                            for pa in qa['plausible_answers']:
-                                total_answers += 1
-                                if pa['text']:
-                                    total_correct_plausible_answers += 1
-                                    correct_plausible_answers.append(pa)
-                            correct_answers = []
-
-                        # add answers and plausible answers to the content cleaned
-                        if correct_answers:
-                            content_qas_id = qa['id']
-                            content_qas_is_impossible = qa['is_impossible']
-                            correct_answers_from_context = []
-                            for a in qa['answers']:
-                                start = a['answer_start']
-                                correct_answers_from_context.append(
-                                    {'text': par['context'][start:start + len(a['text'])],
-                                     'answer_start': start})
-                            qa_cleaned = {'question': question,
-                                          'answers': correct_answers_from_context,
-                                          'id': content_qas_id,
-                                          'is_impossible': content_qas_is_impossible}
-                            qas_cleaned.append(qa_cleaned)
-                        if correct_plausible_answers and not correct_answers:
-                            content_qas_id = qa['id']
-                            content_qas_is_impossible = qa['is_impossible']
-                            correct_answers_from_context = []
-                            for a in qa['answers']:
-                                start = a['answer_start']
-                                correct_answers_from_context.append(
-                                    {'text': par['context'][start:start + len(a['text'])],
-                                     'answer_start': start})
-                            qa_cleaned = {'question': question,
-                                          'answers': correct_answers,
-                                          'plausible_answers': correct_plausible_answers,
-                                          'id': content_qas_id,
-                                          'is_impossible': content_qas_is_impossible}
-                            qas_cleaned.append(qa_cleaned)
-
-                    # Extract answers for SQUAD v1.0
-                    else:
-                        correct_answers = []
-                        for a in qa['answers']:
-                            total_answers += 1
-                            if a['text']:
-                                total_correct_answers += 1
-                                correct_answers.append(a)
-
-                        # add answers and plausible answers to the content cleaned
-                        if correct_answers:
-                            content_qas_id = qa['id']
-                            correct_answers_from_context = []
-                            for a in qa['answers']:
-                                start = a['answer_start']
-                                correct_answers_from_context.append(
-                                    {'text': par['context'][start:start + len(a['text'])],
-                                     'answer_start': start})
-                            qa_cleaned = {'question': question,
-                                          'answers': correct_answers_from_context,
-                                          'id': content_qas_id}
-                            qas_cleaned.append(qa_cleaned)
-
-                # Add the paragraph only if there are non-empty question-answer examples inside
-                if qas_cleaned:
-                    content_context = par['context']
-                    content_cleaned['data'][idx_data]['paragraphs'].append(
-                        {'context': content_context, 'qas': qas_cleaned})
-
-        # Write the content back to the translated dataset
-        if self.answers_from_alignment:
-            translated_file = os.path.join(self.output_dir,
-                                           os.path.basename(self.squad_file).replace(
-                                               '.json',
-                                               '-{}.json'.format(self.lang_target)))
-        else:
-            translated_file = os.path.join(self.output_dir,
+        content = tr_io.load_json(self.squad_file)
+        self.squad_version = content['version']
+
+        contents_cleaned = {from_alignment: {'version': content['version'], 'data': []}
+                            for from_alignment in self.output_variants}
+        stats = {from_alignment: {'total_answers': 0, 'total_correct_answers': 0, 'total_correct_plausible_answers': 0}
+                 for from_alignment in self.output_variants}
+        # Correct answers and answers of each paragraph by stratum, for the confidence interval of a sample
+        paragraph_counts = {from_alignment: defaultdict(list) for from_alignment in self.output_variants}
+        strategies_filename = os.path.join(self.output_dir,
                                            os.path.basename(self.squad_file).replace(
                                                '.json',
-                                               '-{}_small.json'.format(self.lang_target)))
-
-        with open(translated_file, 'w') as fn:
-            json.dump(content_cleaned, fn)
-
+                                               '-{}_answer_strategies.jsonl'.format(self.lang_target)))
+        with tr_io.atomic_open(strategies_filename) as fn, tr_io.JSONLinesWriter(fn) as strategies_file:
+            for idx_data, data in enumerate(tqdm(content['data'])):
+                title_translated = self.title_translation(data['title'])
+                for content_cleaned in contents_cleaned.values():
+                    content_cleaned['data'].append({'title': title_translated, 'paragraphs': []})
+                for paragraph in data['paragraphs']:
+                    results = self.paragraph_results(paragraph)
+                    for strategy in results['strategies']:
+                        strategies_file.write(strategy)
+                    stratum = (squad_utils.paragraph_stratum(paragraph, self.sample_strata['thresholds'])
+                               if self.sample_strata else None)
+                    for from_alignment, paragraph_cleaned in results['paragraphs'].items():
+                        paragraph_stats = results['stats'][from_alignment]
+                        for key, value in paragraph_stats.items():
+                            stats[from_alignment][key] += value
+                        correct = paragraph_stats['total_correct_answers']
+                        if self.squad_version == 'v2.0':
+                            correct += paragraph_stats['total_correct_plausible_answers']
+                        paragraph_counts[from_alignment][stratum].append((correct, paragraph_stats['total_answers']))
+                        if paragraph_cleaned:
+                            contents_cleaned[from_alignment]['data'][-1]['paragraphs'].append(paragraph_cleaned)
+                content['data'][idx_data] = None
+
+        if self.incremental:
+            self.write_manifest()
+
+        # Write the content back to the translated datasets
+        translated_stats = {}
+        for from_alignment, content_cleaned in contents_cleaned.items():
+            translated_file = self.translated_file(from_alignment)
+            tr_io.dump_json(content_cleaned, translated_file)
+            translated_stats[translated_file] = self.log_retrieval_stats(translated_file, stats[from_alignment],
+                                                                         paragraph_counts[from_alignment])
+        return translated_stats
+
+    def log_retrieval_stats(self, translated_file, stats, paragraph_counts=None):
+        total_answers = stats['total_answers']
+        total_correct_answers = stats['total_correct_answers']
+        total_correct_plausible_answers = stats['total_correct_plausible_answers']
         # Count correct answers and plausible answers for SQUAD v2.0
         if self.squad_version  == 'v2.0':
             total_correct = total_correct_answers + total_correct_plausible_answers
@@ -340,6 +551,13 @@ class SquadTranslator:
                                                               total_answers,
                                                               accuracy,
                                                           total_correct_answers))
+        stats['accuracy'] = accuracy
+        if self.sample_strata and paragraph_counts:
+            estimate, low, high = squad_utils.stratified_ratio_interval(paragraph_counts, self.sample_strata['sizes'])
+            stats['confidence_interval'] = (low, high)
+            logging.info('Sample estimate of the percentage of translated examples: {}% '
+                         '(95% confidence interval: {}% - {}%)'.format(estimate, *stats['confidence_interval']))
+        return stats
 
 if __name__ == "__main__":
     start = time.time()
@@ -351,9 +569,41 @@ if __name__ == "__main__":
     parser.add_argument('-output_dir', type=str, help='directory where all the generated files are stored')
     parser.add_argument('-answers_from_alignment', action='store_true',
                         help='retrieve translated answers only from the alignment')
-    parser.add_argument('-alignment_type', type=str, default='forward', help='use a given translation service')
+    parser.add_argument('-alignment_type', type=str, default=None, choices=squad_utils.ALIGNMENT_TYPES,
+                        help='alignment direction (default: the one of the alignment profile)')
+    parser.add_argument('-alignment_profile', type=str, default=squad_utils.ALIGNMENT_PROFILE,
+                        choices=squad_utils.ALIGNMENT_PROFILES,
+                        help='eflomal alignment profile: fast (HMM model, fewer iterations, forward), '
+                             'balanced (fertility model, forward) or quality (fertility model, symmetrized)')
     parser.add_argument('-batch_size', type=int, default='32', help='batch_size for the translation script '
                                                                     '(change this value in case of CUDA out-of-memory')
+    parser.add_argument('-split_delimiters', type=str, default=utils.SPLIT_DELIMITER,
+                        help='characters where the long sentences are split before translation')
+    parser.add_argument('-max_num_tokens', type=int, default=utils.MAX_NUM_TOKENS,
+                        help='sentences with at least this number of tokens are split at the split delimiters')
+    parser.add_argument('-max_segment_tokens', type=int, default=None,
+                        help='split the segments longer than this number of tokens at clause boundaries '
+                             '(set it according to the translation model)')
+    parser.add_argument('-all_outputs', action='store_true',
+                        help='write both the full (answers retrieved from the alignment too) and '
+                             'the small translated datasets in one run')
+    parser.add_argument('-devices', type=str, nargs='+', default=None,
+                        help='translation devices, each a GPU index or a CPU thread group (cpu or cpu:<cores>, '
+                             'e.g. cpu:0-3); cpus:<n> splits the CPU cores into n groups. '
+                             'The sentences are sharded among the devices (default: GPU 0)')
+    parser.add_argument('-incremental', action='store_true',
+                        help='only translate, align and retrieve the paragraphs that are new or changed since '
+                             'the previous run, reusing its results for the others')
+    parser.add_argument('-previous_manifest', type=str, default=None,
+                        help='manifest of the previous run in incremental mode '
+                             '(default: the one of the squad file in the output directory)')
+    parser.add_argument('-sample', type=int, default=None,
+                        help='only translate a deterministic sample of this number of paragraphs, stratified by '
+                             'context and answer length, and report the accuracy with its confidence interval')
+    parser.add_argument('-sample_seed', type=int, default=0, help='seed of the sample')
+    parser.add_argument('-approximate_threshold', type=float, default=None,
+                        help='match the answers not found verbatim approximately near their aligned start, with at '
+                             'least this similarity (1 - edit distance / answer length, e.g. 0.8)')
     args = parser.parse_args()
 
     # Create output directory if doesn't exist already
@@ -368,7 +618,18 @@ if __name__ == "__main__":
                                  args.output_dir,
                                  args.alignment_type,
                                  args.answers_from_alignment,
-                                 args.batch_size)
+                                 args.batch_size,
+                                 list(args.split_delimiters),
+                                 args.max_num_tokens,
+                                 args.max_segment_tokens,
+                                 args.all_outputs,
+                                 args.devices,
+                                 args.alignment_profile,
+                                 args.incremental,
+                                 args.previous_manifest,
+                                 args.sample,
+                                 args.sample_seed,
+                                 args.approximate_threshold)
 
     logging.info('Translate SQUAD textual content and compute alignments...')
     translator.translate_align_content()
@@ -1,40 +1,100 @@
 import requests
 import subprocess
 import json
+import hashlib
+import math
 import os
+import re
 import tempfile
 from sacremoses import MosesTokenizer, MosesDetokenizer
+from bisect import bisect_right
 from collections import defaultdict
 from nltk import sent_tokenize
 
 from translate_retrieve_utils import tokenize
+from translate_retrieve_utils import stream_command
+from translate_retrieve_utils import SCRIPT_DIR
+from translate_retrieve_utils import token_offsets
+from translate_retrieve_utils import count_tokens
 from translate_retrieve_utils import MAX_NUM_TOKENS
 from translate_retrieve_utils import SPLIT_DELIMITER
+from translate_retrieve_utils import CLAUSE_DELIMITERS
 from translate_retrieve_utils import LANGUAGE_ISO_MAP
 
 
 
-def split_sentences(text, lang, delimiter=SPLIT_DELIMITER, max_size=MAX_NUM_TOKENS, tokenized=True):
+def split_sentences(text, lang, delimiter=SPLIT_DELIMITER, max_size=MAX_NUM_TOKENS, tokenized=True,
+                    max_segment_size=None, clause_delimiters=CLAUSE_DELIMITERS):
     """
        Chunk sentences longer than a maximum number of words/tokens based on a delimiter character.
        This option is used only for very long sentences to avoid shorter translation than the
        original source length.
+       The delimiter can be a single character or a set of characters.
+       When max_segment_size is given, the chunks still longer than that number of tokens are
+       further split at the clause boundary (clause_delimiters) that best balances the two parts.
+       The token counts come from the cached token offsets of the sentence, so the sentence
+       is tokenized only once.
        Note that the delimiter can't be a trailing character
     """
-    text_len = len(tokenize(text, lang, return_str=True).split()) if tokenized else len(text.split())
-    if text_len >= max_size:
-        delimiter_match = delimiter + ' '
-        text_chunks = [chunk.strip() for chunk in text.split(delimiter_match) if chunk]
-        # Add the delimiter lost during chunking
-        text_chunks = [chunk + delimiter for chunk in text_chunks[:-1]] + [text_chunks[-1]]
-        return text_chunks
-    return [text]
-
-
-def tokenize_sentences(text, lang):
+    offsets = token_offsets(text, lang, tokenized)
+    if len(offsets) < max_size:
+        return [text]
+
+    delimiters = [delimiter] if isinstance(delimiter, str) else list(delimiter)
+    text_chunks = split_at_delimiters(text, delimiters)
+    if max_segment_size:
+        text_chunks = [segment
+                       for chunk in text_chunks
+                       for segment in split_clauses(chunk, text, offsets, lang, tokenized,
+                                                    max_segment_size, clause_delimiters)]
+    return text_chunks
+
+
+# Split a text at every delimiter followed by a white-space.
+# The chunks are stripped and keep their delimiter except the last one
+def split_at_delimiters(text, delimiters):
+    pieces = re.split('({}) '.format('|'.join(re.escape(d) for d in delimiters)), text)
+    chunks_delimiters = [(chunk, delimiter) for chunk, delimiter in zip(pieces[::2], pieces[1::2] + [''])
+                         if chunk]
+    # Add the delimiter lost during chunking
+    text_chunks = [chunk.strip() + delimiter for chunk, delimiter in chunks_delimiters[:-1]] + \
+                  [chunks_delimiters[-1][0].strip()]
+    return text_chunks
+
+
+# Recursively split a chunk of a sentence longer than max_segment_size tokens at
+# the clause boundary giving the most balanced parts. Chunks without clause boundaries are kept whole
+def split_clauses(chunk, text, offsets, lang, tokenized, max_segment_size, clause_delimiters):
+    chunk_start = text.find(chunk)
+    if chunk_start == -1:
+        # The chunk is not a span of the sentence: tokenize it on its own
+        chunk_offsets, chunk_start, text = token_offsets(chunk, lang, tokenized), 0, chunk
+    else:
+        chunk_offsets = offsets
+    chunk_end = chunk_start + len(chunk)
+    if count_tokens(chunk_offsets, chunk_start, chunk_end) <= max_segment_size:
+        return [chunk]
+
+    pattern = '[{}] '.format(''.join(re.escape(d) for d in clause_delimiters))
+    best_split, best_size = None, None
+    for match in re.finditer(pattern, chunk):
+        split = chunk_start + match.start() + 1
+        size = max(count_tokens(chunk_offsets, chunk_start, split), count_tokens(chunk_offsets, split, chunk_end))
+        if best_size is None or size < best_size:
+            best_split, best_size = split, size
+    if best_split is None:
+        return [chunk]
+
+    left, right = text[chunk_start:best_split].strip(), text[best_split:chunk_end].strip()
+    return split_clauses(left, text, chunk_offsets, lang, tokenized, max_segment_size, clause_delimiters) + \
+        split_clauses(right, text, chunk_offsets, lang, tokenized, max_segment_size, clause_delimiters)
+
+
+def tokenize_sentences(text, lang, delimiter=SPLIT_DELIMITER, max_size=MAX_NUM_TOKENS, max_segment_size=None):
     sentences = [chunk
                  for sentence in sent_tokenize(text, LANGUAGE_ISO_MAP[lang])
-                 for chunk in split_sentences(sentence, lang)]
+                 for chunk in split_sentences(sentence, lang, delimiter, max_size,
+                                              max_segment_size=max_segment_size)]
     return sentences
 
 
@@ -220,9 +280,22 @@ def get_src2tran_alignment_char(alignment, source, translation):
     return src2tran_alignment_char_min_tran_index
 
 
-# Convert a set of sentence alignments into one document alignment
-def compute_context_alignment(sentence_alignments):
-    if isinstance(sentence_alignments, list) and len(sentence_alignments) > 1:
+# Convert a set of sentence alignments into one document alignment.
+# When the number of source and translation tokens of each sentence (i.e. the split points of the
+# context) are given, the token indexes are shifted by the length of the previous sentences.
+# Otherwise, the shift is the maximum aligned index, which is wrong when the last tokens are not aligned
+def compute_context_alignment(sentence_alignments, sentence_lengths=None):
+    if sentence_lengths is not None and len(sentence_alignments) > 1:
+        shifted_alignments = []
+        shift_src, shift_tran = 0, 0
+        for sent_alignment, (source_len, translation_len) in zip(sentence_alignments, sentence_lengths):
+            for src_tran_idx in sent_alignment.split():
+                src_idx, tran_idx = src_tran_idx.split('-')
+                shifted_alignments.append('{}-{}'.format(int(src_idx) + shift_src, int(tran_idx) + shift_tran))
+            shift_src += source_len
+            shift_tran += translation_len
+        context_alignment = ' '.join(shifted_alignments)
+    elif isinstance(sentence_alignments, list) and len(sentence_alignments) > 1:
         def get_max_src_tgt_token_index(sentence_alignment):
             src_token_index = [int(src_tgt_idx.split('-')[0]) for src_tgt_idx in sentence_alignment.split()]
             tran_token_index = [int(src_tran_idx.split('-')[1]) for src_tran_idx in sentence_alignment.split()]
@@ -297,9 +370,135 @@ def extract_answer_translated_from_alignment(answer_text, answer_start,
     return answer_translated, answer_translated_start
 
 
+# Approximate matching of the answers translated not found verbatim: the answer is searched in a window
+# of the context translated from APPROXIMATE_WINDOW chars before its aligned start to APPROXIMATE_WINDOW chars
+# after its aligned end. Answers shorter than APPROXIMATE_MIN_LENGTH chars are only matched exactly
+APPROXIMATE_WINDOW = 50
+APPROXIMATE_MIN_LENGTH = 4
+
+
+# Bit-parallel (Myers) edit distances of a pattern to the substrings of a text ending at each position
+# (distances[end] for text[start:end], the best start), or with anchored to the prefixes of the text
+# (distances[end] for text[:end])
+def edit_distances(pattern, text, anchored=False):
+    length = len(pattern)
+    mask = (1 << length) - 1
+    last = 1 << (length - 1)
+    peq = {}
+    for index, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << index)
+    pv, mv, distance = mask, 0, length
+    distances = [distance]
+    for char in text:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = ((ph << 1) | anchored) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        distances.append(distance)
+    return distances
+
+
+# Find the substring of a text with the minimum edit distance to a pattern. Among the substrings with
+# that distance, the one with the length closest to the pattern length, then the closest to position, is chosen.
+# Return the distance, the start and the end of the substring
+def approximate_search(pattern, text, position=0):
+    distances = edit_distances(pattern, text)
+    distance = min(distances)
+    spans = []
+    for end, end_distance in enumerate(distances):
+        if end_distance != distance:
+            continue
+        # The starts of the substrings ending at end with that distance, from the distances of the reversed
+        # pattern to the prefixes of the reversed text
+        head = max(0, end - len(pattern) - distance)
+        prefix_distances = edit_distances(pattern[::-1], text[head:end][::-1], anchored=True)
+        spans.extend((end - size, end) for size, size_distance in enumerate(prefix_distances)
+                     if size_distance == distance)
+    start, end = min(spans, key=lambda span: (abs(span[1] - span[0] - len(pattern)), abs(span[0] - position)))
+    return distance, start, end
+
+
+# Retrieve the answer translated from a window of the context translated around its aligned start,
+# allowing differences such as inflections, articles or punctuation. The match is snapped to whole words.
+# Return the answer and its start, or an empty answer and -1 when the similarity of the best match
+# (1 - edit distance / answer length, case insensitive) is below the threshold
+def extract_answer_translated_approximate(answer_translated, context_translated, answer_translated_start,
+                                          threshold, window=APPROXIMATE_WINDOW):
+    pattern = answer_translated.strip().lower()
+    if len(pattern) < APPROXIMATE_MIN_LENGTH or answer_translated_start < 0:
+        return '', -1
+    window_start = max(0, answer_translated_start - window)
+    window_end = answer_translated_start + len(pattern) + window
+    distance, start, end = approximate_search(pattern, context_translated[window_start:window_end].lower(),
+                                              answer_translated_start - window_start)
+    if 1 - distance / len(pattern) < threshold:
+        return '', -1
+
+    start, end = snap_to_words(context_translated, window_start + start, window_start + end)
+    if start == end:
+        return '', -1
+    return context_translated[start:end], start
+
+
+# Extend a span of a text to the whole words cut at its edges, or drop them when the span covers
+# less than half of their chars (e.g. the end of the word before an article replaced in the answer)
+def snap_to_words(text, start, end):
+    if 0 < start < end and text[start - 1].isalnum() and text[start].isalnum():
+        word_start, word_end = start, start
+        while word_start > 0 and text[word_start - 1].isalnum():
+            word_start -= 1
+        while word_end < end and text[word_end].isalnum():
+            word_end += 1
+        start = word_start if 2 * (word_end - start) >= word_end - word_start else word_end
+    if start < end < len(text) and text[end - 1].isalnum() and text[end].isalnum():
+        word_start, word_end = end, end
+        while word_start > start and text[word_start - 1].isalnum():
+            word_start -= 1
+        while word_end < len(text) and text[word_end].isalnum():
+            word_end += 1
+        end = word_end if 2 * (end - word_start) >= word_end - word_start else word_start
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+# Strategies used to retrieve an answer translated from the context translated
+EXACT_MATCH_NEAR_ALIGNMENT = 'exact_near_alignment'
+EXACT_MATCH = 'exact'
+APPROXIMATE_MATCH = 'approximate'
+ALIGNMENT = 'alignment'
+NOT_FOUND = 'not_found'
+
+
 # This function extract the answer from a given context
 def extract_answer_translated(answer, answer_translated, context, context_translated, context_alignment_tok,
-                              retrieve_answers_from_alignment):
+                              retrieve_answers_from_alignment, approximate_threshold=None):
+    answer_translated, answer_translated_start, _ = retrieve_answer_translated(answer, answer_translated,
+                                                                               context, context_translated,
+                                                                               context_alignment_tok,
+                                                                               retrieve_answers_from_alignment,
+                                                                               approximate_threshold)
+    return answer_translated, answer_translated_start
+
+
+# This function extract the answer from a given context and also returns the strategy that retrieved it.
+# Since the alignment is only the last fallback of the matching, the result obtained with
+# retrieve_answers_from_alignment is also the result without it unless the strategy is ALIGNMENT.
+# With an approximate_threshold, the answers not found verbatim are matched approximately near
+# their aligned start before falling back to the alignment
+def retrieve_answer_translated(answer, answer_translated, context, context_translated, context_alignment_tok,
+                               retrieve_answers_from_alignment, approximate_threshold=None):
     # First, compute the src2tran_alignment_char
     context_alignment_char = get_src2tran_alignment_char(context_alignment_tok, context, context_translated)
 
@@ -332,6 +531,7 @@ def extract_answer_translated(answer, answer_translated, context, context_transl
                                                                   answer_translated_start_shifted)
         answer_translated_end = answer_translated_start + len(answer_translated)
         answer_translated = context_translated[answer_translated_start: answer_translated_end]
+        strategy = EXACT_MATCH_NEAR_ALIGNMENT
 
     # 1.2) Find the answer_translated in the context_translated from the beginning of the text
     elif context_translated.lower().find(answer_translated.lower(),
@@ -341,28 +541,48 @@ def extract_answer_translated(answer, answer_translated, context, context_transl
             answer_translated_start = context_translated.lower().find(answer_translated.lower())
             answer_translated_end = answer_translated_start + len(answer_translated)
             answer_translated = context_translated[answer_translated_start: answer_translated_end]
+            strategy = EXACT_MATCH
 
-        # 2) Retrieve the answer from the context translated using the
-        # answer start and answer end provided by the alignment
         else:
-            if retrieve_answers_from_alignment:
+            # 2) Match the answer_translated approximately in a window around its aligned start
+            approximate_answer, approximate_start = '', -1
+            if approximate_threshold:
+                approximate_answer, approximate_start = \
+                    extract_answer_translated_approximate(answer_translated, context_translated,
+                                                          answer_translated_start, approximate_threshold)
+            if approximate_answer:
+                answer_translated, answer_translated_start = approximate_answer, approximate_start
+                strategy = APPROXIMATE_MATCH
+
+            # 3) Retrieve the answer from the context translated using the
+            # answer start and answer end provided by the alignment
+            elif retrieve_answers_from_alignment:
                 answer_translated, answer_translated_start = \
                     extract_answer_translated_from_alignment(answer_text, answer_start, context,
                                                              context_translated, context_alignment_char)
+                strategy = ALIGNMENT
             else:
                 answer_translated = ''
                 answer_translated_start = -1
+                strategy = NOT_FOUND
 
     # No answer translated found
     else:
         answer_translated = ''
         answer_translated_start = -1
+        strategy = NOT_FOUND
 
     # Post-process if the answer is not empty
     if answer_translated:
-        answer_translated = post_process_answers_translated(answer_text, answer_translated)
+        answer_processed = post_process_answers_translated(answer_text, answer_translated)
+        # The approximate match may be longer than the answer kept (e.g. an article replaced by another word)
+        if strategy == APPROXIMATE_MATCH:
+            answer_translated_start += max(0, answer_translated.find(answer_processed))
+        answer_translated = answer_processed
+    else:
+        strategy = NOT_FOUND
 
-    return answer_translated, answer_translated_start
+    return answer_translated, answer_translated_start, strategy
 
 
 # TRANSLATING
@@ -399,34 +619,137 @@ def post_process_translation(source, translation, punctuation=PUNCTUATION):
 
 
 # COMPUTE ALIGNMENT
+ALIGNMENT_SCRIPT = os.path.join(SCRIPT_DIR, '..', 'alignment', 'compute_alignment.sh')
+# eflomal profiles of compute_alignment.sh, from the fastest to the most accurate
+ALIGNMENT_PROFILES = ['fast', 'balanced', 'quality']
+ALIGNMENT_PROFILE = 'balanced'
+ALIGNMENT_TYPES = ['forward', 'reverse', 'symmetric']
+
+
+# Stream the sentence pairs to the alignment script and yield the alignments in order.
+# The translated sentences can be an iterator (e.g. the translations as they are produced):
+# the pairs are tokenized while they are sent to the script.
+# Without an alignment type, the direction is the default one of the alignment profile.
+# The priors file, when given, holds the priors already extracted for the words of the sentences
+def compute_alignment_stream(source_sentences, source_lang, translated_sentences, target_lang, alignment_type,
+                             alignment_profile=ALIGNMENT_PROFILE, priors_file=None):
+    # Tokenized text has no tabs, which separate the source and target sentences of a pair
+    sentence_pairs = ('{}\t{}'.format(tokenize(source_sentence, source_lang).replace('\t', ' '),
+                                       tokenize(translated_sentence, target_lang).replace('\t', ' '))
+                      for source_sentence, translated_sentence in zip(source_sentences, translated_sentences))
+    cmd = [ALIGNMENT_SCRIPT, '-', source_lang, '-', target_lang, alignment_type or 'default', '-',
+           alignment_profile]
+    env = dict(os.environ, PRIORS_FILE=priors_file) if priors_file else None
+    for alignment in stream_command(cmd, sentence_pairs, env):
+        yield alignment.strip()
+
+
 # Compute alignment between source and target sentences
 def compute_alignment(source_sentences, source_lang, translated_sentences, target_lang,
-                      alignment_type, file, output_dir):
-    filename = os.path.basename(file)
-    source_sentences = [tokenize(sentence, source_lang) for sentence in source_sentences]
-    translated_sentences = [tokenize(sentence, target_lang) for sentence in translated_sentences]
-
-    source_filename = os.path.join(output_dir, '{}_source_align'.format(filename))
-    with open(source_filename, 'w') as sf:
-        sf.writelines('\n'.join(s for s in source_sentences))
-
-    translation_filename = os.path.join(output_dir, '{}_target_align'.format(filename))
-    with open(translation_filename, 'w') as tf:
-        tf.writelines('\n'.join(s for s in translated_sentences))
-
-    alignment_filename = os.path.join(output_dir, 'alignment')
-    efolmal_cmd = SCRIPT_DIR + '/../alignment/compute_alignment.sh {} {} {} {} {} {}'.format(source_filename,
-                                                                                             source_lang,
-                                                                                             translation_filename,
-                                                                                             target_lang,
-                                                                                             alignment_type,
-                                                                                             alignment_filename)
-    subprocess.run(efolmal_cmd.split())
-
-    with open(alignment_filename) as af:
-        alignments = [a.strip() for a in af.readlines()]
-
-    os.remove(source_filename)
-    os.remove(translation_filename)
-    os.remove(alignment_filename)
-    return alignments
+                      alignment_type, file=None, output_dir=None, alignment_profile=ALIGNMENT_PROFILE,
+                      priors_file=None):
+    return list(compute_alignment_stream(source_sentences, source_lang, translated_sentences, target_lang,
+                                         alignment_type, alignment_profile, priors_file))
+
+
+# SAMPLING
+# The paragraphs are stratified by the length of their context and the mean length of their answers (in words),
+# each split in SAMPLE_LENGTH_BINS bins of equal size over the dataset
+SAMPLE_LENGTH_BINS = 3
+# Normal quantile of the 95% confidence intervals
+CONFIDENCE_Z = 1.96
+
+
+def paragraph_answers(paragraph):
+    return [answer['text'] for qa in paragraph['qas']
+            for answer in qa['answers'] + qa.get('plausible_answers', [])]
+
+
+# Bin thresholds splitting the values in num_bins bins of (about) the same size
+def length_thresholds(values, num_bins=SAMPLE_LENGTH_BINS):
+    values = sorted(values)
+    return [values[len(values) * i // num_bins] for i in range(1, num_bins)] if values else []
+
+
+# Thresholds of the strata of a dataset: the context length and answer length bin thresholds
+def strata_thresholds(content):
+    paragraphs = [paragraph for data in content['data'] for paragraph in data['paragraphs']]
+    return (length_thresholds([len(paragraph['context'].split()) for paragraph in paragraphs]),
+            length_thresholds([mean_answer_length(paragraph) for paragraph in paragraphs]))
+
+
+def mean_answer_length(paragraph):
+    answers = paragraph_answers(paragraph)
+    return sum(len(answer.split()) for answer in answers) / len(answers) if answers else 0
+
+
+# Stratum of a paragraph: the bins of its context length and of the mean length of its answers
+def paragraph_stratum(paragraph, thresholds):
+    context_thresholds, answer_thresholds = thresholds
+    return (bisect_right(context_thresholds, len(paragraph['context'].split())),
+            bisect_right(answer_thresholds, mean_answer_length(paragraph)))
+
+
+# Draw a deterministic stratified sample of num_paragraphs paragraphs of a SQuAD dataset.
+# The sample of each stratum is proportional to its size (largest remainders) and its paragraphs are the ones with
+# the lowest hash of the seed and their content: the same seed gives the same sample, and adding paragraphs to
+# the dataset changes the sample as little as possible. The articles keep their order and title,
+# with only their sampled paragraphs. Return the sample, the strata thresholds and the number of paragraphs
+# of each stratum in the dataset
+def sample_squad(content, num_paragraphs, seed=0):
+    paragraphs = [(idx_data, idx_paragraph, paragraph) for idx_data, data in enumerate(content['data'])
+                  for idx_paragraph, paragraph in enumerate(data['paragraphs'])]
+    thresholds = strata_thresholds(content)
+
+    strata = defaultdict(list)
+    for paragraph in paragraphs:
+        key = hashlib.blake2b('{}\t{}'.format(seed, json.dumps(paragraph[2], sort_keys=True)).encode('utf8'),
+                              digest_size=8).hexdigest()
+        strata[paragraph_stratum(paragraph[2], thresholds)].append((key, paragraph))
+
+    num_paragraphs = min(num_paragraphs, len(paragraphs))
+    quotas = {stratum: num_paragraphs * len(members) / len(paragraphs) for stratum, members in strata.items()}
+    sizes = {stratum: int(quota) for stratum, quota in quotas.items()}
+    remainders = sorted(quotas, key=lambda stratum: (sizes[stratum] - quotas[stratum], stratum))
+    for stratum in remainders[:num_paragraphs - sum(sizes.values())]:
+        sizes[stratum] += 1
+
+    sampled = set()
+    for stratum, members in strata.items():
+        sampled.update((idx_data, idx_paragraph)
+                       for _, (idx_data, idx_paragraph, _) in sorted(members)[:sizes[stratum]])
+
+    sample = {'version': content['version'], 'data': []}
+    for idx_data, data in enumerate(content['data']):
+        data_paragraphs = [paragraph for idx_paragraph, paragraph in enumerate(data['paragraphs'])
+                           if (idx_data, idx_paragraph) in sampled]
+        if data_paragraphs:
+            sample['data'].append({'title': data['title'], 'paragraphs': data_paragraphs})
+    return sample, thresholds, {stratum: len(members) for stratum, members in strata.items()}
+
+
+# Estimate in % of the proportion of correct answers from a stratified sample of paragraphs, with its confidence
+# interval. The answers of a paragraph are correlated, so the paragraph is the sampling unit: the proportion is
+# the (combined) ratio estimator of the correct answers over the answers, and its variance is the one of the
+# residuals correct - ratio * answers of the paragraphs within each stratum, with the finite population correction.
+# paragraph_counts maps each stratum to the (correct answers, answers) of its sampled paragraphs and
+# strata_sizes to its number of paragraphs in the dataset. A stratum with a single sampled paragraph adds no variance
+def stratified_ratio_interval(paragraph_counts, strata_sizes, z=CONFIDENCE_Z):
+    num_paragraphs = sum(strata_sizes.values())
+    strata = [(strata_sizes[stratum] / num_paragraphs, strata_sizes[stratum], counts)
+              for stratum, counts in paragraph_counts.items() if counts]
+    total = sum(weight * sum(answers for _, answers in counts) / len(counts) for weight, _, counts in strata)
+    if not total:
+        return 0.0, 0.0, 100.0
+    ratio = sum(weight * sum(correct for correct, _ in counts) / len(counts) for weight, _, counts in strata) / total
+    variance = 0.0
+    for weight, size, counts in strata:
+        if len(counts) < 2:
+            continue
+        residuals = [correct - ratio * answers for correct, answers in counts]
+        mean = sum(residuals) / len(residuals)
+        residual_variance = sum((residual - mean) ** 2 for residual in residuals) / (len(residuals) - 1)
+        variance += weight ** 2 * (1 - len(counts) / size) * residual_variance / len(counts)
+    margin = z * math.sqrt(variance) / total
+    return (round(ratio * 100, 2), round(max(0.0, ratio - margin) * 100, 2),
+            round(min(1.0, ratio + margin) * 100, 2))
@@ -1,4 +1,3 @@
-import json
 import time
 import subprocess
 import csv
@@ -8,6 +7,7 @@ from collections import defaultdict
 import pickle
 import argparse
 import translate_retrieve_utils as utils
+import translate_retrieve_io as tr_io
 from nltk import sent_tokenize
 import logging
 import stanza
@@ -49,13 +49,15 @@ class STSBenchmarkTranslator:
                  lang_source,
                  lang_target,
                  output_dir,
-                 batch_size):
+                 batch_size,
+                 devices=None):
 
         self.sts_benchmark_file = sts_benchmark_file
         self.lang_source = lang_source
         self.lang_target = lang_target
         self.output_dir = output_dir
         self.batch_size = batch_size
+        self.devices = utils.parse_devices(devices)
 
         # initialize content_translations_alignments
         self.content_translations_alignments = defaultdict()
@@ -75,7 +77,7 @@ class STSBenchmarkTranslator:
         # Load snli content and get snli contexts
         headers = ['genre' , 'filename', 'year', 'captionID', 'score', 'sentence1', 'sentence2']
         content_lines = []
-        with open(self.sts_benchmark_file) as hn:
+        with tr_io.open_file(self.sts_benchmark_file) as hn:
             csvFile = csv.reader(hn, delimiter='|')
             for row in csvFile:
                 print('number of elements', len(row))
@@ -88,9 +90,10 @@ class STSBenchmarkTranslator:
 
         # Check if the content of STS Benchmark has been translated and aligned already
         content_translations_alignments_file = os.path.join(self.output_dir,
-                                                    '{}_content_translations_alignments.{}'.format(
+                                                    '{}_content_translations_alignments.{}{}'.format(
                                                         os.path.basename(self.sts_benchmark_file),
-                                                        self.lang_target))
+                                                        self.lang_target,
+                                                        tr_io.file_compression(self.sts_benchmark_file)))
         if not os.path.isfile(content_translations_alignments_file):
             # Extract sentence one and two.             
             sentences_one = []
@@ -108,9 +111,11 @@ class STSBenchmarkTranslator:
                 sentences_two.extend(tokenize_sentences(content['sentence2'],
                                                               lang=self.lang_source))
 
-            sentence_one_translated = utils.translate(sentences_one, self.sts_benchmark_file, self.output_dir, self.batch_size)
+            sentence_one_translated = utils.translate(sentences_one, self.sts_benchmark_file, self.output_dir, self.batch_size,
+                                                      self.devices)
             sentence_two_translated = utils.translate(sentences_two, self.sts_benchmark_file,
-                                                      self.output_dir, self.batch_size)
+                                                      self.output_dir, self.batch_size,
+                                                      self.devices)
 
             logging.info('Collected {} sentence to translate'.format(len(sentences_one)))
 
@@ -118,7 +123,8 @@ class STSBenchmarkTranslator:
                                            os.path.basename(self.sts_benchmark_file).replace(
                                            '.csv',
                                            '-{}_small.json'.format(self.lang_target)))
-            with open(translated_file, 'w') as fn:
+            # Write the lines in batches
+            with tr_io.atomic_open(translated_file) as fn, tr_io.JSONLinesWriter(fn) as writer:
                 i = 0
                 for content in tqdm(content_lines):
                     content_line = {}
@@ -134,14 +140,13 @@ class STSBenchmarkTranslator:
                     content_line['score'] = content['score']
                     content_line['year'] = content['year']
                     content_line['filename'] = content['filename']
-                    json.dump(content_line, fn)
-                    fn.write('\n')
+                    writer.write(content_line)
                     i = i + 1
 
         # Load content translated and aligned from file
         else:
             logging.info('Use previously content translations and alignments')
-            with open(content_translations_alignments_file, 'rb') as fn:
+            with tr_io.open_file(content_translations_alignments_file, 'rb') as fn:
                 self.content_translations_alignments = pickle.load(fn)
 
 
@@ -155,6 +160,10 @@ if __name__ == "__main__":
     parser.add_argument('-output_dir', type=str, help='directory where all the generated files are stored')
     parser.add_argument('-batch_size', type=int, default='32', help='batch_size for the translation script '
                                                                     '(change this value in case of CUDA out-of-memory')
+    parser.add_argument('-devices', type=str, nargs='+', default=None,
+                        help='translation devices, each a GPU index or a CPU thread group (cpu or cpu:<cores>, '
+                             'e.g. cpu:0-3); cpus:<n> splits the CPU cores into n groups. '
+                             'The sentences are sharded among the devices (default: GPU 0)')
     args = parser.parse_args()
     # Create output directory if doesn't exist already
     try:
@@ -166,7 +175,8 @@ if __name__ == "__main__":
                                  args.lang_source,
                                  args.lang_target,
                                  args.output_dir,
-                                 args.batch_size)
+                                 args.batch_size,
+                                 args.devices)
 
     logging.info('Translate STS Benchmark textual content')
     translator.translate()
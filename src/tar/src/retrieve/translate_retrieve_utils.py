@@ -2,7 +2,13 @@ import requests
 import subprocess
 import json
 import os
+import queue
+import shutil
 import tempfile
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache
 from sacremoses import MosesTokenizer, MosesDetokenizer
 
 from nltk import sent_tokenize
@@ -17,9 +23,27 @@ detokenizer_es = MosesDetokenizer(lang='es')
 
 MAX_NUM_TOKENS = 10
 SPLIT_DELIMITER = ';'
+# Clause boundaries where the segments longer than the maximum segment size are split
+CLAUSE_DELIMITERS = (';', ':', ',')
 LANGUAGE_ISO_MAP = {'en': 'english', 'es': 'spanish'}
 
+# Number of tokenized texts kept in memory. The same sentences are tokenized
+# to be split, aligned and to map the alignment to characters
+TOKENIZE_CACHE_SIZE = 1 << 18
+
+
 def tokenize(text, lang, return_str=True):
+    if return_str:
+        return _tokenize_cached(text, lang)
+    return _tokenize(text, lang, return_str=False)
+
+
+@lru_cache(maxsize=TOKENIZE_CACHE_SIZE)
+def _tokenize_cached(text, lang):
+    return _tokenize(text, lang, return_str=True)
+
+
+def _tokenize(text, lang, return_str=True):
     if lang == 'en':
         text_tok = tokenizer_en.tokenize(text, return_str=return_str, escape=False)
         return text_tok
@@ -28,6 +52,28 @@ def tokenize(text, lang, return_str=True):
         return text_tok
 
 
+# Compute the character offset of every token in the text. When the tokenizer changed
+# a token, its offset is the end of the previous token
+@lru_cache(maxsize=TOKENIZE_CACHE_SIZE)
+def token_offsets(text, lang, tokenized=True):
+    tokens = tokenize(text, lang).split() if tokenized else text.split()
+    offsets = []
+    pos = 0
+    for token in tokens:
+        idx = text.find(token, pos)
+        if idx == -1:
+            offsets.append(pos)
+        else:
+            offsets.append(idx)
+            pos = idx + len(token)
+    return tuple(offsets)
+
+
+# Count the tokens of the text[start:end] span using the token offsets of the full text
+def count_tokens(offsets, start, end):
+    return bisect_left(offsets, end) - bisect_left(offsets, start)
+
+
 def de_tokenize(text, lang):
     if not isinstance(text, list):
         text = text.split()
@@ -40,32 +86,196 @@ def de_tokenize(text, lang):
         return text_detok
 
 
-def translate(source_sentences, file, output_dir, batch_size):
+# Run a command streaming the lines to its standard input and yield the lines of its standard output
+# as soon as they are produced. A writer thread feeds the process: it blocks while the pipe is full,
+# so that the lines are produced (e.g. lazily tokenized) at the pace of the process
+def stream_command(cmd, lines, env=None):
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+                               universal_newlines=True, encoding='utf8')
+    errors = []
+
+    def write_lines():
+        try:
+            for line in lines:
+                process.stdin.write(line + '\n')
+        except BrokenPipeError:
+            # The process exited before reading all the lines: its exit status reports the error
+            pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=write_lines, daemon=True)
+    writer.start()
+    try:
+        for line in process.stdout:
+            yield line.rstrip('\n')
+        writer.join()
+        process.stdout.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+        if errors:
+            raise errors[0]
+    finally:
+        # Stop the process when the output is not fully consumed
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+# Translation devices: a GPU index or a CPU thread group ('cpu' or 'cpu:<cores>', e.g. 'cpu:0-3,8')
+DEFAULT_DEVICES = ['0']
+# Number of shards per device. The devices pull the shards from a shared queue,
+# so that a faster device translates more shards than a slower one
+SHARDS_PER_DEVICE = 4
+TRANSLATE_SCRIPT = os.path.join(SCRIPT_DIR, '..', 'nmt', 'en2es_translate.sh')
+
+
+# Parse a list of CPU cores such as '0-3,8' into a list of core indexes
+def parse_cores(cores):
+    core_list = []
+    for cores_range in cores.split(','):
+        first, _, last = cores_range.partition('-')
+        core_list.extend(range(int(first), int(last or first) + 1))
+    return core_list
+
+
+# Split the CPU cores available to this process into num_groups thread groups,
+# e.g. cpu_devices(2) -> ['cpu:0-3', 'cpu:4-7'] on an 8-core machine
+def cpu_devices(num_groups):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    num_groups = max(1, min(num_groups, len(cores)))
+    group_size, remainder = divmod(len(cores), num_groups)
+    devices, start = [], 0
+    for group in range(num_groups):
+        end = start + group_size + (group < remainder)
+        devices.append('cpu:{}'.format(','.join(str(core) for core in cores[start:end])))
+        start = end
+    return devices
+
+
+# Expand the devices given in the command line: 'cpus:<n>' stands for n CPU thread groups
+def parse_devices(devices):
+    if not devices:
+        return list(DEFAULT_DEVICES)
+    parsed_devices = []
+    for device in devices:
+        if device.startswith('cpus:'):
+            parsed_devices.extend(cpu_devices(int(device[len('cpus:'):])))
+        else:
+            parsed_devices.append(device)
+    return parsed_devices
+
+
+# Build the command and the environment translating the standard input to the standard output on a device.
+# A CPU thread group is pinned to its cores (with taskset when available) and
+# the intra-op threads of the translation are limited to the size of the group
+def translate_command(batch_size, device):
+    env = os.environ.copy()
+    device_type, _, cores = device.partition(':')
+    if device_type != 'cpu':
+        cmd = [TRANSLATE_SCRIPT, '-', '-', str(batch_size), device]
+        return cmd, env
+
+    cmd = [TRANSLATE_SCRIPT, '-', '-', str(batch_size), 'cpu']
+    if cores:
+        core_list = parse_cores(cores)
+        env['OMP_NUM_THREADS'] = env['MKL_NUM_THREADS'] = str(len(core_list))
+        if shutil.which('taskset'):
+            cmd = ['taskset', '-c', cores] + cmd
+    return cmd, env
+
+
+# Stream the sentences through the translation script on a device and yield the translations in order
+def translate_lines(source_sentences, batch_size, device):
+    cmd, env = translate_command(batch_size, device)
+    num_translated = 0
+    for translated_sentence in stream_command(cmd, source_sentences, env):
+        num_translated += 1
+        yield translated_sentence.strip()
+
+    if num_translated != len(source_sentences):
+        raise RuntimeError('Translation on device {} returned {} sentences instead of {}'.format(
+            device, num_translated, len(source_sentences)))
+
+
+# Translate the sentences and yield the translations in order as soon as they are available,
+# so that the next stages can start before the end of the translation.
+# The sentences are split into shards translated in parallel by one process per device:
+# a thread per device pulls the shards from a shared queue and the shards are yielded in order
+def translate_stream(source_sentences, batch_size, devices=None, shards_per_device=SHARDS_PER_DEVICE):
+    source_sentences = list(source_sentences)
+    devices = list(devices or DEFAULT_DEVICES)
+    if len(devices) == 1 or len(source_sentences) <= 1:
+        yield from translate_lines(source_sentences, batch_size, devices[0])
+        return
+
+    num_shards = min(len(source_sentences), len(devices) * shards_per_device)
+    shard_size = -(-len(source_sentences) // num_shards)
+    shards = queue.Queue()
+    for shard_id, start in enumerate(range(0, len(source_sentences), shard_size)):
+        shards.put((shard_id, start))
+    num_shards = shards.qsize()
+
+    translated_shards = {}
+    errors = []
+    shard_done = threading.Condition()
+    stop = threading.Event()
+
+    def device_worker(device):
+        while not stop.is_set():
+            try:
+                shard_id, start = shards.get_nowait()
+            except queue.Empty:
+                return
+            shard_start = time.time()
+            try:
+                translated_shard = list(translate_lines(source_sentences[start:start + shard_size],
+                                                        batch_size, device))
+            except Exception as e:
+                with shard_done:
+                    errors.append(e)
+                    shard_done.notify_all()
+                return
+            with shard_done:
+                translated_shards[shard_id] = translated_shard
+                shard_done.notify_all()
+            print('shard {} translated on device {} in {:.1f} s'.format(shard_id, device,
+                                                                       time.time() - shard_start))
+
+    workers = [threading.Thread(target=device_worker, args=(device,)) for device in devices]
+    for worker in workers:
+        worker.start()
+    try:
+        for shard_id in range(num_shards):
+            with shard_done:
+                shard_done.wait_for(lambda: shard_id in translated_shards or errors)
+                if errors:
+                    raise errors[0]
+                translated_shard = translated_shards.pop(shard_id)
+            yield from translated_shard
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+def translate(source_sentences, file, output_dir, batch_size, devices=None, shards_per_device=SHARDS_PER_DEVICE):
     """
-    Translate via the OpenNMT-py script
+    Translate via the OpenNMT-py script. The sentences are streamed to the script and the translations
+    read back through pipes. They are split into shards translated in parallel by one process per device
     :param source_sentences: list of sentences to translate
     :param file: file name to use for translation
     :param output_dir: output directory to use for translation
     :param batch_size: number of sentence to translate in an execution.
+    :param devices: list of devices, each a GPU index or a CPU thread group ('cpu' or 'cpu:<cores>')
+    :param shards_per_device: number of shards per device used to balance the work among the devices
     :return:
     """
     print('number of sentences:', len(source_sentences) )
     print('first sentence:', source_sentences[0] )
-    filename = os.path.basename(file)
-    source_filename = os.path.join(output_dir, '{}_source_translate'.format(filename))
-    with open(source_filename, 'w') as sf:
-        sf.writelines('\n'.join(s for s in source_sentences))
-
-    translation_filename = os.path.join(output_dir, '{}_target_translated'.format(filename))
-    en2es_translate_cmd = SCRIPT_DIR + '/../nmt/en2es_translate.sh {} {} {}'.format(source_filename,
-                                                                                    translation_filename,
-                                                                                    batch_size)
-    subprocess.run(en2es_translate_cmd.split())
-
-    with open(translation_filename) as tf:
-        translated_sentences = [s.strip() for s in tf.readlines()]
-
-    os.remove(source_filename)
-    os.remove(translation_filename)
-
-    return translated_sentences
\ No newline at end of file
+    return list(translate_stream(source_sentences, batch_size, devices, shards_per_device))